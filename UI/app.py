@@ -15,6 +15,8 @@ if str(project_root) not in sys.path:
 
 from database.auth import auth_manager
 from database.database import db
+from database.maintenance import MaintenanceScheduler
+from database.settings import MAINTENANCE_ENABLED
 from bot.theory import theory_manager
 from bot.testing import testing_manager
 
@@ -22,9 +24,18 @@ PYTHON_FILENAME = "app"
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
+db.init_app(app)
 
 PAGE_TITLE = "Система регистрации учителей и учеников"
 PAGE_ICON = "🎓"
+STUDENTS_PAGE_SIZE = 50
+NOTIFICATIONS_PAGE_SIZE = 20
+CALLS_PAGE_SIZE = 50
+
+# Фоновое обслуживание базы: просроченные записи уроков, старые уведомления, optimize/vacuum.
+# Запускается из точки входа, а не при импорте; под WSGI-сервером вызывается maintenance.start()
+# из хука запуска - файловая блокировка оставляет один работающий планировщик на все воркеры
+maintenance = MaintenanceScheduler(db)
 
 @app.before_request
 def before_request():
@@ -697,11 +708,12 @@ def api_dashboard_requests():
                 'requests': requests_list or []
             })
         elif user['role'] == 'Учитель':
-            # Для учителя - список учеников
-            students = db.get_all_students()
+            # Для учителя - первая страница каталога учеников
+            students_page = get_students_page()
             sent_requests = db.get_requests_by_teacher(user['id'])
             return jsonify({
-                'all_students': students or [],
+                'all_students': students_page['students'],
+                'next_cursor': students_page['next_cursor'],
                 'sent_requests': sent_requests or []
             })
         else:
@@ -710,6 +722,38 @@ def api_dashboard_requests():
         return jsonify({'error': str(e)}), 500
 
 
+def get_students_page():
+    """Страница каталога учеников по параметрам запроса"""
+    return db.get_students_directory(
+        city=request.args.get('city', '').strip() or None,
+        school=request.args.get('school', '').strip() or None,
+        class_number=request.args.get('class_number', '').strip() or None,
+        name_prefix=request.args.get('name', '').strip() or None,
+        limit=STUDENTS_PAGE_SIZE,
+        cursor=request.args.get('cursor')
+    )
+
+
+@app.route('/api/dashboard/students')
+def api_dashboard_students():
+    """Постраничный каталог учеников с фильтрами"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    try:
+        user = auth_manager.get_current_user()
+        if not user or user['role'] != 'Учитель':
+            return jsonify({'error': 'Только учителя могут просматривать каталог учеников'}), 403
+        
+        students_page = get_students_page()
+        return jsonify({
+            'students': students_page['students'],
+            'next_cursor': students_page['next_cursor']
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/dashboard/teachers')
 def api_dashboard_teachers():
     """Получение списка учителей"""
@@ -723,24 +767,19 @@ def api_dashboard_teachers():
         
         response_data = {}
         
-        # Получаем список всех учителей
-        all_teachers = db.get_teachers()
-        
-        # Фильтр по предмету (если указан)
+        # Получаем список учителей (фильтр по предмету выполняется в БД)
         subject_filter = request.args.get('subject')
         if subject_filter and subject_filter != 'Все предметы':
-            all_teachers = [t for t in all_teachers if t.get('subjects') and subject_filter in t.get('subjects', '')]
+            all_teachers = db.get_teachers(subject_filter)
+        else:
+            all_teachers = db.get_teachers()
         
         response_data['teachers'] = all_teachers or []
         
-        # Получаем список всех предметов для фильтра
-        subjects_set = set()
-        for teacher in db.get_teachers():
-            if teacher.get('subjects'):
-                # Предметы могут быть строкой с разделителями
-                subjects_list = [s.strip() for s in teacher['subjects'].split(',')]
-                subjects_set.update(subjects_list)
-        response_data['subjects'] = sorted(list(subjects_set))
+        # Список предметов для фильтра с количеством учителей
+        subject_facets = db.get_teacher_subject_facets()
+        response_data['subjects'] = [facet['subject'] for facet in subject_facets]
+        response_data['subject_counts'] = {facet['subject']: facet['count'] for facet in subject_facets}
         
         # Для ученика - показываем его учителей
         if user['role'] == 'Ученик':
@@ -761,6 +800,20 @@ def api_dashboard_teachers():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/presence/heartbeat', methods=['POST'])
+def api_presence_heartbeat():
+    """Heartbeat открытой вкладки: пользователь остаётся онлайн"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    user = auth_manager.get_current_user()
+    if not user:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+    
+    db.update_user_online_status(user['id'], True)
+    return jsonify({'success': True})
+
+
 @app.route('/api/dashboard/auto-match', methods=['POST'])
 def api_dashboard_auto_match():
     """Автоматическое прикрепление учеников к учителю"""
@@ -772,38 +825,7 @@ def api_dashboard_auto_match():
         if not user or user['role'] != 'Учитель':
             return jsonify({'error': 'Только учителя могут выполнять эту операцию'}), 403
         
-        from database.models import StudentTeacherRelation
-        from sqlalchemy.exc import IntegrityError
-        
-        # Получаем всех учеников из той же школы и города
-        all_students = db.get_all_students()
-        matched_count = 0
-        
-        for student in all_students:
-            # Проверяем совпадение города и школы
-            if (student.get('city') == user.get('city') and 
-                student.get('school') == user.get('school')):
-                # Проверяем, не связаны ли уже
-                existing_teachers = db.get_student_teachers(student['id'])
-                if not any(t['id'] == user['id'] for t in (existing_teachers or [])):
-                    # Создаем связь напрямую через базу данных
-                    try:
-                        session = db.get_session()
-                        new_relation = StudentTeacherRelation(
-                            student_id=student['id'],
-                            teacher_id=user['id']
-                        )
-                        session.add(new_relation)
-                        session.commit()
-                        matched_count += 1
-                    except IntegrityError:
-                        # Связь уже существует
-                        session.rollback()
-                    except Exception as e:
-                        print(f"[ERROR] Ошибка создания связи: {e}")
-                        session.rollback()
-                    finally:
-                        session.close()
+        matched_count = db.auto_match_students(user['id'])
         
         return jsonify({
             'success': True,
@@ -891,6 +913,112 @@ def api_requests_reject(request_id):
         return jsonify({'error': str(e)}), 500
 
 
+# ========================== API: ЗВОНКИ ==========================
+
+@app.route('/api/dashboard/calls')
+def api_dashboard_calls():
+    """Страница звонков пользователя, сгруппированная по статусу"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    try:
+        user = auth_manager.get_current_user()
+        if not user:
+            return jsonify({'error': 'Пользователь не найден'}), 404
+        
+        page = db.get_user_calls_page(
+            user['id'],
+            limit=CALLS_PAGE_SIZE,
+            cursor=request.args.get('cursor')
+        )
+        call_groups = {'active': [], 'scheduled': [], 'completed': []}
+        for call in page['calls']:
+            call_groups.setdefault(call['status'], []).append(call)
+        
+        response_data = {'call_groups': call_groups, 'next_cursor': page['next_cursor']}
+        if user['role'] == 'Учитель' and not request.args.get('cursor'):
+            response_data['students'] = db.get_teacher_students(user['id'])
+        return jsonify(response_data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# ========================== API: УВЕДОМЛЕНИЯ ==========================
+
+@app.route('/api/dashboard/notifications')
+def api_dashboard_notifications():
+    """Страница уведомлений и количество непрочитанных"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    try:
+        user = auth_manager.get_current_user()
+        if not user:
+            return jsonify({'error': 'Пользователь не найден'}), 404
+        
+        page = db.get_notifications_page(
+            user['id'],
+            limit=NOTIFICATIONS_PAGE_SIZE,
+            cursor=request.args.get('cursor')
+        )
+        return jsonify({
+            'notifications': page['notifications'],
+            'next_cursor': page['next_cursor'],
+            'unread_count': db.get_unread_notifications_count(user['id'])
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/dashboard/notifications/unread-count')
+def api_dashboard_notifications_unread_count():
+    """Количество непрочитанных уведомлений для значка"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    user = auth_manager.get_current_user()
+    if not user:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+    
+    return jsonify({'unread_count': db.get_unread_notifications_count(user['id'])})
+
+
+@app.route('/api/dashboard/notifications/<int:notification_id>/read', methods=['POST'])
+def api_dashboard_notifications_read(notification_id):
+    """Отметка уведомления как прочитанного"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    try:
+        user = auth_manager.get_current_user()
+        if not user:
+            return jsonify({'error': 'Пользователь не найден'}), 404
+        
+        success, message = db.mark_notification_read(notification_id, user['id'])
+        return jsonify({'success': success, 'message': message}), 200 if success else 404
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/dashboard/notifications/read-all', methods=['POST'])
+def api_dashboard_notifications_read_all():
+    """Отметка всех уведомлений как прочитанных"""
+    if not auth_manager.is_logged_in():
+        return jsonify({'error': 'Не авторизован'}), 401
+    
+    try:
+        user = auth_manager.get_current_user()
+        if not user:
+            return jsonify({'error': 'Пользователь не найден'}), 404
+        
+        success, result = db.mark_all_notifications_read(user['id'])
+        if success:
+            return jsonify({'success': True, 'count': result})
+        return jsonify({'success': False, 'message': result}), 500
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 # ========================== API: КАЛЬКУЛЯТОР ФОРМУЛ ==========================
 
 @app.route('/api/formulas/categories')
@@ -1012,4 +1140,6 @@ log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 if __name__ == '__main__':
     app.logger.disabled = True
+    if MAINTENANCE_ENABLED:
+        maintenance.start()
     app.run(host='0.0.0.0', port=5000, debug = False)
@@ -1,4 +1,6 @@
 // Звонки
+let callsCursor = null;
+
 function loadCalls() {
     fetch('/api/dashboard/calls')
         .then(response => response.json())
@@ -80,7 +82,11 @@ function loadCalls() {
                 html += '<div class="alert alert-info">У вас нет запланированных звонков.</div>';
             }
             
+            html += '<div id="callsMoreList"></div>';
+            html += `<button type="button" class="btn btn-link px-0" id="loadMoreCalls" onclick="loadMoreCalls()" ${data.next_cursor ? '' : 'hidden'}>Показать ещё звонки</button>`;
+            
             container.innerHTML = html;
+            callsCursor = data.next_cursor || null;
         })
         .catch(error => {
             console.error('Ошибка загрузки звонков:', error);
@@ -88,6 +94,28 @@ function loadCalls() {
         });
 }
 
+function loadMoreCalls() {
+    if (!callsCursor) {
+        return;
+    }
+    fetch(`/api/dashboard/calls?cursor=${encodeURIComponent(callsCursor)}`)
+        .then(response => response.json())
+        .then(data => {
+            const userRole = document.body.dataset.userRole || '';
+            const list = document.getElementById('callsMoreList');
+            if (list && data.call_groups) {
+                Object.keys(data.call_groups).forEach(status => {
+                    data.call_groups[status].forEach(call => {
+                        list.insertAdjacentHTML('beforeend', renderCallCard(call, status, userRole));
+                    });
+                });
+            }
+            callsCursor = data.next_cursor || null;
+            document.getElementById('loadMoreCalls').hidden = !callsCursor;
+        })
+        .catch(error => console.error('Ошибка загрузки звонков:', error));
+}
+
 function renderCallCard(call, status, userRole) {
     const participantName = userRole === 'Ученик'
         ? `${call.teacher_name} ${call.teacher_surname}`
@@ -53,3 +53,15 @@ function showTab(tabName) {
     }
 }
 
+
+// Присутствие: пока вкладка открыта, пользователь считается онлайн
+const PRESENCE_HEARTBEAT_MS = 30000;
+
+function sendPresenceHeartbeat() {
+    fetch('/api/presence/heartbeat', {method: 'POST'}).catch(() => {});
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    sendPresenceHeartbeat();
+    setInterval(sendPresenceHeartbeat, PRESENCE_HEARTBEAT_MS);
+});
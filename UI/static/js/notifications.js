@@ -1,37 +1,53 @@
 // Уведомления
+const NOTIFICATIONS_BADGE_MS = 60000;
+let notificationsCursor = null;
+
+function renderNotifications(notifications) {
+    let html = '';
+    notifications.forEach(notification => {
+        const icon = notification.is_read ? '✅' : '🔴';
+        html += `<div class="card mb-2 notification-card${notification.is_read ? ' notification-read' : ''}">
+            <div class="card-body">
+                <h5>${icon} ${notification.title} - ${notification.created_at}</h5>
+                <p>${notification.message}</p>`;
+        if (!notification.is_read) {
+            html += `<button class="btn btn-sm btn-primary" onclick="markAsRead(${notification.id})">Отметить как прочитанное</button>`;
+        }
+        html += '</div></div>';
+    });
+    return html;
+}
+
 function loadNotifications() {
     fetch('/api/dashboard/notifications')
         .then(response => response.json())
         .then(data => {
             const container = document.getElementById('notificationsContent');
+            const showAll = document.getElementById('showAll');
+            const showAllChecked = showAll ? showAll.checked : true;
             let html = '';
-            
+
             if (data.unread_count > 0) {
                 html += `<div class="alert alert-info">📬 У вас ${data.unread_count} непрочитанных уведомлений</div>`;
+                html += '<button class="btn btn-sm btn-outline-primary mb-3" onclick="markAllAsRead()">Отметить все как прочитанные</button>';
             }
-            
+
             html += '<div class="form-check mb-3">';
-            html += '<input class="form-check-input" type="checkbox" id="showAll" checked onchange="filterNotifications()">';
+            html += `<input class="form-check-input" type="checkbox" id="showAll" ${showAllChecked ? 'checked' : ''} onchange="filterNotifications()">`;
             html += '<label class="form-check-label" for="showAll">Показать все уведомления</label>';
             html += '</div>';
-            
+
             if (!data.notifications || data.notifications.length === 0) {
                 html += '<div class="alert alert-info">У вас пока нет уведомлений</div>';
             } else {
-                data.notifications.forEach(notification => {
-                    const icon = notification.is_read ? '✅' : '🔴';
-                    html += `<div class="card mb-2">
-                        <div class="card-body">
-                            <h5>${icon} ${notification.title} - ${notification.created_at}</h5>
-                            <p>${notification.message}</p>`;
-                    if (!notification.is_read) {
-                        html += `<button class="btn btn-sm btn-primary" onclick="markAsRead(${notification.id})">Отметить как прочитанное</button>`;
-                    }
-                    html += '</div></div>';
-                });
+                html += `<div id="notificationsList">${renderNotifications(data.notifications)}</div>`;
+                html += `<button type="button" class="btn btn-link px-0" id="loadMoreNotifications" onclick="loadMoreNotifications()" ${data.next_cursor ? '' : 'hidden'}>Показать ещё уведомления</button>`;
             }
-            
+
             container.innerHTML = html;
+            notificationsCursor = data.next_cursor || null;
+            setNotificationsBadge(data.unread_count);
+            filterNotifications();
         })
         .catch(error => {
             console.error('Ошибка загрузки уведомлений:', error);
@@ -39,6 +55,24 @@ function loadNotifications() {
         });
 }
 
+function loadMoreNotifications() {
+    if (!notificationsCursor) {
+        return;
+    }
+    fetch(`/api/dashboard/notifications?cursor=${encodeURIComponent(notificationsCursor)}`)
+        .then(response => response.json())
+        .then(data => {
+            const list = document.getElementById('notificationsList');
+            if (list && data.notifications) {
+                list.insertAdjacentHTML('beforeend', renderNotifications(data.notifications));
+            }
+            notificationsCursor = data.next_cursor || null;
+            document.getElementById('loadMoreNotifications').hidden = !notificationsCursor;
+            filterNotifications();
+        })
+        .catch(error => console.error('Ошибка загрузки уведомлений:', error));
+}
+
 function markAsRead(notificationId) {
     fetch(`/api/dashboard/notifications/${notificationId}/read`, {method: 'POST'})
         .then(response => response.json())
@@ -51,21 +85,60 @@ function markAsRead(notificationId) {
         });
 }
 
+function markAllAsRead() {
+    fetch('/api/dashboard/notifications/read-all', {method: 'POST'})
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                loadNotifications();
+            } else {
+                alert('Ошибка: ' + data.message);
+            }
+        });
+}
+
 function filterNotifications() {
-    const showAll = document.getElementById('showAll').checked;
-    loadNotifications();
+    const showAll = document.getElementById('showAll');
+    const showRead = !showAll || showAll.checked;
+    document.querySelectorAll('.notification-read').forEach(card => {
+        card.hidden = !showRead;
+    });
+}
+
+function setNotificationsBadge(count) {
+    const tab = document.querySelector('button[onclick="showTab(\'notifications\')"]');
+    if (!tab) {
+        return;
+    }
+    let badge = tab.querySelector('.notifications-badge');
+    if (!badge) {
+        badge = document.createElement('span');
+        badge.className = 'badge bg-danger ms-1 notifications-badge';
+        tab.appendChild(badge);
+    }
+    badge.textContent = count;
+    badge.hidden = !count;
+}
+
+function updateNotificationsBadge() {
+    fetch('/api/dashboard/notifications/unread-count')
+        .then(response => response.json())
+        .then(data => setNotificationsBadge(data.unread_count || 0))
+        .catch(() => {});
 }
 
 document.addEventListener('DOMContentLoaded', function() {
     if (document.getElementById('notifications') && document.getElementById('notifications').classList.contains('active')) {
         loadNotifications();
     }
-    
+
     const notificationsTab = document.querySelector('button[onclick="showTab(\'notifications\')"]');
     if (notificationsTab) {
         notificationsTab.addEventListener('click', function() {
             setTimeout(loadNotifications, 100);
         });
+        // Значок обновляется по счётчику, без загрузки списка
+        updateNotificationsBadge();
+        setInterval(updateNotificationsBadge, NOTIFICATIONS_BADGE_MS);
     }
 });
-
@@ -1,6 +1,77 @@
 // Заявки
+let studentsCursor = null;
+let studentFilters = {name: '', city: '', school: '', class_number: ''};
+
+function studentFiltersQuery() {
+    const params = new URLSearchParams();
+    Object.entries(studentFilters).forEach(([key, value]) => {
+        if (value) {
+            params.set(key, value);
+        }
+    });
+    return params;
+}
+
+function renderStudentFilters() {
+    let html = '<form class="row g-2 mb-3" onsubmit="applyStudentFilters(event)">';
+    html += '<div class="col-md-3"><input class="form-control" id="studentFilterName" placeholder="Имя или фамилия"></div>';
+    html += '<div class="col-md-3"><input class="form-control" id="studentFilterCity" placeholder="Город"></div>';
+    html += '<div class="col-md-3"><input class="form-control" id="studentFilterSchool" placeholder="Школа"></div>';
+    html += '<div class="col-md-2"><input class="form-control" id="studentFilterClass" placeholder="Класс"></div>';
+    html += '<div class="col-md-1"><button type="submit" class="btn btn-outline-primary w-100">Найти</button></div>';
+    html += '</form>';
+    return html;
+}
+
+function restoreStudentFilters() {
+    const fields = {name: 'studentFilterName', city: 'studentFilterCity', school: 'studentFilterSchool', class_number: 'studentFilterClass'};
+    Object.entries(fields).forEach(([key, id]) => {
+        const input = document.getElementById(id);
+        if (input) {
+            input.value = studentFilters[key];
+        }
+    });
+}
+
+function renderStudentOptions(students) {
+    return students.map(student =>
+        `<option value="${student.id}">${student.first_name} ${student.last_name} (${student.email})</option>`
+    ).join('');
+}
+
+function applyStudentFilters(event) {
+    event.preventDefault();
+    studentFilters = {
+        name: document.getElementById('studentFilterName').value.trim(),
+        city: document.getElementById('studentFilterCity').value.trim(),
+        school: document.getElementById('studentFilterSchool').value.trim(),
+        class_number: document.getElementById('studentFilterClass').value.trim()
+    };
+    loadRequests();
+}
+
+function loadMoreStudents() {
+    if (!studentsCursor) {
+        return;
+    }
+    const params = studentFiltersQuery();
+    params.set('cursor', studentsCursor);
+    fetch(`/api/dashboard/students?${params.toString()}`)
+        .then(response => response.json())
+        .then(data => {
+            const select = document.getElementById('studentSelect');
+            if (select && data.students) {
+                select.insertAdjacentHTML('beforeend', renderStudentOptions(data.students));
+            }
+            studentsCursor = data.next_cursor || null;
+            document.getElementById('loadMoreStudents').hidden = !studentsCursor;
+        })
+        .catch(error => console.error('Ошибка загрузки учеников:', error));
+}
+
 function loadRequests() {
-    fetch('/api/dashboard/requests')
+    const query = studentFiltersQuery().toString();
+    fetch(query ? `/api/dashboard/requests?${query}` : '/api/dashboard/requests')
         .then(response => response.json())
         .then(data => {
             const container = document.getElementById('requestsContent');
@@ -38,18 +109,20 @@ function loadRequests() {
             } else if (userRole === 'Учитель') {
                 // Для учителя - отправка заявок
                 html += '<h4>Отправка заявок ученикам</h4>';
+                html += renderStudentFilters();
                 if (!data.all_students || data.all_students.length === 0) {
-                    html += '<div class="alert alert-info">В системе нет зарегистрированных учеников.</div>';
+                    html += studentFiltersQuery().toString()
+                        ? '<div class="alert alert-info">Ученики по заданным фильтрам не найдены.</div>'
+                        : '<div class="alert alert-info">В системе нет зарегистрированных учеников.</div>';
                 } else {
                     html += '<form id="sendRequestForm" onsubmit="sendRequest(event)">';
                     html += '<div class="mb-3">';
                     html += '<label class="form-label">Выберите ученика:</label>';
                     html += '<select class="form-select" id="studentSelect" required>';
                     html += '<option value="">-- Выберите ученика --</option>';
-                    data.all_students.forEach(student => {
-                        html += `<option value="${student.id}">${student.first_name} ${student.last_name} (${student.email})</option>`;
-                    });
+                    html += renderStudentOptions(data.all_students);
                     html += '</select>';
+                    html += `<button type="button" class="btn btn-link px-0" id="loadMoreStudents" onclick="loadMoreStudents()" ${data.next_cursor ? '' : 'hidden'}>Показать ещё учеников</button>`;
                     html += '</div>';
                     html += '<div class="mb-3">';
                     html += '<label class="form-label">Сообщение (необязательно):</label>';
@@ -77,6 +150,8 @@ function loadRequests() {
             }
             
             container.innerHTML = html;
+            studentsCursor = data.next_cursor || null;
+            restoreStudentFilters();
         })
         .catch(error => {
             console.error('Ошибка загрузки заявок:', error);
@@ -47,7 +47,7 @@ class AuthManager:
     def login_user(user_data):
         """Вход пользователя в систему"""
         try:
-            # Обновляем статус онлайн при входе
+            # Отмечаем присутствие при входе; в БД статус записывается пакетно
             db.update_user_online_status(user_data['id'], True)
         except Exception as e:
             print(f"Ошибка обновления статуса онлайн: {e}")
@@ -72,7 +72,7 @@ class AuthManager:
             user = session.get(SESSION_STATE_KEY, {}).get('user_data')
         
         try:
-            # Обновляем статус офлайн при выходе
+            # Снимаем присутствие при выходе; в БД статус записывается пакетно
             if user and user.get('id'):
                 db.update_user_online_status(user['id'], False)
         except Exception as e:
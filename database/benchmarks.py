@@ -0,0 +1,374 @@
+"""
+Нагрузочные замеры для слоя базы данных
+
+Запуск: python -m database.benchmarks [имя замера ...]
+Замеры выполняются на временных базах данных.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from sqlalchemy import create_engine, text
+from database.engine import create_sqlite_engine
+
+
+def _temp_db_url(directory, name):
+    """URL временной базы SQLite"""
+    return f"sqlite:///{Path(directory) / name}"
+
+
+def _throughput(operations, seconds):
+    """Операций в секунду"""
+    return operations / seconds if seconds > 0 else 0.0
+
+
+# ==================== PRAGMA-профиль ====================
+
+def _pragmas_workload(engine, rows, duration):
+    """Запись и чтение одиночных строк, как при входе пользователя"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, is_online BOOLEAN)"
+        ))
+        conn.execute(
+            text("INSERT INTO users (id, email, is_online) VALUES (:id, :email, 0)"),
+            [{'id': i, 'email': f'user{i}@example.com'} for i in range(1, rows + 1)]
+        )
+
+    # Запись: каждая смена статуса - отдельная транзакция
+    writes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE users SET is_online = NOT is_online WHERE id = :id"),
+                {'id': writes % rows + 1}
+            )
+        writes += 1
+    write_rate = _throughput(writes, time.perf_counter() - start)
+
+    # Чтение: точечные выборки по первичному ключу
+    reads = 0
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        while time.perf_counter() - start < duration:
+            conn.execute(text("SELECT email FROM users WHERE id = :id"), {'id': reads % rows + 1}).fetchone()
+            reads += 1
+    read_rate = _throughput(reads, time.perf_counter() - start)
+
+    # Смешанная нагрузка: читатель в отдельном потоке, пока идёт запись
+    stop = threading.Event()
+    mixed_reads = [0]
+
+    def reader():
+        with engine.connect() as conn:
+            while not stop.is_set():
+                conn.execute(text("SELECT COUNT(*) FROM users WHERE is_online = 1")).scalar()
+                conn.commit()
+                mixed_reads[0] += 1
+
+    thread = threading.Thread(target=reader, daemon=True)
+    mixed_writes = 0
+    start = time.perf_counter()
+    thread.start()
+    while time.perf_counter() - start < duration:
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE users SET is_online = NOT is_online WHERE id = :id"),
+                {'id': mixed_writes % rows + 1}
+            )
+        mixed_writes += 1
+    stop.set()
+    thread.join()
+    elapsed = time.perf_counter() - start
+
+    engine.dispose()
+    return {
+        'writes/s': write_rate,
+        'reads/s': read_rate,
+        'mixed writes/s': _throughput(mixed_writes, elapsed),
+        'mixed reads/s': _throughput(mixed_reads[0], elapsed),
+    }
+
+
+def benchmark_pragmas(rows=10000, duration=2.0):
+    """Пропускная способность SQLite со стандартными настройками и с профилем PRAGMA"""
+    with tempfile.TemporaryDirectory() as directory:
+        stock = create_engine(_temp_db_url(directory, 'stock.db'))
+        tuned = create_sqlite_engine(_temp_db_url(directory, 'tuned.db'))
+        results = {
+            'stock': _pragmas_workload(stock, rows, duration),
+            'tuned': _pragmas_workload(tuned, rows, duration),
+        }
+
+    print(f"PRAGMA-профиль ({rows} строк, {duration} с на замер)")
+    print(f"{'метрика':<16}{'stock':>12}{'tuned':>12}{'x':>8}")
+    for metric in results['stock']:
+        before, after = results['stock'][metric], results['tuned'][metric]
+        ratio = after / before if before else 0.0
+        print(f"{metric:<16}{before:>12.0f}{after:>12.0f}{ratio:>8.2f}")
+    return results
+
+
+# ==================== Статистика по классу ====================
+
+def _timed(func, repeat):
+    """Среднее время вызова в миллисекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def benchmark_statistics(students=30, assignments=100, repeat=20):
+    """Время отчётов get_class_statistics и get_assignment_statistics"""
+    from database.database import Database
+    from database.models import User, ClassAssignment, AssignmentTarget, AssignmentSubmission
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = Database(_temp_db_url(directory, 'statistics.db'))
+        session = database.get_session()
+        teacher = User(email='teacher@example.com', email_normalized='teacher@example.com',
+                       password_hash='', first_name='Учитель', last_name='Тестовый', role='Учитель')
+        session.add(teacher)
+        session.flush()
+        student_rows = [
+            User(email=f'student{i}@example.com', email_normalized=f'student{i}@example.com',
+                 password_hash='', first_name=f'Ученик{i}', last_name='Тестовый', role='Ученик',
+                 city='Москва', school='Школа №1', class_number='10А')
+            for i in range(students)
+        ]
+        assignment_rows = [
+            ClassAssignment(teacher_id=teacher.id, title=f'Задание {i}', target_city='Москва',
+                            target_school='Школа №1', target_class='10А')
+            for i in range(assignments)
+        ]
+        session.add_all(student_rows + assignment_rows)
+        session.flush()
+        session.add_all([
+            AssignmentTarget(assignment_id=a.id, city='Москва', school='Школа №1', class_number='10А')
+            for a in assignment_rows
+        ] + [
+            AssignmentSubmission(assignment_id=a.id, student_id=s.id, score=i % 10, max_score=10,
+                                 percentage=(i % 10) * 10, time_spent=60 + i % 120)
+            for i, (a, s) in enumerate((a, s) for a in assignment_rows for s in student_rows)
+        ])
+        session.commit()
+        teacher_id, assignment_id = teacher.id, assignment_rows[0].id
+        session.close()
+
+        class_ms = _timed(lambda: database.get_class_statistics(teacher_id, class_number='10А'), repeat)
+        assignment_ms = _timed(lambda: database.get_assignment_statistics(assignment_id), repeat)
+        database.engine.dispose()
+
+    print(f"Статистика ({students} учеников, {assignments} заданий)")
+    print(f"get_class_statistics:      {class_ms:8.2f} мс")
+    print(f"get_assignment_statistics: {assignment_ms:8.2f} мс")
+    return {'class_ms': class_ms, 'assignment_ms': assignment_ms}
+
+
+# ==================== Сжатие JSON ====================
+
+def _sample_questions(seed, count=20):
+    """JSON теста, похожий на сгенерированный: варианты ответов и объяснения"""
+    return json.dumps([
+        {
+            'question': f"Вопрос {seed}-{i}: вычислите значение выражения и выберите верный ответ",
+            'options': [f"Вариант {chr(1040 + k)}: {seed * i + k}" for k in range(4)],
+            'answer': f"Вариант А: {seed * i}",
+            'explanation': "Раскроем скобки, приведём подобные слагаемые и подставим значение переменной. " * 3,
+        }
+        for i in range(count)
+    ], ensure_ascii=False)
+
+
+def _db_size(engine, path):
+    """Размер файла базы после VACUUM в килобайтах"""
+    from database.migrations import vacuum
+    vacuum(engine)
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    return os.path.getsize(path) / 1024
+
+
+def benchmark_compression(assignments=2000, repeat=500):
+    """Размер базы и время get_assignment_by_id до и после сжатия questions_json"""
+    from database.database import Database
+    from database.migrations import recompress_json_columns
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'compression.db'
+        database = Database(_temp_db_url(directory, path.name))
+        
+        # Строки записываются в старом формате - обычным текстом
+        with database.engine.begin() as conn:
+            teacher_id = conn.execute(text(
+                "INSERT INTO users (email, email_normalized, password_hash, first_name, last_name, role) "
+                "VALUES ('teacher@example.com', 'teacher@example.com', '', 'Учитель', 'Тестовый', 'Учитель')"
+            )).lastrowid
+            conn.execute(
+                text(
+                    "INSERT INTO class_assignments (teacher_id, title, questions_json, is_active, created_at) "
+                    "VALUES (:teacher_id, :title, :questions_json, 1, CURRENT_TIMESTAMP)"
+                ),
+                [
+                    {'teacher_id': teacher_id, 'title': f'Задание {i}', 'questions_json': _sample_questions(i)}
+                    for i in range(1, assignments + 1)
+                ]
+            )
+        
+        def read_all():
+            for i in range(repeat):
+                database.get_assignment_by_id(i % assignments + 1)
+        
+        results = {'text': {}, 'compressed': {}}
+        results['text']['size_kb'] = _db_size(database.engine, path)
+        results['text']['read_ms'] = _timed(read_all, 1) / repeat
+        recompress_json_columns(database.engine)
+        results['compressed']['size_kb'] = _db_size(database.engine, path)
+        results['compressed']['read_ms'] = _timed(read_all, 1) / repeat
+        database.engine.dispose()
+    
+    print(f"Сжатие questions_json ({assignments} заданий)")
+    print(f"{'метрика':<16}{'text':>12}{'compressed':>12}{'x':>8}")
+    for metric in results['text']:
+        before, after = results['text'][metric], results['compressed'][metric]
+        ratio = after / before if before else 0.0
+        print(f"{metric:<16}{before:>12.2f}{after:>12.2f}{ratio:>8.2f}")
+    return results
+
+
+# ==================== Сериализация строк ====================
+
+def _orm_notifications(session, user_id):
+    """Прежний путь чтения: ORM-объекты и словарь на каждый объект"""
+    from database.models import Notification
+    return [
+        {
+            'id': n.id,
+            'user_id': n.user_id,
+            'title': n.title,
+            'message': n.message,
+            'is_read': n.is_read,
+            'created_at': n.created_at.strftime('%Y-%m-%d %H:%M:%S') if n.created_at else None
+        }
+        for n in session.query(Notification).filter(
+            Notification.user_id == user_id
+        ).order_by(Notification.created_at.desc()).all()
+    ]
+
+
+def _core_notifications(session, user_id):
+    """Путь чтения Database: select() по колонкам и RowSerializer"""
+    from database.database import NOTIFICATION_ROW
+    from database.models import Notification
+    return NOTIFICATION_ROW.all(session.execute(
+        NOTIFICATION_ROW.select().where(
+            Notification.user_id == user_id
+        ).order_by(Notification.created_at.desc())
+    ))
+
+
+def benchmark_serialization(sizes=(1000, 10000), repeat=10):
+    """Время на строку: ORM-объекты против select() по колонкам с RowSerializer"""
+    from database.database import Database
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database = Database(_temp_db_url(directory, 'serialization.db'))
+        for size in sizes:
+            with database.engine.begin() as conn:
+                user_id = conn.execute(text(
+                    "INSERT INTO users (email, email_normalized, password_hash, first_name, last_name, role) "
+                    "VALUES (:email, :email, '', 'Ученик', 'Тестовый', 'Ученик')"
+                ), {'email': f'student{size}@example.com'}).lastrowid
+                conn.execute(
+                    text(
+                        "INSERT INTO notifications (user_id, title, message, is_read, created_at) "
+                        "VALUES (:user_id, :title, :message, 0, CURRENT_TIMESTAMP)"
+                    ),
+                    [
+                        {'user_id': user_id, 'title': f'Уведомление {i}', 'message': 'Новое задание от учителя'}
+                        for i in range(size)
+                    ]
+                )
+            
+            session = database.SessionLocal()
+            try:
+                assert _orm_notifications(session, user_id) == _core_notifications(session, user_id)
+                timings = {}
+                for name, read in (('orm', _orm_notifications), ('core', _core_notifications)):
+                    def run():
+                        read(session, user_id)
+                        session.expunge_all()
+                    timings[name] = _timed(run, repeat) * 1000 / size
+                results[size] = timings
+            finally:
+                session.close()
+        database.engine.dispose()
+    
+    print(f"Сериализация уведомлений (мкс на строку, {repeat} повторов)")
+    print(f"{'строк':<16}{'orm':>12}{'core':>12}{'x':>8}")
+    for size, timings in results.items():
+        ratio = timings['orm'] / timings['core'] if timings['core'] else 0.0
+        print(f"{size:<16}{timings['orm']:>12.2f}{timings['core']:>12.2f}{ratio:>8.2f}")
+    return results
+
+
+# ==================== Групповой коммит ====================
+
+def benchmark_write_buffer(writes=2000):
+    """Создание уведомлений: коммит на каждую запись против буфера группового коммита"""
+    from database.database import Database
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, buffered in (('direct', False), ('buffered', True)):
+            database = Database(_temp_db_url(directory, f'{name}.db'), write_buffer=buffered)
+            with database.engine.begin() as conn:
+                user_id = conn.execute(text(
+                    "INSERT INTO users (email, email_normalized, password_hash, first_name, last_name, role) "
+                    "VALUES ('student@example.com', 'student@example.com', '', 'Ученик', 'Тестовый', 'Ученик')"
+                )).lastrowid
+            
+            notify = database.enqueue_notification if buffered else database.create_notification
+            start = time.perf_counter()
+            for i in range(writes):
+                notify(user_id, f'Уведомление {i}', 'Новое задание от учителя')
+            if buffered:
+                database.write_buffer.stop()
+            elapsed = time.perf_counter() - start
+            
+            assert database.get_unread_notifications_count(user_id) == writes
+            results[name] = {
+                'writes/s': _throughput(writes, elapsed),
+                'commits': database.write_buffer.stats['batches'] if buffered else writes,
+            }
+            database.engine.dispose()
+    
+    print(f"Групповой коммит ({writes} уведомлений)")
+    print(f"{'метрика':<16}{'direct':>12}{'buffered':>12}{'x':>8}")
+    for metric in results['direct']:
+        before, after = results['direct'][metric], results['buffered'][metric]
+        ratio = after / before if before else 0.0
+        print(f"{metric:<16}{before:>12.0f}{after:>12.0f}{ratio:>8.2f}")
+    return results
+
+
+BENCHMARKS = {
+    'pragmas': benchmark_pragmas,
+    'statistics': benchmark_statistics,
+    'compression': benchmark_compression,
+    'serialization': benchmark_serialization,
+    'write_buffer': benchmark_write_buffer,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
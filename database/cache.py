@@ -0,0 +1,100 @@
+"""
+Кэш чтения для часто запрашиваемых данных пользователей
+
+Записи живут не дольше CACHE_TTL_SECONDS и вытесняются по LRU.
+Изменяющие методы Database явно сбрасывают затронутые записи; сброс меняет
+поколение кэша, и чтение, начатое до сброса, своё значение уже не сохранит.
+"""
+import time
+import functools
+import threading
+from collections import OrderedDict
+from database.settings import CACHE_TTL_SECONDS, CACHE_MAX_SIZE
+from logger.tracer import record_cache_access
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограниченным временем жизни записей"""
+    
+    def __init__(self, name, maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL_SECONDS):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def generation(self):
+        """Номер поколения: увеличивается при каждом сбросе"""
+        return self._generation
+    
+    def get(self, key):
+        """Значение из кэша: (найдено, значение)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                hit, value = True, entry[1]
+            else:
+                if entry is not None:
+                    del self._data[key]
+                hit, value = False, None
+        record_cache_access(self.name, hit)
+        return hit, value
+    
+    def set(self, key, value, generation=None):
+        """Сохранение значения; generation - поколение на начало чтения (после сброса не сохраняется)"""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+    
+    def invalidate(self, key):
+        """Сброс одной записи"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+    
+    def clear(self):
+        """Сброс всех записей"""
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+
+class Uncached:
+    """Значение, которое метод с @cached возвращает, но не кэширует (запасной результат при ошибке)"""
+    __slots__ = ('value',)
+    
+    def __init__(self, value):
+        self.value = value
+
+
+def cached(cache_name):
+    """
+    Декоратор метода Database: результат кэшируется по позиционным аргументам
+    
+    Возвращаемые значения разделяются между вызовами, поэтому изменять их нельзя.
+    None и Uncached(...) не кэшируются.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            cache = self.caches[cache_name]
+            hit, value = cache.get(args)
+            if hit:
+                return value
+            generation = cache.generation
+            value = func(self, *args)
+            if isinstance(value, Uncached):
+                return value.value
+            if value is not None:
+                cache.set(args, value, generation)
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,64 @@
+"""
+Прозрачное сжатие JSON-колонок (questions_json, answers_json)
+
+Сжатое значение хранится как BLOB: однобайтовый маркер формата и данные.
+Строки старого формата (обычный текст) читаются без изменений.
+"""
+import zlib
+from sqlalchemy.types import TypeDecorator, Text
+from database.settings import JSON_COMPRESSION, JSON_COMPRESSION_LEVEL, JSON_COMPRESSION_MIN_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if JSON_COMPRESSION == 'zstd' and zstandard is None:
+    print("[Codec] JSON_COMPRESSION = 'zstd', но пакет zstandard не установлен: используется zlib")
+
+# Маркеры формата в первом байте сжатого значения
+ZLIB_MARKER = b'\x01'
+ZSTD_MARKER = b'\x02'
+
+
+def compress_text(value, method=JSON_COMPRESSION, level=JSON_COMPRESSION_LEVEL,
+                  min_size=JSON_COMPRESSION_MIN_SIZE):
+    """Сжатие строки; короткие строки возвращаются как есть"""
+    if value is None or isinstance(value, bytes):
+        return value
+    data = value.encode('utf-8')
+    if len(data) < min_size:
+        return value
+    if method == 'zstd' and zstandard is not None:
+        packed = ZSTD_MARKER + zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        packed = ZLIB_MARKER + zlib.compress(data, level)
+    # Несжимаемые данные выгоднее оставить текстом
+    return packed if len(packed) < len(data) else value
+
+
+def decompress_text(value):
+    """Строка из сохранённого значения любого формата"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    marker, payload = value[:1], value[1:]
+    if marker == ZLIB_MARKER:
+        return zlib.decompress(payload).decode('utf-8')
+    if marker == ZSTD_MARKER:
+        if zstandard is None:
+            raise RuntimeError("Значение сжато zstd, но пакет zstandard не установлен")
+        return zstandard.ZstdDecompressor().decompress(payload).decode('utf-8')
+    return value.decode('utf-8')
+
+
+class CompressedJSON(TypeDecorator):
+    """Текстовая колонка с JSON, сжимаемым при записи"""
+    impl = Text
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+    
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
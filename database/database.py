@@ -1,67 +1,457 @@
-from sqlalchemy import create_engine, and_, or_, func, text
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import and_, or_, func, text, select, insert, update, delete, literal, tuple_, bindparam, type_coerce, Boolean
+from sqlalchemy.orm import sessionmaker, scoped_session, aliased
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
+from flask import g, has_app_context
+import atexit
 import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from database.settings import DATABASE_URL
+from database.settings import DATABASE_URL, MAINTENANCE_BATCH_SIZE, WRITE_BUFFER_ENABLED, PRESENCE_TTL_SECONDS
+from database.engine import create_sqlite_engine, track_statement_cache
 from database.models import *
+from database.migrations import migrate
+from database.pagination import encode_cursor, decode_cursor
+from database.serialization import RowSerializer, DATETIME_MINUTES_FORMAT
+from database.cache import TTLCache, Uncached, cached
+from database.presence import PresenceTracker
+from database.write_buffer import WriteBuffer
+from database.maintenance import media_url_path, remove_media_file
 from logger.tracer import trace
 
+# ==================== Сериализаторы строк для чтения ====================
+
+Student = aliased(User, name='student')
+Teacher = aliased(User, name='teacher')
+
+USER_BRIEF_ROW = RowSerializer(User.id, User.email, User.first_name, User.last_name, User.role)
+USER_PROFILE_ROW = RowSerializer(
+    User.id, User.email, User.first_name, User.last_name, User.role, User.city,
+    User.school, User.class_number, User.subjects, User.created_at
+)
+# Онлайн - heartbeat не старше PRESENCE_TTL_SECONDS по users.last_seen, который пишут все процессы;
+# heartbeat текущего процесса, ещё не записанные в базу, добавляет PresenceTracker.annotate
+IS_ONLINE = type_coerce(
+    and_(User.last_seen.isnot(None), User.last_seen >= func.datetime('now', f'-{PRESENCE_TTL_SECONDS} seconds')),
+    Boolean
+).label('is_online')
+
+TEACHER_ROW = RowSerializer(User.id, User.first_name, User.last_name, User.subjects, User.city, User.school, IS_ONLINE)
+STUDENT_ROW = RowSerializer(
+    User.id, User.first_name, User.last_name, User.email, User.city, User.school, User.class_number, IS_ONLINE
+)
+STUDENT_REQUEST_ROW = RowSerializer(
+    TeacherRequest.id, TeacherRequest.teacher_id, TeacherRequest.message, TeacherRequest.created_at,
+    User.first_name, User.last_name, User.subjects, User.school
+)
+PENDING_REQUEST_ROW = RowSerializer(
+    TeacherRequest.id, TeacherRequest.teacher_id, User.first_name, User.last_name, User.email, User.subjects,
+    User.school, User.city, TeacherRequest.message, TeacherRequest.created_at,
+    datetime_format=DATETIME_MINUTES_FORMAT
+)
+TEACHER_REQUEST_ROW = RowSerializer(
+    TeacherRequest.id, TeacherRequest.student_id, User.first_name, User.last_name, User.email,
+    TeacherRequest.status, TeacherRequest.message, TeacherRequest.created_at,
+    datetime_format=DATETIME_MINUTES_FORMAT
+)
+SENT_REQUEST_ROW = RowSerializer(
+    TeacherRequest.id, TeacherRequest.student_id, TeacherRequest.status, TeacherRequest.message,
+    TeacherRequest.created_at, User.first_name.label('student_name'), User.last_name.label('student_surname')
+)
+CALL_ROW = RowSerializer(
+    Call.id, Call.student_id, Call.teacher_id, Call.scheduled_time, Call.actual_start_time, Call.actual_end_time,
+    Call.duration_minutes, Call.status, Call.recording_path, Call.notes, Call.created_at,
+    Student.first_name.label('student_name'), Student.last_name.label('student_surname'),
+    Teacher.first_name.label('teacher_name'), Teacher.last_name.label('teacher_surname')
+)
+LESSON_RECORD_ROW = RowSerializer(
+    LessonRecord.id, LessonRecord.student_id, LessonRecord.teacher_id, LessonRecord.lesson_title,
+    LessonRecord.lesson_date, LessonRecord.subject, LessonRecord.video_url, LessonRecord.video_file_path,
+    LessonRecord.description, LessonRecord.homework, LessonRecord.is_auto_created, LessonRecord.call_id,
+    LessonRecord.expires_at, LessonRecord.created_at,
+    Student.first_name.label('student_name'), Student.last_name.label('student_surname'),
+    Teacher.first_name.label('teacher_name'), Teacher.last_name.label('teacher_surname')
+)
+NOTIFICATION_ROW = RowSerializer(
+    Notification.id, Notification.user_id, Notification.title, Notification.message,
+    Notification.is_read, Notification.created_at
+)
+# Список заданий учителя без description: текст нужен только карточке задания (ASSIGNMENT_ROW)
+TEACHER_ASSIGNMENT_ROW = RowSerializer(
+    ClassAssignment.id, ClassAssignment.title, ClassAssignment.subject,
+    ClassAssignment.topic, ClassAssignment.difficulty, ClassAssignment.assignment_type,
+    ClassAssignment.target_city, ClassAssignment.target_school, ClassAssignment.target_class,
+    ClassAssignment.deadline, ClassAssignment.is_active, ClassAssignment.created_at,
+    func.count(AssignmentSubmission.id).label('submissions_count'),
+    func.avg(AssignmentSubmission.percentage).label('avg_score'),
+    datetime_format=DATETIME_MINUTES_FORMAT
+)
+ASSIGNMENT_ROW = RowSerializer(
+    ClassAssignment.id, ClassAssignment.title, ClassAssignment.description, ClassAssignment.subject,
+    ClassAssignment.topic, ClassAssignment.difficulty, ClassAssignment.assignment_type,
+    ClassAssignment.questions_json, ClassAssignment.target_city, ClassAssignment.target_school,
+    ClassAssignment.target_class, ClassAssignment.deadline, ClassAssignment.is_active, ClassAssignment.created_at,
+    ClassAssignment.teacher_id, User.first_name.label('teacher_first_name'), User.last_name.label('teacher_last_name'),
+    datetime_format=DATETIME_MINUTES_FORMAT
+)
+# Ученику description показывается прямо в карточке списка, поэтому здесь он остаётся
+STUDENT_ASSIGNMENT_ROW = RowSerializer(
+    ClassAssignment.id, ClassAssignment.title, ClassAssignment.description, ClassAssignment.subject,
+    ClassAssignment.topic, ClassAssignment.difficulty, ClassAssignment.assignment_type,
+    ClassAssignment.deadline, ClassAssignment.created_at,
+    User.first_name.label('teacher_first_name'), User.last_name.label('teacher_last_name'),
+    AssignmentSubmission.id.label('submission_id'), AssignmentSubmission.score, AssignmentSubmission.max_score,
+    AssignmentSubmission.percentage, AssignmentSubmission.submitted_at,
+    datetime_format=DATETIME_MINUTES_FORMAT
+)
+SETTINGS_ROW = RowSerializer(
+    UserSettings.theme, UserSettings.font_size, UserSettings.notifications_enabled,
+    UserSettings.sound_enabled, UserSettings.language
+)
+
+# ==================== Готовые запросы ====================
+# Самые частые выборки собираются один раз: SQLAlchemy запоминает ключ кэша
+# выражения и при каждом вызове берёт уже скомпилированный SQL, подставляя только параметры
+
+USER_BY_EMAIL = USER_BRIEF_ROW.select().where(email_matches(bindparam('email'))).order_by(*EMAIL_MATCH_ORDER)
+USER_BY_ID = USER_PROFILE_ROW.select().where(User.id == bindparam('user_id'))
+USER_SETTINGS_BY_USER = SETTINGS_ROW.select().where(UserSettings.user_id == bindparam('user_id'))
+PENDING_STUDENT_REQUESTS = STUDENT_REQUEST_ROW.select().join(
+    User, TeacherRequest.teacher_id == User.id
+).where(
+    and_(TeacherRequest.student_id == bindparam('student_id'), TeacherRequest.status == 'pending')
+).order_by(TeacherRequest.created_at.desc())
+USER_NOTIFICATIONS = NOTIFICATION_ROW.select().where(
+    Notification.user_id == bindparam('user_id')
+).order_by(Notification.created_at.desc())
+UNREAD_NOTIFICATIONS_COUNT = select(User.unread_notifications).where(User.id == bindparam('user_id'))
+
+# Статистика класса: задания учителя под фильтром (NULL - без фильтра) и два сгруппированных
+# запроса по покрывающему индексу ix_assignment_submissions_stats
+CLASS_ASSIGNMENT_IDS = select(ClassAssignment.id).where(
+    ClassAssignment.teacher_id == bindparam('teacher_id'),
+    or_(bindparam('city') == None, ClassAssignment.target_city == bindparam('city')),
+    or_(bindparam('school') == None, ClassAssignment.target_school == bindparam('school')),
+    or_(bindparam('class_number') == None, select(AssignmentTarget.id).where(
+        AssignmentTarget.assignment_id == ClassAssignment.id,
+        AssignmentTarget.class_number == bindparam('class_number')
+    ).exists())
+)
+CLASS_ASSIGNMENT_STATS = select(
+    ClassAssignment.id,
+    ClassAssignment.title,
+    func.count(AssignmentSubmission.id).label('total_submissions'),
+    func.avg(AssignmentSubmission.percentage).label('avg_percentage'),
+    func.min(AssignmentSubmission.percentage).label('min_percentage'),
+    func.max(AssignmentSubmission.percentage).label('max_percentage'),
+    func.avg(AssignmentSubmission.time_spent).label('avg_time')
+).outerjoin(
+    AssignmentSubmission, AssignmentSubmission.assignment_id == ClassAssignment.id
+).where(
+    ClassAssignment.id.in_(CLASS_ASSIGNMENT_IDS)
+).group_by(
+    ClassAssignment.id
+).order_by(ClassAssignment.created_at.desc())
+# Сначала агрегаты, затем имена: users читается по строке на ученика, а не на каждый ответ
+_CLASS_STUDENT_TOTALS = select(
+    AssignmentSubmission.student_id,
+    func.count(AssignmentSubmission.id).label('total_submissions'),
+    func.sum(AssignmentSubmission.percentage).label('total_score'),
+    func.avg(AssignmentSubmission.percentage).label('avg_percentage'),
+    func.min(AssignmentSubmission.percentage).label('min_percentage'),
+    func.max(AssignmentSubmission.percentage).label('max_percentage'),
+    func.sum(AssignmentSubmission.time_spent).label('total_time')
+).where(
+    AssignmentSubmission.assignment_id.in_(CLASS_ASSIGNMENT_IDS)
+).group_by(
+    AssignmentSubmission.student_id
+).subquery()
+CLASS_STUDENT_STATS = select(
+    _CLASS_STUDENT_TOTALS, User.first_name, User.last_name, User.class_number
+).outerjoin(
+    User, User.id == _CLASS_STUDENT_TOTALS.c.student_id
+).order_by(User.first_name, User.last_name)
+
+SETTINGS_FIELDS = ('theme', 'font_size', 'notifications_enabled', 'sound_enabled', 'language')
+SETTINGS_CHOICES = {'theme': ('light', 'dark'), 'font_size': ('small', 'medium', 'large')}
+
+# Настройки пишутся одним upsert и напрямую, и через буфер: не переданное поле (NULL)
+# при вставке получает значение по умолчанию, при обновлении остаётся прежним
+SETTINGS_UPSERT = sqlite_insert(UserSettings).values(
+    user_id=bindparam('user_id'),
+    updated_at=bindparam('updated_at'),
+    **{
+        key: func.coalesce(bindparam(key), default)
+        for key, default in UserSettings.get_defaults().items()
+    }
+).on_conflict_do_update(
+    index_elements=[UserSettings.user_id],
+    set_={
+        'updated_at': bindparam('updated_at'),
+        **{key: func.coalesce(bindparam(key), getattr(UserSettings, key)) for key in SETTINGS_FIELDS}
+    }
+)
+
+# Записи для буфера группового коммита: одинаковые выражения сбрасываются одним executemany
+PRESENCE_UPDATE = update(User).where(User.id == bindparam('user_id')).values(last_seen=bindparam('last_seen'))
+NOTIFICATION_INSERT = insert(Notification)
+UNREAD_COUNTER_INCREMENT = update(User).where(User.id == bindparam('user_id')).values(
+    unread_notifications=User.unread_notifications + 1
+)
+NOTIFICATION_MARK_READ = update(Notification).where(
+    Notification.id == bindparam('notification_id'), Notification.user_id == bindparam('owner_id')
+).values(is_read=True)
+# Пересчёт вместо вычитания: повторная отметка того же уведомления в пакете не собьёт счётчик
+UNREAD_COUNTER_RECOUNT = update(User).where(User.id == bindparam('owner_id')).values(
+    unread_notifications=select(func.count(Notification.id)).where(
+        Notification.user_id == bindparam('owner_id'), Notification.is_read == False
+    ).scalar_subquery()
+)
+
+
+# ==================== Построители запросов ====================
+# Запросы с фильтрами собираются функциями; те же выражения проверяет database.diagnostics
+
+def teachers_query(subject=None):
+    """Учителя (все или по предмету)"""
+    statement = TEACHER_ROW.select().where(User.role == 'Учитель')
+    if subject:
+        statement = statement.join(
+            TeacherSubject, TeacherSubject.teacher_id == User.id
+        ).where(TeacherSubject.subject == subject)
+    return statement
+
+
+def student_teachers_query(student_id):
+    """Учителя ученика"""
+    return TEACHER_ROW.select().join(
+        StudentTeacherRelation, StudentTeacherRelation.teacher_id == User.id
+    ).where(StudentTeacherRelation.student_id == student_id)
+
+
+def teacher_students_query(teacher_id):
+    """Ученики учителя по имени"""
+    return STUDENT_ROW.select().join(
+        StudentTeacherRelation, StudentTeacherRelation.student_id == User.id
+    ).where(StudentTeacherRelation.teacher_id == teacher_id).order_by(User.first_name, User.last_name)
+
+
+def students_directory_query(city=None, school=None, class_number=None, name_prefix=None):
+    """Каталог учеников с фильтрами в порядке keyset-пагинации (first_name, last_name, id)"""
+    prefix = normalize_name(name_prefix)
+    if prefix:
+        # Диапазон по нормализованным именам вместо LIKE: без учёта регистра и по индексу.
+        # Роль уже отобрана в подзапросе; повтор условия увёл бы план на ix_users_role_name
+        statement = STUDENT_ROW.select().where(User.id.in_(name_prefix_ids(prefix)))
+    else:
+        statement = STUDENT_ROW.select().where(User.role == 'Ученик')
+    
+    if city:
+        statement = statement.where(User.city == city)
+    if school:
+        statement = statement.where(User.school == school)
+    if class_number:
+        statement = statement.where(User.class_number == class_number)
+    
+    return statement.order_by(User.first_name, User.last_name, User.id)
+
+
+def teacher_requests_query(teacher_id):
+    """Заявки учителя с данными учеников"""
+    return TEACHER_REQUEST_ROW.select().join(
+        User, TeacherRequest.student_id == User.id
+    ).where(TeacherRequest.teacher_id == teacher_id).order_by(TeacherRequest.created_at.desc())
+
+
+def user_calls_query(user_id):
+    """Звонки пользователя с именами ученика и учителя (один запрос)"""
+    return CALL_ROW.select().join(
+        Student, Call.student_id == Student.id
+    ).join(
+        Teacher, Call.teacher_id == Teacher.id
+    ).where(
+        or_(Call.student_id == user_id, Call.teacher_id == user_id)
+    ).order_by(Call.scheduled_time.desc(), Call.id.desc())
+
+
+def lesson_records_query(user_id):
+    """Записи уроков пользователя с именами обоих участников (один запрос)"""
+    return LESSON_RECORD_ROW.select().join(
+        Student, LessonRecord.student_id == Student.id
+    ).join(
+        Teacher, LessonRecord.teacher_id == Teacher.id
+    ).where(
+        or_(LessonRecord.student_id == user_id, LessonRecord.teacher_id == user_id)
+    ).order_by(LessonRecord.lesson_date.desc())
+
+
+def expired_lesson_records_query(now, limit):
+    """Пакет просроченных автоматических записей уроков с путями к видео"""
+    return select(LessonRecord.id, LessonRecord.video_file_path).where(
+        and_(LessonRecord.expires_at < now, LessonRecord.is_auto_created == True)
+    ).limit(limit)
+
+
+def notifications_page_query(user_id):
+    """Уведомления пользователя в порядке keyset-пагинации (created_at, id)"""
+    return NOTIFICATION_ROW.select().where(
+        Notification.user_id == user_id
+    ).order_by(Notification.created_at.desc(), Notification.id.desc())
+
+
+def teacher_assignments_query(teacher_id):
+    """Задания учителя с количеством ответов и средним процентом (один сгруппированный запрос)"""
+    return TEACHER_ASSIGNMENT_ROW.select().outerjoin(
+        AssignmentSubmission, AssignmentSubmission.assignment_id == ClassAssignment.id
+    ).where(
+        ClassAssignment.teacher_id == teacher_id
+    ).group_by(
+        ClassAssignment.id
+    ).order_by(ClassAssignment.created_at.desc(), ClassAssignment.id.desc())
+
+
+def student_assignments_query(student_id, city=None, school=None, class_number=None):
+    """Активные задания класса ученика с его ответом и именем учителя; questions_json не загружается"""
+    statement = STUDENT_ASSIGNMENT_ROW.select().join(
+        AssignmentTarget, AssignmentTarget.assignment_id == ClassAssignment.id
+    ).outerjoin(
+        User, User.id == ClassAssignment.teacher_id
+    ).outerjoin(
+        AssignmentSubmission, and_(
+            AssignmentSubmission.assignment_id == ClassAssignment.id,
+            AssignmentSubmission.student_id == student_id
+        )
+    ).where(
+        ClassAssignment.is_active == True
+    )
+    
+    # Адресаты ищутся по индексу (city, school, class_number); '' - любой
+    if city:
+        statement = statement.where(AssignmentTarget.city.in_([city, '']))
+    if school:
+        statement = statement.where(AssignmentTarget.school.in_([school, '']))
+    if class_number:
+        statement = statement.where(AssignmentTarget.class_number.in_([class_number, '']))
+    
+    return statement.order_by(ClassAssignment.created_at.desc())
+
+
+def assignment_submissions_query(assignment_id):
+    """Ответы на задание с данными учеников"""
+    return select(
+        AssignmentSubmission.student_id,
+        AssignmentSubmission.score,
+        AssignmentSubmission.max_score,
+        AssignmentSubmission.percentage,
+        AssignmentSubmission.time_spent,
+        AssignmentSubmission.submitted_at,
+        User.first_name,
+        User.last_name,
+        User.class_number
+    ).outerjoin(
+        User, User.id == AssignmentSubmission.student_id
+    ).where(
+        AssignmentSubmission.assignment_id == assignment_id
+    ).order_by(AssignmentSubmission.id)
+
+
 class Database:
     """Класс для работы с базой данных через SQLAlchemy ORM"""
     
-    def __init__(self):
-        """Инициализация базы данных"""
+    def __init__(self, database_url=None, write_buffer=WRITE_BUFFER_ENABLED):
+        """Инициализация базы данных; write_buffer - включить групповой коммит мелких записей"""
+        self._background = None
+        self.write_buffer = None
+        self.presence = PresenceTracker()
+        self.caches = {
+            name: TTLCache(name)
+            for name in ('user', 'teachers', 'teacher_subjects', 'student_teachers', 'teacher_students_tree')
+        }
         try:
-            self.engine = create_engine(DATABASE_URL, echo=False)
+            self.engine = track_statement_cache(create_sqlite_engine(database_url or DATABASE_URL))
             self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
             self.Session = scoped_session(self.SessionLocal)
             self.init_database()
+            if write_buffer:
+                self.write_buffer = WriteBuffer(self.engine)
+                self.write_buffer.start()
+                atexit.register(self.write_buffer.stop)
         except Exception:
             pass
     
     def init_database(self):
-        """Создание таблиц в базе данных"""
+        """Создание таблиц и применение миграций схемы"""
         try:
-            Base.metadata.create_all(bind=self.engine)
-            self.update_database_schema()
+            migrate(self.engine, Base.metadata)
             return True
         except SQLAlchemyError:
             return False
     
-    def update_database_schema(self):
-        """Обновление схемы базы данных (добавление отсутствующих столбцов)"""
-        try:
-            with self.engine.begin() as conn:
-                # Проверяем, существует ли таблица users
-                result = conn.execute(text(
-                    "SELECT name FROM sqlite_master WHERE type='table' AND name='users'"
-                ))
-                table_exists = result.fetchone() is not None
-                
-                if not table_exists:
-                    # Таблица будет создана через Base.metadata.create_all
-                    return
-                
-                # Проверяем наличие столбца is_online в таблице users
-                result = conn.execute(text("PRAGMA table_info(users)"))
-                rows = result.fetchall()
-                
-                columns = [row[1] for row in rows]  # row[1] - это имя столбца
-                
-                # Добавляем столбец is_online, если его нет
-                if 'is_online' not in columns:
-                    try:
-                        conn.execute(text("ALTER TABLE users ADD COLUMN is_online BOOLEAN DEFAULT 0"))
-                    except Exception:
-                        raise
-                        
-        except Exception:
-            pass
+    def init_app(self, app):
+        """Привязка сессии к контексту приложения Flask: одна сессия и одно подключение на запрос"""
+        app.teardown_appcontext(self.remove_request_session)
     
     def get_session(self):
-        """Получение сессии базы данных"""
-        return self.Session()
+        """Получение сессии базы данных: сессия запроса Flask или сессия потока"""
+        if not has_app_context():
+            return self.Session()
+        if 'db_session' not in g:
+            g.db_connection = self.engine.connect()
+            g.db_session = self.SessionLocal(bind=g.db_connection)
+            g.db_session_depth = 0
+        g.db_session_depth += 1
+        return g.db_session
+    
+    def release_session(self, session):
+        """Завершение работы метода с сессией"""
+        if not has_app_context() or session is not g.get('db_session'):
+            session.close()
+            return
+        g.db_session_depth -= 1
+        if g.db_session_depth == 0:
+            # Сессия запроса остаётся открытой до teardown_appcontext; незафиксированные
+            # изменения отбрасываются, а объекты устаревают, как после close()
+            session.rollback()
+    
+    def remove_request_session(self, exception=None):
+        """Закрытие сессии и подключения запроса"""
+        session = g.pop('db_session', None)
+        connection = g.pop('db_connection', None)
+        g.pop('db_session_depth', None)
+        if session is not None:
+            session.close()
+        if connection is not None:
+            connection.close()
+    
+    def invalidate_user(self, user_id):
+        """Сброс кэшированной карточки пользователя после записи в его строку users"""
+        self.caches['user'].invalidate((user_id,))
+    
+    def _buffer_write(self, *writes, user_ids=()):
+        """Запись через буфер; карточки user_ids сбрасываются после коммита пакета (Future записи)"""
+        future = self.write_buffer.add(*writes)
+        if user_ids:
+            future.add_done_callback(lambda _: [self.invalidate_user(user_id) for user_id in user_ids])
+        return future
+    
+    def invalidate_user_caches(self, user_id=None, student_id=None, teacher_id=None):
+        """Сброс кэшей, затронутых изменением пользователя или связи ученик-учитель"""
+        if user_id is not None:
+            # Пользователь может быть и в списке учителей, и в любой связи
+            self.caches['user'].invalidate((user_id,))
+            self.caches['teachers'].clear()
+            self.caches['teacher_subjects'].clear()
+            self.caches['student_teachers'].clear()
+            self.caches['teacher_students_tree'].clear()
+            return
+        if student_id is not None:
+            self.caches['student_teachers'].invalidate((student_id,))
+        else:
+            self.caches['student_teachers'].clear()
+        if teacher_id is not None:
+            self.caches['teacher_students_tree'].invalidate((teacher_id,))
+        else:
+            self.caches['teacher_students_tree'].clear()
     
     def hash_password(self, password):
         """Хеширование пароля"""
@@ -73,19 +463,16 @@ class Database:
         session = self.get_session()
         try:
             # Нормализация email 
-            email = user_data['email'].strip().lower() if user_data.get('email') else ''
+            email = normalize_email(user_data.get('email'))
             
             if not email:
                 return False, "Email не может быть пустым"
             
             # Проверка на существование пользователя с таким email
-            # Получаем всех пользователей и проверяем в Python для надежности
-            all_users = session.query(User).all()
-            for user in all_users:
-                user_email_normalized = user.email.strip().lower() if user.email else ''
-                if user_email_normalized == email:
-                    print(f"Попытка регистрации с существующим email: {email} (найден пользователь ID: {user.id}, email в БД: '{user.email}')")
-                    return False, "Пользователь с таким email уже существует"
+            user = session.query(User).filter(email_matches(email)).order_by(*EMAIL_MATCH_ORDER).first()
+            if user:
+                print(f"Попытка регистрации с существующим email: {email} (найден пользователь ID: {user.id}, email в БД: '{user.email}')")
+                return False, "Пользователь с таким email уже существует"
             
             # Хеширование пароля
             password_hash = self.hash_password(user_data['password'])
@@ -98,9 +485,12 @@ class Database:
             # Создание нового пользователя
             new_user = User(
                 email=email,
+                email_normalized=email,
                 password_hash=password_hash,
                 first_name=user_data['first_name'],
                 last_name=user_data['last_name'],
+                first_name_normalized=normalize_name(user_data['first_name']),
+                last_name_normalized=normalize_name(user_data['last_name']),
                 role=user_data['role'],
                 city=user_data.get('city', ''),
                 school=user_data.get('school', ''),
@@ -109,8 +499,15 @@ class Database:
             )
             
             session.add(new_user)
+            session.flush()
+            
+            if new_user.role == 'Учитель':
+                self._sync_teacher_subjects(session, new_user.id, subjects)
+            
             session.commit()
             user_id = new_user.id
+            self.caches['teachers'].clear()
+            self.caches['teacher_subjects'].clear()
             
             print(f"Пользователь {email} успешно зарегистрирован (ID: {user_id})")
             return True, user_id
@@ -124,51 +521,34 @@ class Database:
             print(f"Неожиданная ошибка при регистрации пользователя: {e}")
             return False, f"Ошибка: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_user_by_email(self, email):
         """Получение пользователя по email"""
         session = self.get_session()
         try:
-            email = email.strip().lower() if email else ''
+            email = normalize_email(email)
             if not email:
                 return None
             
-            all_users = session.query(User).all()
-            for u in all_users:
-                user_email_normalized = u.email.strip().lower() if u.email else ''
-                if user_email_normalized == email:
-                    return {
-                        'id': u.id,
-                        'email': u.email,
-                        'first_name': u.first_name,
-                        'last_name': u.last_name,
-                        'role': u.role
-                    }
-            return None
+            return USER_BRIEF_ROW.one(session.execute(USER_BY_EMAIL, {'email': email}).first())
         except Exception as e:
             print(f"Ошибка получения пользователя по email: {e}")
             return None
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def reset_user_password(self, email, new_password):
         """Сброс пароля пользователя"""
         session = self.get_session()
         try:
-            email = email.strip().lower() if email else ''
+            email = normalize_email(email)
             if not email:
                 return False, "Email не может быть пустым"
             
-            all_users = session.query(User).all()
-            user = None
-            for u in all_users:
-                user_email_normalized = u.email.strip().lower() if u.email else ''
-                if user_email_normalized == email:
-                    user = u
-                    break
+            user = session.query(User).filter(email_matches(email)).order_by(*EMAIL_MATCH_ORDER).first()
             
             if not user:
                 return False, "Пользователь с таким email не найден"
@@ -177,6 +557,7 @@ class Database:
             password_hash = self.hash_password(new_password)
             user.password_hash = password_hash
             session.commit()
+            self.invalidate_user(user.id)
             
             print(f"Пароль успешно сброшен для пользователя {email}")
             return True, "Пароль успешно изменен"
@@ -186,7 +567,15 @@ class Database:
             print(f"Ошибка сброса пароля: {e}")
             return False, f"Ошибка: {e}"
         finally:
-            session.close()
+            self.release_session(session)
+    
+    @staticmethod
+    def _sync_teacher_subjects(session, teacher_id, subjects):
+        """Строки teacher_subjects по строке users.subjects (в транзакции вызывающего)"""
+        session.execute(delete(TeacherSubject).where(TeacherSubject.teacher_id == teacher_id))
+        rows = [{'teacher_id': teacher_id, 'subject': subject} for subject in split_subjects(subjects)]
+        if rows:
+            session.execute(insert(TeacherSubject), rows)
     
     @trace
     def authenticate_user(self, email, password):
@@ -194,35 +583,21 @@ class Database:
         session = self.get_session()
         try:
             # Нормализация email
-            email = email.strip().lower() if email else ''
+            email = normalize_email(email)
             
             if not email:
                 return False, None
             
             password_hash = self.hash_password(password)
-            # Получаем всех пользователей и проверяем в Python для надежности
-            all_users = session.query(User).all()
-            user = None
-            for u in all_users:
-                user_email_normalized = u.email.strip().lower() if u.email else ''
-                if user_email_normalized == email and u.password_hash == password_hash:
-                    user = u
-                    break
+            row = session.execute(
+                USER_PROFILE_ROW.select().add_columns(IS_ONLINE).where(
+                    and_(email_matches(email), User.password_hash == password_hash)
+                ).order_by(*EMAIL_MATCH_ORDER)
+            ).first()
             
-            if user:
-                user_dict = {
-                    'id': user.id,
-                    'email': user.email,
-                    'first_name': user.first_name,
-                    'last_name': user.last_name,
-                    'role': user.role,
-                    'city': user.city,
-                    'is_online': user.is_online if hasattr(user, 'is_online') else False,
-                    'school': user.school,
-                    'class_number': user.class_number,
-                    'subjects': user.subjects,
-                    'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S') if user.created_at else None
-                }
+            if row:
+                user_dict = USER_PROFILE_ROW.one(row[:-1])
+                user_dict['is_online'] = self.presence.is_online(row.id, row.is_online)
                 print(f"Пользователь {email} успешно аутентифицирован")
                 return True, user_dict
             else:
@@ -236,96 +611,91 @@ class Database:
             print(f"Неожиданная ошибка при аутентификации: {e}")
             return False, None
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
-    def get_teachers(self):
-        """Получение списка всех учителей"""
+    def get_teachers(self, subject=None):
+        """Получение списка учителей (всех или по предмету)"""
+        return self.presence.annotate(self._load_teachers(subject))
+    
+    @cached('teachers')
+    def _load_teachers(self, subject=None):
+        """Учителя из базы данных; статус онлайн подставляет get_teachers"""
         session = self.get_session()
         try:
-            teachers = session.query(User).filter(User.role == 'Учитель').all()
-            teachers_list = []
-            
-            for teacher in teachers:
-                teachers_list.append({
-                    'id': teacher.id,
-                    'first_name': teacher.first_name,
-                    'last_name': teacher.last_name,
-                    'subjects': teacher.subjects,
-                    'city': teacher.city,
-                    'school': teacher.school,
-                    'is_online': teacher.is_online if hasattr(teacher, 'is_online') else False
-                })
-            
-            return teachers_list
+            return TEACHER_ROW.all(session.execute(teachers_query(subject)))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения списка учителей: {e}")
-            return []
+            return Uncached([])
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
+    @cached('teacher_subjects')
+    def get_teacher_subject_facets(self):
+        """Предметы учителей с количеством учителей по каждому"""
+        session = self.get_session()
+        try:
+            facets = session.query(
+                TeacherSubject.subject,
+                func.count(TeacherSubject.teacher_id).label('teachers_count')
+            ).group_by(TeacherSubject.subject).order_by(TeacherSubject.subject).all()
+            
+            return [{'subject': f.subject, 'count': f.teachers_count} for f in facets]
+            
+        except SQLAlchemyError as e:
+            print(f"Ошибка получения предметов учителей: {e}")
+            return Uncached([])
+        finally:
+            self.release_session(session)
+    
+    @trace
+    @cached('user')
     def get_user_by_id(self, user_id):
         """Получение пользователя по ID"""
         session = self.get_session()
         try:
-            user = session.query(User).filter(User.id == user_id).first()
-            if user:
-                return {
-                    'id': user.id,
-                    'email': user.email,
-                    'first_name': user.first_name,
-                    'last_name': user.last_name,
-                    'role': user.role,
-                    'city': user.city,
-                    'school': user.school,
-                    'class_number': user.class_number,
-                    'subjects': user.subjects,
-                    'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S') if user.created_at else None
-                }
-            return None
-            
+            return USER_PROFILE_ROW.one(session.execute(USER_BY_ID, {'user_id': user_id}).first())
         except SQLAlchemyError as e:
             print(f"Ошибка получения пользователя: {e}")
             return None
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def delete_user(self, user_id, email, password):
         """Удаление пользователя с подтверждением"""
         session = self.get_session()
         try:
-            # Проверка подлинности пользователя
-            password_hash = self.hash_password(password)
-            user = session.query(User).filter(
-                and_(User.id == user_id, User.email == email, User.password_hash == password_hash)
-            ).first()
+            # Видео звонков и уроков пользователя: строки удалит каскад, файлы - remove_media_file
+            media_paths = set(session.execute(
+                select(LessonRecord.video_file_path).where(
+                    or_(LessonRecord.student_id == user_id, LessonRecord.teacher_id == user_id)
+                ).union(
+                    select(Call.recording_path).where(or_(Call.student_id == user_id, Call.teacher_id == user_id))
+                )
+            ).scalars())
             
-            if not user:
+            # Проверка подлинности и удаление одним запросом; связанные записи
+            # удаляет SQLite по ON DELETE CASCADE
+            password_hash = self.hash_password(password)
+            deleted = session.execute(
+                delete(User).where(
+                    and_(User.id == user_id, User.email == email, User.password_hash == password_hash)
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            
+            if not deleted:
+                session.rollback()
                 return False, "Неверный email или пароль"
             
-            # Удаление связанных записей
-            session.query(StudentTeacherRelation).filter(
-                or_(StudentTeacherRelation.student_id == user_id, StudentTeacherRelation.teacher_id == user_id)
-            ).delete()
-            
-            session.query(TeacherRequest).filter(
-                or_(TeacherRequest.student_id == user_id, TeacherRequest.teacher_id == user_id)
-            ).delete()
-            
-            session.query(LessonRecord).filter(
-                or_(LessonRecord.student_id == user_id, LessonRecord.teacher_id == user_id)
-            ).delete()
-            
-            session.query(Call).filter(
-                or_(Call.student_id == user_id, Call.teacher_id == user_id)
-            ).delete()
-            
-            # Удаление пользователя
-            session.delete(user)
             session.commit()
+            self.invalidate_user_caches(user_id=user_id)
+            self.presence.set_offline(user_id)
+            # Файлы удаляются только после фиксации транзакции
+            for path in media_paths:
+                remove_media_file(path)
             
             print(f"Пользователь с ID {user_id} успешно удален")
             return True, "Профиль успешно удален"
@@ -335,36 +705,30 @@ class Database:
             print(f"Ошибка удаления пользователя: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def create_teacher_request(self, teacher_id, student_id, message=""):
         """Создание заявки от учителя к ученику"""
         session = self.get_session()
         try:
-            # Проверка существования заявки
-            existing_request = session.query(TeacherRequest).filter(
-                and_(
-                    TeacherRequest.teacher_id == teacher_id,
-                    TeacherRequest.student_id == student_id,
-                    TeacherRequest.status == 'pending'
+            # Повторная заявка отсекается уникальным индексом по ожидающим заявкам
+            created = session.execute(
+                sqlite_insert(TeacherRequest).values(
+                    teacher_id=teacher_id,
+                    student_id=student_id,
+                    message=message,
+                    status='pending'
+                ).on_conflict_do_nothing(
+                    index_elements=['teacher_id', 'student_id'],
+                    index_where=TeacherRequest.status == 'pending'
                 )
-            ).first()
+            ).rowcount
+            session.commit()
             
-            if existing_request:
+            if not created:
                 return False, "Заявка уже отправлена"
             
-            # Создание заявки
-            new_request = TeacherRequest(
-                teacher_id=teacher_id,
-                student_id=student_id,
-                message=message,
-                status='pending'
-            )
-            
-            session.add(new_request)
-            session.commit()
-            
             print(f"Заявка от учителя {teacher_id} к ученику {student_id} создана")
             return True, "Заявка отправлена"
             
@@ -373,71 +737,61 @@ class Database:
             print(f"Ошибка создания заявки: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_student_requests(self, student_id):
         """Получение заявок для ученика"""
         session = self.get_session()
         try:
-            requests = session.query(TeacherRequest, User).join(
-                User, TeacherRequest.teacher_id == User.id
-            ).filter(
-                and_(TeacherRequest.student_id == student_id, TeacherRequest.status == 'pending')
-            ).order_by(TeacherRequest.created_at.desc()).all()
-            
-            requests_list = []
-            for request, teacher in requests:
-                requests_list.append({
-                    'id': request.id,
-                    'teacher_id': request.teacher_id,
-                    'message': request.message,
-                    'created_at': request.created_at.strftime('%Y-%m-%d %H:%M:%S') if request.created_at else None,
-                    'first_name': teacher.first_name,
-                    'last_name': teacher.last_name,
-                    'subjects': teacher.subjects,
-                    'school': teacher.school
-                })
-            
-            return requests_list
+            return STUDENT_REQUEST_ROW.all(
+                session.execute(PENDING_STUDENT_REQUESTS, {'student_id': student_id})
+            )
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения заявок: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def accept_teacher_request(self, request_id, student_id):
         """Принятие заявки от учителя"""
         session = self.get_session()
         try:
-            # Получение данных заявки
-            request = session.query(TeacherRequest).filter(
-                and_(
-                    TeacherRequest.id == request_id,
-                    TeacherRequest.student_id == student_id,
-                    TeacherRequest.status == 'pending'
-                )
-            ).first()
-            
-            if not request:
+            # Смена статуса и получение учителя одним запросом
+            teacher_id = session.execute(
+                update(TeacherRequest).where(
+                    and_(
+                        TeacherRequest.id == request_id,
+                        TeacherRequest.student_id == student_id,
+                        TeacherRequest.status == 'pending'
+                    )
+                ).values(
+                    status='accepted',
+                    updated_at=datetime.utcnow()
+                ).returning(TeacherRequest.teacher_id)
+            ).scalar()
+            
+            if teacher_id is None:
+                session.rollback()
                 return False, "Заявка не найдена"
             
-            # Обновление статуса заявки
-            request.status = 'accepted'
-            request.updated_at = datetime.utcnow()
-            
-            # Добавление связи ученик-учитель
-            new_relation = StudentTeacherRelation(
-                student_id=student_id,
-                teacher_id=request.teacher_id
-            )
-            session.add(new_relation)
+            # Добавление связи ученик-учитель (если её ещё нет)
+            created = session.execute(
+                sqlite_insert(StudentTeacherRelation).values(
+                    student_id=student_id,
+                    teacher_id=teacher_id,
+                    created_at=datetime.utcnow()
+                ).on_conflict_do_nothing(index_elements=['student_id', 'teacher_id'])
+            ).rowcount
             
             session.commit()
+            self.invalidate_user_caches(student_id=student_id, teacher_id=teacher_id)
             
             print(f"Заявка {request_id} принята")
+            if not created:
+                return True, "Заявка принята, учитель уже добавлен"
             return True, "Заявка принята, учитель добавлен"
             
         except SQLAlchemyError as e:
@@ -445,7 +799,7 @@ class Database:
             print(f"Ошибка принятия заявки: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def reject_teacher_request(self, request_id, student_id):
@@ -475,36 +829,63 @@ class Database:
             print(f"Ошибка отклонения заявки: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_student_teachers(self, student_id):
         """Получение списка учителей ученика"""
+        return self.presence.annotate(self._load_student_teachers(student_id))
+    
+    @cached('student_teachers')
+    def _load_student_teachers(self, student_id):
+        """Учителя ученика из базы данных; статус онлайн подставляет get_student_teachers"""
         session = self.get_session()
         try:
-            teachers = session.query(User).join(
-                StudentTeacherRelation, StudentTeacherRelation.teacher_id == User.id
-            ).filter(StudentTeacherRelation.student_id == student_id).all()
-            
-            teachers_list = []
-            for teacher in teachers:
-                teachers_list.append({
-                    'id': teacher.id,
-                    'first_name': teacher.first_name,
-                    'last_name': teacher.last_name,
-                    'subjects': teacher.subjects,
-                    'school': teacher.school,
-                    'city': teacher.city,
-                    'is_online': teacher.is_online if hasattr(teacher, 'is_online') else False
-                })
-            
-            return teachers_list
+            return TEACHER_ROW.all(session.execute(student_teachers_query(student_id)))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения учителей ученика: {e}")
-            return []
+            return Uncached([])
         finally:
-            session.close()
+            self.release_session(session)
+    
+    @trace
+    def auto_match_students(self, teacher_id):
+        """Прикрепление к учителю всех учеников его города и школы"""
+        try:
+            with self.engine.begin() as conn:
+                teacher = conn.execute(
+                    select(User.city, User.school).where(
+                        and_(User.id == teacher_id, User.role == 'Учитель')
+                    )
+                ).first()
+                if not teacher:
+                    return 0
+                
+                students = select(
+                    User.id, literal(teacher_id), literal(datetime.utcnow())
+                ).where(
+                    and_(
+                        User.role == 'Ученик',
+                        # IS, а не =, чтобы пустые город и школа совпадали так же, как раньше
+                        User.city.is_(teacher.city),
+                        User.school.is_(teacher.school)
+                    )
+                )
+                statement = sqlite_insert(StudentTeacherRelation).from_select(
+                    ['student_id', 'teacher_id', 'created_at'], students
+                ).on_conflict_do_nothing(index_elements=['student_id', 'teacher_id'])
+                
+                matched_count = conn.execute(statement).rowcount
+            
+            if matched_count:
+                self.invalidate_user_caches(teacher_id=teacher_id)
+            print(f"К учителю {teacher_id} автоматически прикреплено учеников: {matched_count}")
+            return matched_count
+            
+        except SQLAlchemyError as e:
+            print(f"Ошибка автоматического прикрепления учеников: {e}")
+            return 0
     
     @trace
     def create_call(self, student_id, teacher_id, scheduled_time, duration_minutes=60, notes=""):
@@ -531,7 +912,7 @@ class Database:
             print(f"Ошибка создания звонка: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def start_call(self, call_id):
@@ -557,7 +938,7 @@ class Database:
             print(f"Ошибка начала звонка: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def end_call(self, call_id, recording_path=""):
@@ -571,6 +952,9 @@ class Database:
             if not call:
                 return False, "Звонок не найден или не активен"
             
+            # Путь приводится к виду /<путь от MEDIA_ROOT>, по которому обслуживание найдёт файл
+            recording_path = media_url_path(recording_path)
+            
             # Обновление статуса звонка
             call.status = 'completed'
             call.actual_end_time = datetime.utcnow()
@@ -603,74 +987,61 @@ class Database:
             print(f"Ошибка завершения звонка: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_user_calls(self, user_id):
         """Получение звонков пользователя"""
         session = self.get_session()
         try:
-            calls = session.query(Call, User.first_name.label('student_name'), User.last_name.label('student_surname')).join(
-                User, Call.student_id == User.id
-            ).filter(
-                or_(Call.student_id == user_id, Call.teacher_id == user_id)
-            ).order_by(Call.scheduled_time.desc()).all()
-            
-            # Дополнительно получаем данные учителей
-            calls_with_teacher = session.query(Call, 
-                User.first_name.label('teacher_name'), 
-                User.last_name.label('teacher_surname')
-            ).join(
-                User, Call.teacher_id == User.id
-            ).filter(
-                or_(Call.student_id == user_id, Call.teacher_id == user_id)
-            ).order_by(Call.scheduled_time.desc()).all()
-            
-            calls_list = []
-            for i, (call, student_name, student_surname) in enumerate(calls):
-                teacher_name = calls_with_teacher[i][1]
-                teacher_surname = calls_with_teacher[i][2]
-                
-                calls_list.append({
-                    'id': call.id,
-                    'student_id': call.student_id,
-                    'teacher_id': call.teacher_id,
-                    'scheduled_time': call.scheduled_time.strftime('%Y-%m-%d %H:%M:%S') if call.scheduled_time else None,
-                    'actual_start_time': call.actual_start_time.strftime('%Y-%m-%d %H:%M:%S') if call.actual_start_time else None,
-                    'actual_end_time': call.actual_end_time.strftime('%Y-%m-%d %H:%M:%S') if call.actual_end_time else None,
-                    'duration_minutes': call.duration_minutes,
-                    'status': call.status,
-                    'recording_path': call.recording_path,
-                    'notes': call.notes,
-                    'created_at': call.created_at.strftime('%Y-%m-%d %H:%M:%S') if call.created_at else None,
-                    'student_name': student_name,
-                    'student_surname': student_surname,
-                    'teacher_name': teacher_name,
-                    'teacher_surname': teacher_surname
-                })
-            
-            return calls_list
+            return CALL_ROW.all(session.execute(user_calls_query(user_id)))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения звонков: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
-    def cleanup_expired_records(self):
-        """Очистка просроченных записей уроков (старше 2 дней)"""
+    def get_user_calls_page(self, user_id, limit=50, cursor=None):
+        """Страница звонков пользователя (keyset-пагинация по scheduled_time)"""
         session = self.get_session()
         try:
-            # Удаление просроченных автоматических записей
-            deleted_count = session.query(LessonRecord).filter(
-                and_(
-                    LessonRecord.is_auto_created == True,
-                    LessonRecord.expires_at < datetime.utcnow()
-                )
-            ).delete()
+            statement = user_calls_query(user_id)
+            
+            after = decode_cursor(cursor, 2)
+            if after:
+                scheduled_time, call_id = after
+                # При сортировке по убыванию звонки без времени идут в конце
+                if scheduled_time is None:
+                    statement = statement.where(and_(Call.scheduled_time == None, Call.id < call_id))
+                else:
+                    statement = statement.where(or_(
+                        Call.scheduled_time < scheduled_time,
+                        and_(Call.scheduled_time == scheduled_time, Call.id < call_id),
+                        Call.scheduled_time == None
+                    ))
+            
+            calls = session.execute(statement.limit(limit + 1)).all()
+            has_more = len(calls) > limit
+            calls = calls[:limit]
             
-            session.commit()
+            return {
+                'calls': CALL_ROW.all(calls),
+                'next_cursor': encode_cursor(calls[-1].scheduled_time, calls[-1].id) if has_more else None
+            }
+            
+        except SQLAlchemyError as e:
+            print(f"Ошибка получения звонков: {e}")
+            return {'calls': [], 'next_cursor': None}
+        finally:
+            self.release_session(session)
+    
+    @trace
+    def cleanup_expired_records(self, batch_size=MAINTENANCE_BATCH_SIZE):
+        """Очистка просроченных записей уроков (старше 2 дней)"""
+        try:
+            deleted_count, _ = self.delete_expired_lesson_records(batch_size)
             
             if deleted_count > 0:
                 print(f"Удалено {deleted_count} просроченных записей уроков")
@@ -678,11 +1049,68 @@ class Database:
             return True, f"Удалено {deleted_count} просроченных записей"
             
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"Ошибка очистки записей: {e}")
             return False, f"Ошибка базы данных: {e}"
-        finally:
-            session.close()
+    
+    @trace
+    def delete_expired_lesson_records(self, batch_size=MAINTENANCE_BATCH_SIZE):
+        """Пакетное удаление просроченных автоматических записей уроков и их видео: (записей, файлов)"""
+        deleted_records = 0
+        deleted_files = 0
+        now = datetime.utcnow()
+        while True:
+            # Каждый пакет - короткая транзакция, запись в базу не блокируется надолго
+            with self.engine.begin() as conn:
+                rows = conn.execute(expired_lesson_records_query(now, batch_size)).all()
+                if not rows:
+                    break
+                conn.execute(delete(LessonRecord).where(LessonRecord.id.in_([row.id for row in rows])))
+            deleted_records += len(rows)
+            # Файлы удаляются только после фиксации транзакции
+            deleted_files += sum(remove_media_file(row.video_file_path) for row in rows)
+            if len(rows) < batch_size:
+                break
+        return deleted_records, deleted_files
+    
+    @trace
+    def prune_read_notifications(self, retention_days, batch_size=MAINTENANCE_BATCH_SIZE):
+        """Удаление прочитанных уведомлений старше retention_days дней пакетами"""
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = 0
+        last_id = 0
+        while True:
+            # Проход по первичному ключу: каждый пакет продолжает с места предыдущего
+            with self.engine.begin() as conn:
+                ids = conn.execute(
+                    select(Notification.id).where(
+                        and_(
+                            Notification.id > last_id,
+                            Notification.is_read == True,
+                            Notification.created_at < cutoff
+                        )
+                    ).order_by(Notification.id).limit(batch_size)
+                ).scalars().all()
+                if not ids:
+                    break
+                conn.execute(delete(Notification).where(Notification.id.in_(ids)))
+            deleted += len(ids)
+            last_id = ids[-1]
+            if len(ids) < batch_size:
+                break
+        return deleted
+    
+    @trace
+    def optimize_storage(self, vacuum_pages):
+        """PRAGMA optimize и возврат до vacuum_pages свободных страниц; возвращает число освобождённых"""
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("PRAGMA optimize"))
+            # incremental_vacuum работает только в режиме auto_vacuum = INCREMENTAL (2)
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                return 0
+            free_before = conn.execute(text("PRAGMA freelist_count")).scalar()
+            # executescript выполняет PRAGMA до конца; обычный execute освобождает одну страницу
+            conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+            return free_before - conn.execute(text("PRAGMA freelist_count")).scalar()
     
     @trace
     def create_lesson_record(self, student_id, teacher_id, lesson_title, lesson_date, subject="", video_url="", video_file_path="", description="", homework=""):
@@ -713,58 +1141,19 @@ class Database:
             print(f"Ошибка создания записи урока: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_user_lesson_records(self, user_id):
         """Получение записей уроков пользователя"""
         session = self.get_session()
         try:
-            records = session.query(LessonRecord, 
-                User.first_name.label('student_name'), 
-                User.last_name.label('student_surname')
-            ).join(
-                User, LessonRecord.student_id == User.id
-            ).filter(
-                or_(LessonRecord.student_id == user_id, LessonRecord.teacher_id == user_id)
-            ).order_by(LessonRecord.lesson_date.desc()).all()
-            
-            # Дополнительно получаем данные учителей
-            records_with_teacher = session.query(LessonRecord,
-                User.first_name.label('teacher_name'),
-                User.last_name.label('teacher_surname')
-            ).join(
-                User, LessonRecord.teacher_id == User.id
-            ).filter(
-                or_(LessonRecord.student_id == user_id, LessonRecord.teacher_id == user_id)
-            ).order_by(LessonRecord.lesson_date.desc()).all()
-            
-            records_list = []
-            for i, (record, student_name, student_surname) in enumerate(records):
-                teacher_name = records_with_teacher[i][1]
-                teacher_surname = records_with_teacher[i][2]
-                
-                records_list.append({
-                    'id': record.id,
-                    'student_id': record.student_id,
-                    'teacher_id': record.teacher_id,
-                    'lesson_title': record.lesson_title,
-                    'lesson_date': record.lesson_date.strftime('%Y-%m-%d %H:%M:%S') if record.lesson_date else None,
-                    'subject': record.subject,
-                    'video_url': record.video_url,
-                    'video_file_path': record.video_file_path,
-                    'description': record.description,
-                    'homework': record.homework,
-                    'is_auto_created': record.is_auto_created,
-                    'call_id': record.call_id,
-                    'expires_at': record.expires_at.strftime('%Y-%m-%d %H:%M:%S') if record.expires_at else None,
-                    'created_at': record.created_at.strftime('%Y-%m-%d %H:%M:%S') if record.created_at else None,
-                    'student_name': student_name,
-                    'student_surname': student_surname,
-                    'teacher_name': teacher_name,
-                    'teacher_surname': teacher_surname,
-                    'availability_status': record.availability_status
-                })
+            # Записи и имена обоих участников получаются одним запросом по колонкам
+            rows = session.execute(lesson_records_query(user_id)).all()
+            
+            records_list = LESSON_RECORD_ROW.all(rows)
+            for record, row in zip(records_list, rows):
+                record['availability_status'] = LessonRecord.availability_for(row.expires_at)
             
             return records_list
             
@@ -772,64 +1161,68 @@ class Database:
             print(f"Ошибка получения записей уроков: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_all_students(self):
         """Получение списка всех учеников"""
         session = self.get_session()
         try:
-            students = session.query(User).filter(User.role == 'Ученик').order_by(User.first_name, User.last_name).all()
-            
-            students_list = []
-            for student in students:
-                students_list.append({
-                    'id': student.id,
-                    'first_name': student.first_name,
-                    'last_name': student.last_name,
-                    'email': student.email,
-                    'city': student.city,
-                    'school': student.school,
-                    'class_number': student.class_number,
-                    'is_online': student.is_online if hasattr(student, 'is_online') else False
-                })
-            
-            return students_list
+            return self.presence.annotate(STUDENT_ROW.all(session.execute(
+                STUDENT_ROW.select().where(User.role == 'Ученик').order_by(User.first_name, User.last_name)
+            )))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения списка учеников: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
-    def get_pending_requests_for_student(self, student_id):
-        """Получение входящих заявок для ученика"""
+    def get_students_directory(self, city=None, school=None, class_number=None, name_prefix=None,
+                               limit=50, cursor=None):
+        """Страница каталога учеников с фильтрами (keyset-пагинация по имени)"""
         session = self.get_session()
         try:
-            requests = session.query(TeacherRequest, User).join(
-                User, TeacherRequest.teacher_id == User.id
-            ).filter(
-                TeacherRequest.student_id == student_id,
-                TeacherRequest.status == 'pending'
-            ).order_by(TeacherRequest.created_at.desc()).all()
+            statement = students_directory_query(city, school, class_number, name_prefix)
             
-            requests_list = []
-            for request, teacher in requests:
-                requests_list.append({
-                    'id': request.id,
-                    'teacher_id': request.teacher_id,
-                    'first_name': teacher.first_name,
-                    'last_name': teacher.last_name,
-                    'email': teacher.email,
-                    'subjects': teacher.subjects if hasattr(teacher, 'subjects') else None,
-                    'school': teacher.school,
-                    'city': teacher.city,
-                    'message': request.message,
-                    'created_at': request.created_at.strftime('%Y-%m-%d %H:%M') if request.created_at else None
-                })
+            after = decode_cursor(cursor, 3)
+            if after:
+                statement = statement.where(
+                    tuple_(User.first_name, User.last_name, User.id) > tuple_(*after)
+                )
             
-            return requests_list
+            students = session.execute(statement.limit(limit + 1)).all()
+            has_more = len(students) > limit
+            students = students[:limit]
+            
+            students_list = self.presence.annotate(STUDENT_ROW.all(students))
+            
+            last = students[-1] if students else None
+            return {
+                'students': students_list,
+                'next_cursor': encode_cursor(last.first_name, last.last_name, last.id) if has_more else None
+            }
+            
+        except SQLAlchemyError as e:
+            print(f"Ошибка получения каталога учеников: {e}")
+            return {'students': [], 'next_cursor': None}
+        finally:
+            self.release_session(session)
+    
+    @trace
+    def get_pending_requests_for_student(self, student_id):
+        """Получение входящих заявок для ученика"""
+        session = self.get_session()
+        try:
+            return PENDING_REQUEST_ROW.all(session.execute(
+                PENDING_REQUEST_ROW.select().join(
+                    User, TeacherRequest.teacher_id == User.id
+                ).where(
+                    TeacherRequest.student_id == student_id,
+                    TeacherRequest.status == 'pending'
+                ).order_by(TeacherRequest.created_at.desc())
+            ))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения входящих заявок: {e}")
@@ -837,27 +1230,23 @@ class Database:
             traceback.print_exc()
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_requests_by_teacher(self, teacher_id):
         """Получение всех заявок отправленных учителем"""
         session = self.get_session()
         try:
-            requests = session.query(TeacherRequest, User).join(
-                User, TeacherRequest.student_id == User.id
-            ).filter(TeacherRequest.teacher_id == teacher_id).order_by(TeacherRequest.created_at.desc()).all()
-            
             requests_list = []
-            for request, student in requests:
+            for request in TEACHER_REQUEST_ROW.all(session.execute(teacher_requests_query(teacher_id))):
                 requests_list.append({
-                    'id': request.id,
-                    'student_id': request.student_id,
-                    'student_name': f"{student.first_name} {student.last_name}",
-                    'student_email': student.email,
-                    'status': request.status,
-                    'message': request.message,
-                    'created_at': request.created_at.strftime('%Y-%m-%d %H:%M') if request.created_at else None
+                    'id': request['id'],
+                    'student_id': request['student_id'],
+                    'student_name': f"{request['first_name']} {request['last_name']}",
+                    'student_email': request['email'],
+                    'status': request['status'],
+                    'message': request['message'],
+                    'created_at': request['created_at']
                 })
             
             return requests_list
@@ -868,137 +1257,215 @@ class Database:
             traceback.print_exc()
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_teacher_sent_requests(self, teacher_id):
         """Получение отправленных заявок учителя"""
         session = self.get_session()
         try:
-            requests = session.query(TeacherRequest, User).join(
-                User, TeacherRequest.student_id == User.id
-            ).filter(TeacherRequest.teacher_id == teacher_id).order_by(TeacherRequest.created_at.desc()).all()
-            
-            requests_list = []
-            for request, student in requests:
-                requests_list.append({
-                    'id': request.id,
-                    'student_id': request.student_id,
-                    'status': request.status,
-                    'message': request.message,
-                    'created_at': request.created_at.strftime('%Y-%m-%d %H:%M:%S') if request.created_at else None,
-                    'student_name': student.first_name,
-                    'student_surname': student.last_name
-                })
-            
-            return requests_list
+            return SENT_REQUEST_ROW.all(session.execute(
+                SENT_REQUEST_ROW.select().join(
+                    User, TeacherRequest.student_id == User.id
+                ).where(TeacherRequest.teacher_id == teacher_id).order_by(TeacherRequest.created_at.desc())
+            ))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения отправленных заявок: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_teacher_students(self, teacher_id):
         """Получение учеников учителя"""
         session = self.get_session()
         try:
-            students = session.query(User).join(
-                StudentTeacherRelation, StudentTeacherRelation.student_id == User.id
-            ).filter(StudentTeacherRelation.teacher_id == teacher_id).order_by(User.first_name, User.last_name).all()
-            
-            students_list = []
-            for student in students:
-                students_list.append({
-                    'id': student.id,
-                    'first_name': student.first_name,
-                    'last_name': student.last_name,
-                    'email': student.email,
-                    'city': student.city,
-                    'school': student.school,
-                    'class_number': student.class_number,
-                    'is_online': student.is_online if hasattr(student, 'is_online') else False
-                })
-            
-            return students_list
+            return self.presence.annotate(STUDENT_ROW.all(session.execute(teacher_students_query(teacher_id))))
             
         except SQLAlchemyError as e:
             print(f"Ошибка получения учеников учителя: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def update_user_online_status(self, user_id, is_online):
-        """Обновление статуса онлайн пользователя"""
-        session = self.get_session()
+        """Обновление статуса онлайн пользователя (heartbeat, вход или выход)"""
+        if is_online:
+            self.presence.touch(user_id)
+            if self.presence.start(self.flush_presence):
+                atexit.register(self.presence.stop, self.flush_presence)
+        else:
+            self.presence.set_offline(user_id)
+        return True
+    
+    @trace
+    def flush_presence(self):
+        """Пакетная запись времени последних heartbeat в users.last_seen"""
+        changes = self.presence.drain()
+        if not changes:
+            return 0
+        params = [{'user_id': user_id, 'last_seen': last_seen} for user_id, last_seen in changes.items()]
+        if self.write_buffer is not None:
+            self._buffer_write(*[(PRESENCE_UPDATE, row) for row in params], user_ids=list(changes))
+            return len(changes)
         try:
-            user = session.query(User).filter(User.id == user_id).first()
-            if user:
-                user.is_online = is_online
-                session.commit()
-                return True
-            return False
+            with self.engine.begin() as conn:
+                conn.execute(PRESENCE_UPDATE, params)
+            for user_id in changes:
+                self.invalidate_user(user_id)
+            return len(changes)
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"Ошибка обновления статуса онлайн: {e}")
-            return False
-        finally:
-            session.close()
+            return 0
     
     @trace
     def get_user_notifications(self, user_id):
         """Получение уведомлений пользователя"""
         session = self.get_session()
         try:
-            notifications = session.query(Notification).filter(
-                Notification.user_id == user_id
-            ).order_by(Notification.created_at.desc()).all()
-            
-            notifications_list = []
-            for notification in notifications:
-                notifications_list.append({
-                    'id': notification.id,
-                    'user_id': notification.user_id,
-                    'title': notification.title,
-                    'message': notification.message,
-                    'is_read': notification.is_read,
-                    'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S') if notification.created_at else None
-                })
-            
-            return notifications_list
+            return NOTIFICATION_ROW.all(session.execute(USER_NOTIFICATIONS, {'user_id': user_id}))
         except SQLAlchemyError as e:
             print(f"Ошибка получения уведомлений: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
+    
+    @trace
+    def get_notifications_page(self, user_id, limit=20, cursor=None):
+        """Страница уведомлений пользователя (keyset-пагинация по created_at)"""
+        session = self.get_session()
+        try:
+            statement = notifications_page_query(user_id)
+            
+            after = decode_cursor(cursor, 2)
+            if after:
+                statement = statement.where(
+                    tuple_(Notification.created_at, Notification.id) < tuple_(*after)
+                )
+            
+            notifications = session.execute(statement.limit(limit + 1)).all()
+            has_more = len(notifications) > limit
+            notifications = notifications[:limit]
+            
+            last = notifications[-1] if notifications else None
+            return {
+                'notifications': NOTIFICATION_ROW.all(notifications),
+                'next_cursor': encode_cursor(last.created_at, last.id) if has_more else None
+            }
+        except SQLAlchemyError as e:
+            print(f"Ошибка получения страницы уведомлений: {e}")
+            return {'notifications': [], 'next_cursor': None}
+        finally:
+            self.release_session(session)
+    
+    @trace
+    def get_unread_notifications_count(self, user_id):
+        """Количество непрочитанных уведомлений из счётчика пользователя"""
+        session = self.get_session()
+        try:
+            return session.execute(UNREAD_NOTIFICATIONS_COUNT, {'user_id': user_id}).scalar() or 0
+        except SQLAlchemyError as e:
+            print(f"Ошибка получения количества уведомлений: {e}")
+            return 0
+        finally:
+            self.release_session(session)
+    
+    @staticmethod
+    def _unread_counter_update(user_ids, delta):
+        """UPDATE счётчика непрочитанных уведомлений на delta для пользователей из user_ids"""
+        return update(User).where(User.id.in_(user_ids)).values(
+            unread_notifications=User.unread_notifications + delta
+        ).execution_options(synchronize_session=False)
     
     @trace
     def mark_notification_read(self, notification_id, user_id):
         """Отметить уведомление как прочитанное"""
+        if self.write_buffer is not None:
+            return self._buffer_notification_read(notification_id, user_id)
         session = self.get_session()
         try:
-            notification = session.query(Notification).filter(
-                and_(Notification.id == notification_id, Notification.user_id == user_id)
-            ).first()
-            
-            if not notification:
-                return False, "Уведомление не найдено"
+            marked = session.execute(
+                update(Notification).where(
+                    Notification.id == notification_id,
+                    Notification.user_id == user_id,
+                    Notification.is_read == False
+                ).values(is_read=True).execution_options(synchronize_session=False)
+            ).rowcount
+            
+            if not marked:
+                exists = session.execute(
+                    select(Notification.id).where(
+                        Notification.id == notification_id, Notification.user_id == user_id
+                    )
+                ).first()
+                if not exists:
+                    return False, "Уведомление не найдено"
+                return True, "Уведомление отмечено как прочитанное"
             
-            notification.is_read = True
+            # Счётчик меняется в той же транзакции, что и уведомление
+            session.execute(self._unread_counter_update([user_id], -1))
             session.commit()
+            self.invalidate_user(user_id)
             return True, "Уведомление отмечено как прочитанное"
         except SQLAlchemyError as e:
             session.rollback()
             print(f"Ошибка отметки уведомления: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
+    
+    def _buffer_notification_read(self, notification_id, user_id):
+        """Отметка о прочтении через буфер записи: проверка владельца сейчас, запись - с пакетом"""
+        session = self.get_session()
+        try:
+            exists = session.execute(
+                select(Notification.id).where(
+                    Notification.id == notification_id, Notification.user_id == user_id
+                )
+            ).first()
+        except SQLAlchemyError as e:
+            print(f"Ошибка отметки уведомления: {e}")
+            return False, f"Ошибка базы данных: {e}"
+        finally:
+            self.release_session(session)
+        
+        if not exists:
+            return False, "Уведомление не найдено"
+        params = {'notification_id': notification_id, 'owner_id': user_id}
+        self._buffer_write((NOTIFICATION_MARK_READ, params), (UNREAD_COUNTER_RECOUNT, params), user_ids=[user_id])
+        return True, "Уведомление отмечено как прочитанное"
+    
+    @trace
+    def mark_all_notifications_read(self, user_id):
+        """Отметить все уведомления пользователя как прочитанные одним UPDATE"""
+        session = self.get_session()
+        try:
+            marked = session.execute(
+                update(Notification).where(
+                    Notification.user_id == user_id,
+                    Notification.is_read == False
+                ).values(is_read=True).execution_options(synchronize_session=False)
+            ).rowcount
+            
+            if marked:
+                # Вычитание, а не обнуление: уведомление, созданное параллельно, останется в счётчике
+                session.execute(self._unread_counter_update([user_id], -marked))
+            session.commit()
+            if marked:
+                self.invalidate_user(user_id)
+            return True, marked
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Ошибка отметки уведомлений: {e}")
+            return False, f"Ошибка базы данных: {e}"
+        finally:
+            self.release_session(session)
     
     @trace
     def create_notification(self, user_id, title, message):
-        """Создание нового уведомления"""
+        """Создание нового уведомления (сразу, с ID; отложенная запись - enqueue_notification)"""
         session = self.get_session()
         try:
             new_notification = Notification(
@@ -1009,8 +1476,10 @@ class Database:
             )
             
             session.add(new_notification)
+            session.execute(self._unread_counter_update([user_id], 1))
             session.commit()
             notification_id = new_notification.id
+            self.invalidate_user(user_id)
             
             return True, notification_id
         except SQLAlchemyError as e:
@@ -1018,50 +1487,74 @@ class Database:
             print(f"Ошибка создания уведомления: {e}")
             return False, f"Ошибка базы данных: {e}"
         finally:
-            session.close()
+            self.release_session(session)
+    
+    @trace
+    def enqueue_notification(self, user_id, title, message):
+        """Создание уведомления через буфер записи, без ожидания коммита
+        
+        Возвращает Future: он завершается после записи или с её ошибкой. Ошибка одной
+        записи (например, пользователь уже удалён) завершает только её Future,
+        остальные записи пакета сохраняются. Без буфера уведомление пишется сразу.
+        """
+        if self.write_buffer is not None:
+            return self._buffer_write(
+                (NOTIFICATION_INSERT, {
+                    'user_id': user_id, 'title': title, 'message': message,
+                    'is_read': False, 'created_at': datetime.utcnow()
+                }),
+                (UNREAD_COUNTER_INCREMENT, {'user_id': user_id}),
+                user_ids=[user_id]
+            )
+        future = Future()
+        success, result = self.create_notification(user_id, title, message)
+        if success:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+        return future
     
     @trace
     def get_teacher_students_tree(self, teacher_id):
         """Получение древовидной структуры учеников учителя: Город → Школа → Класс → Ученики"""
+        return {
+            city: {
+                school: {
+                    class_num: self.presence.annotate(students)
+                    for class_num, students in classes.items()
+                }
+                for school, classes in schools.items()
+            }
+            for city, schools in self._load_teacher_students_tree(teacher_id).items()
+        }
+    
+    @cached('teacher_students_tree')
+    def _load_teacher_students_tree(self, teacher_id):
+        """Дерево учеников учителя из базы данных; статус онлайн подставляет get_teacher_students_tree"""
         session = self.get_session()
         try:
-            students = session.query(User).join(
-                StudentTeacherRelation, StudentTeacherRelation.student_id == User.id
-            ).filter(StudentTeacherRelation.teacher_id == teacher_id).order_by(
-                User.city, User.school, User.class_number, User.first_name, User.last_name
-            ).all()
+            students = STUDENT_ROW.all(session.execute(
+                STUDENT_ROW.select().join(
+                    StudentTeacherRelation, StudentTeacherRelation.student_id == User.id
+                ).where(StudentTeacherRelation.teacher_id == teacher_id).order_by(
+                    User.city, User.school, User.class_number, User.first_name, User.last_name
+                )
+            ))
             
             tree = {}
             for student in students:
-                city = student.city or "Не указан"
-                school = student.school or "Не указана"
-                class_num = student.class_number or "Не указан"
-                
-                if city not in tree:
-                    tree[city] = {}
-                if school not in tree[city]:
-                    tree[city][school] = {}
-                if class_num not in tree[city][school]:
-                    tree[city][school][class_num] = []
-                
-                tree[city][school][class_num].append({
-                    'id': student.id,
-                    'first_name': student.first_name,
-                    'last_name': student.last_name,
-                    'email': student.email,
-                    'city': student.city,
-                    'school': student.school,
-                    'class_number': student.class_number,
-                    'is_online': student.is_online if hasattr(student, 'is_online') else False
-                })
+                city = student['city'] or "Не указан"
+                school = student['school'] or "Не указана"
+                class_num = student['class_number'] or "Не указан"
+                tree.setdefault(city, {}).setdefault(school, {}).setdefault(class_num, []).append(student)
             
             return tree
         except SQLAlchemyError as e:
             print(f"Ошибка получения дерева учеников: {e}")
-            return {}
+            return Uncached({})
         finally:
-            session.close()
-
+            self.release_session(session)
+    
     # ==================== Методы для настроек пользователя ====================
     
     @trace
@@ -1069,37 +1562,30 @@ class Database:
         """Получение настроек пользователя"""
         session = self.get_session()
         try:
-            settings = session.query(UserSettings).filter(UserSettings.user_id == user_id).first()
-            if settings:
-                return settings.to_dict()
-            return UserSettings.get_defaults()
+            settings = SETTINGS_ROW.one(session.execute(USER_SETTINGS_BY_USER, {'user_id': user_id}).first())
+            return settings or UserSettings.get_defaults()
         except SQLAlchemyError as e:
             print(f"Ошибка получения настроек: {e}")
             return UserSettings.get_defaults()
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def update_user_settings(self, user_id, settings_data):
         """Обновление настроек пользователя"""
+        params = {'user_id': user_id, 'updated_at': datetime.utcnow()}
+        for key in SETTINGS_FIELDS:
+            value = settings_data.get(key)
+            if value is not None and key in SETTINGS_CHOICES and value not in SETTINGS_CHOICES[key]:
+                return False, f"Недопустимое значение {key}: {value}"
+            params[key] = value
+        
+        if self.write_buffer is not None:
+            self._buffer_write((SETTINGS_UPSERT, params))
+            return True, "Настройки обновлены"
         session = self.get_session()
         try:
-            settings = session.query(UserSettings).filter(UserSettings.user_id == user_id).first()
-            if not settings:
-                settings = UserSettings(user_id=user_id)
-                session.add(settings)
-            
-            if 'theme' in settings_data:
-                settings.theme = settings_data['theme']
-            if 'font_size' in settings_data:
-                settings.font_size = settings_data['font_size']
-            if 'notifications_enabled' in settings_data:
-                settings.notifications_enabled = settings_data['notifications_enabled']
-            if 'sound_enabled' in settings_data:
-                settings.sound_enabled = settings_data['sound_enabled']
-            if 'language' in settings_data:
-                settings.language = settings_data['language']
-            
+            session.execute(SETTINGS_UPSERT, params)
             session.commit()
             return True, "Настройки обновлены"
         except SQLAlchemyError as e:
@@ -1107,7 +1593,7 @@ class Database:
             print(f"Ошибка обновления настроек: {e}")
             return False, str(e)
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def reset_user_settings(self, user_id):
@@ -1129,15 +1615,21 @@ class Database:
             print(f"Ошибка сброса настроек: {e}")
             return False, str(e)
         finally:
-            session.close()
+            self.release_session(session)
     
     # ==================== Методы для заданий классу ====================
     
     @trace
     def create_class_assignment(self, teacher_id, title, description, subject, topic, 
                                  difficulty, assignment_type, questions_json,
-                                 target_city, target_school, target_class, deadline=None):
-        """Создание задания для класса"""
+                                 target_city, target_school, target_class, deadline=None,
+                                 notify_in_background=False):
+        """Создание задания для класса
+        
+        По умолчанию уведомления ученикам пишутся в той же транзакции, что и задание.
+        notify_in_background=True - задание фиксируется сразу, а рассылка уходит в фоновый
+        поток со своим подключением: время создания не зависит от числа учеников
+        """
         session = self.get_session()
         try:
             new_assignment = ClassAssignment(
@@ -1157,21 +1649,25 @@ class Database:
             )
             
             session.add(new_assignment)
-            session.commit()
+            session.flush()
             assignment_id = new_assignment.id
-            
-            # Создаём уведомления для учеников
-            students = self._get_students_by_criteria(session, target_city, target_school, target_class)
-            for student in students:
-                notification = Notification(
-                    user_id=student.id,
-                    title=f"📝 Новое задание: {title}",
-                    message=f"Учитель назначил новое задание по предмету {subject}. Тема: {topic}",
-                    is_read=False
-                )
-                session.add(notification)
-            
-            session.commit()
+            session.add_all([
+                AssignmentTarget(assignment_id=assignment_id, **target)
+                for target in build_assignment_targets(target_city, target_school, target_class)
+            ])
+            
+            notification = (
+                f"📝 Новое задание: {title}",
+                f"Учитель назначил новое задание по предмету {subject}. Тема: {topic}"
+            )
+            if notify_in_background:
+                session.commit()
+                self.run_in_background(self._notify_students, target_city, target_school, target_class, *notification)
+            else:
+                # В той же транзакции: задание без уведомлений не сохранится
+                self._insert_student_notifications(session, target_city, target_school, target_class, *notification)
+                session.commit()
+                self.caches['user'].clear()
             
             print(f"Задание создано: {title} для класса {target_class}")
             return True, assignment_id
@@ -1180,230 +1676,217 @@ class Database:
             print(f"Ошибка создания задания: {e}")
             return False, str(e)
         finally:
-            session.close()
+            self.release_session(session)
     
-    def _get_students_by_criteria(self, session, city, school, class_number):
-        """Получение учеников по критериям (внутренний метод)"""
-        query = session.query(User).filter(User.role == 'Ученик')
+    def _students_by_criteria(self, city, school, class_number):
+        """Запрос ID учеников по критериям (внутренний метод)"""
+        query = select(User.id).where(User.role == 'Ученик')
         
         if city:
-            query = query.filter(User.city == city)
+            query = query.where(User.city == city)
         if school:
-            query = query.filter(User.school == school)
+            query = query.where(User.school == school)
         if class_number:
             # Поддержка нескольких классов через запятую
             classes = [c.strip() for c in class_number.split(',')]
-            query = query.filter(User.class_number.in_(classes))
+            query = query.where(User.class_number.in_(classes))
         
-        return query.all()
+        return query
+    
+    def _insert_student_notifications(self, connection, city, school, class_number, title, message):
+        """Уведомления ученикам одним INSERT ... SELECT и их счётчики (в транзакции вызывающего)"""
+        students = self._students_by_criteria(city, school, class_number).subquery()
+        statement = insert(Notification).from_select(
+            ['user_id', 'title', 'message', 'is_read', 'created_at'],
+            select(
+                students.c.id,
+                literal(title),
+                literal(message),
+                literal(False),
+                literal(datetime.utcnow())
+            )
+        )
+        count = connection.execute(statement).rowcount
+        connection.execute(self._unread_counter_update(
+            self._students_by_criteria(city, school, class_number), 1
+        ))
+        return count
+    
+    @trace
+    def _notify_students(self, city, school, class_number, title, message):
+        """Рассылка в собственной транзакции; ошибка поднимается и попадает в счётчик ошибок @trace"""
+        with self.engine.begin() as conn:
+            count = self._insert_student_notifications(conn, city, school, class_number, title, message)
+        # Адресатов рассылки может быть много: карточки пользователей сбрасываются целиком
+        self.caches['user'].clear()
+        return count
     
     @trace
-    def get_teacher_assignments(self, teacher_id):
-        """Получение заданий учителя"""
+    def notify_students_by_criteria(self, city, school, class_number, title, message):
+        """Рассылка уведомления ученикам одним INSERT ... SELECT и обновление их счётчиков"""
+        try:
+            return self._notify_students(city, school, class_number, title, message)
+        except SQLAlchemyError as e:
+            print(f"Ошибка рассылки уведомлений: {e}")
+            return 0
+    
+    def run_in_background(self, func, *args, **kwargs):
+        """Выполнение функции в фоновом потоке базы данных (задачи идут по очереди); Future задачи"""
+        if self._background is None:
+            self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database-background')
+        future = self._background.submit(func, *args, **kwargs)
+        future.add_done_callback(self._report_background_error)
+        return future
+    
+    @staticmethod
+    def _report_background_error(future):
+        """Ошибка фоновой задачи в лог"""
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Ошибка фоновой задачи базы данных: {future.exception()}")
+    
+    @trace
+    def get_teacher_assignments(self, teacher_id, limit=None, offset=0):
+        """Получение заданий учителя (постранично, если указан limit)"""
         session = self.get_session()
         try:
-            assignments = session.query(ClassAssignment).filter(
-                ClassAssignment.teacher_id == teacher_id
-            ).order_by(ClassAssignment.created_at.desc()).all()
+            statement = teacher_assignments_query(teacher_id)
             
-            result = []
-            for a in assignments:
-                submissions = session.query(AssignmentSubmission).filter(
-                    AssignmentSubmission.assignment_id == a.id
-                ).all()
-                
-                result.append({
-                    'id': a.id,
-                    'title': a.title,
-                    'description': a.description,
-                    'subject': a.subject,
-                    'topic': a.topic,
-                    'difficulty': a.difficulty,
-                    'assignment_type': a.assignment_type,
-                    'target_city': a.target_city,
-                    'target_school': a.target_school,
-                    'target_class': a.target_class,
-                    'deadline': a.deadline.strftime('%Y-%m-%d %H:%M') if a.deadline else None,
-                    'is_active': a.is_active,
-                    'created_at': a.created_at.strftime('%Y-%m-%d %H:%M'),
-                    'submissions_count': len(submissions),
-                    'avg_score': sum(s.percentage for s in submissions) / len(submissions) if submissions else 0
-                })
+            if limit is not None:
+                statement = statement.limit(limit).offset(offset)
+            
+            result = TEACHER_ASSIGNMENT_ROW.all(session.execute(statement))
+            for assignment in result:
+                assignment['avg_score'] = assignment['avg_score'] or 0
             
             return result
         except SQLAlchemyError as e:
             print(f"Ошибка получения заданий: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_student_assignments(self, student_id):
         """Получение заданий для ученика"""
         session = self.get_session()
         try:
-            student = session.query(User).filter(User.id == student_id).first()
+            student = session.query(
+                User.city, User.school, User.class_number
+            ).filter(User.id == student_id).first()
             if not student:
                 return []
             
-            # Получаем задания, подходящие для ученика
-            query = session.query(ClassAssignment).filter(
-                ClassAssignment.is_active == True
-            )
-            
-            if student.city:
-                query = query.filter(
-                    or_(ClassAssignment.target_city == student.city, ClassAssignment.target_city == None)
-                )
-            if student.school:
-                query = query.filter(
-                    or_(ClassAssignment.target_school == student.school, ClassAssignment.target_school == None)
-                )
-            if student.class_number:
-                query = query.filter(
-                    or_(
-                        ClassAssignment.target_class.contains(student.class_number),
-                        ClassAssignment.target_class == None
-                    )
-                )
-            
-            assignments = query.order_by(ClassAssignment.created_at.desc()).all()
+            # Задания, ответ ученика и имя учителя получаются одним запросом
+            rows = session.execute(student_assignments_query(
+                student_id, student.city, student.school, student.class_number
+            ))
             
             result = []
-            for a in assignments:
-                # Проверяем, отправил ли ученик ответ
-                submission = session.query(AssignmentSubmission).filter(
-                    and_(
-                        AssignmentSubmission.assignment_id == a.id,
-                        AssignmentSubmission.student_id == student_id
-                    )
-                ).first()
+            seen = set()
+            for assignment in STUDENT_ASSIGNMENT_ROW.all(rows):
+                # Повторный ответ ученика не должен дублировать задание в списке
+                if assignment['id'] in seen:
+                    continue
+                seen.add(assignment['id'])
                 
-                teacher = session.query(User).filter(User.id == a.teacher_id).first()
-                
-                result.append({
-                    'id': a.id,
-                    'title': a.title,
-                    'description': a.description,
-                    'subject': a.subject,
-                    'topic': a.topic,
-                    'difficulty': a.difficulty,
-                    'assignment_type': a.assignment_type,
-                    'deadline': a.deadline.strftime('%Y-%m-%d %H:%M') if a.deadline else None,
-                    'created_at': a.created_at.strftime('%Y-%m-%d %H:%M'),
-                    'teacher_name': f"{teacher.first_name} {teacher.last_name}" if teacher else "Неизвестно",
-                    'is_submitted': submission is not None,
-                    'submission': {
-                        'score': submission.score,
-                        'max_score': submission.max_score,
-                        'percentage': submission.percentage,
-                        'submitted_at': submission.submitted_at.strftime('%Y-%m-%d %H:%M')
-                    } if submission else None
-                })
+                first_name = assignment.pop('teacher_first_name')
+                last_name = assignment.pop('teacher_last_name')
+                assignment['teacher_name'] = f"{first_name} {last_name}" if first_name is not None else "Неизвестно"
+                submission = {key: assignment.pop(key) for key in ('score', 'max_score', 'percentage', 'submitted_at')}
+                assignment['is_submitted'] = assignment.pop('submission_id') is not None
+                assignment['submission'] = submission if assignment['is_submitted'] else None
+                result.append(assignment)
             
             return result
         except SQLAlchemyError as e:
             print(f"Ошибка получения заданий ученика: {e}")
             return []
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_assignment_by_id(self, assignment_id):
         """Получение задания по ID"""
         session = self.get_session()
         try:
-            assignment = session.query(ClassAssignment).filter(
-                ClassAssignment.id == assignment_id
-            ).first()
+            # Карточка задания - единственное место, где нужны вопросы и описание
+            assignment = ASSIGNMENT_ROW.one(session.execute(
+                ASSIGNMENT_ROW.select().outerjoin(
+                    User, User.id == ClassAssignment.teacher_id
+                ).where(ClassAssignment.id == assignment_id)
+            ).first())
             
             if not assignment:
                 return None
             
-            teacher = session.query(User).filter(User.id == assignment.teacher_id).first()
-            
-            return {
-                'id': assignment.id,
-                'title': assignment.title,
-                'description': assignment.description,
-                'subject': assignment.subject,
-                'topic': assignment.topic,
-                'difficulty': assignment.difficulty,
-                'assignment_type': assignment.assignment_type,
-                'questions_json': assignment.questions_json,
-                'target_city': assignment.target_city,
-                'target_school': assignment.target_school,
-                'target_class': assignment.target_class,
-                'deadline': assignment.deadline.strftime('%Y-%m-%d %H:%M') if assignment.deadline else None,
-                'is_active': assignment.is_active,
-                'created_at': assignment.created_at.strftime('%Y-%m-%d %H:%M'),
-                'teacher_id': assignment.teacher_id,
-                'teacher_name': f"{teacher.first_name} {teacher.last_name}" if teacher else "Неизвестно"
-            }
+            first_name = assignment.pop('teacher_first_name')
+            last_name = assignment.pop('teacher_last_name')
+            assignment['teacher_name'] = f"{first_name} {last_name}" if first_name is not None else "Неизвестно"
+            return assignment
         except SQLAlchemyError as e:
             print(f"Ошибка получения задания: {e}")
             return None
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def submit_assignment(self, assignment_id, student_id, answers_json, score, max_score, time_spent=0):
         """Отправка ответа на задание"""
         session = self.get_session()
         try:
-            # Проверяем, не отправлял ли ученик уже ответ
-            existing = session.query(AssignmentSubmission).filter(
-                and_(
-                    AssignmentSubmission.assignment_id == assignment_id,
-                    AssignmentSubmission.student_id == student_id
-                )
-            ).first()
-            
-            if existing:
-                return False, "Вы уже отправили ответ на это задание"
-            
             percentage = int((score / max_score) * 100) if max_score > 0 else 0
             
-            submission = AssignmentSubmission(
-                assignment_id=assignment_id,
-                student_id=student_id,
-                answers_json=answers_json,
-                score=score,
-                max_score=max_score,
-                percentage=percentage,
-                time_spent=time_spent,
-                status='submitted'
-            )
-            
-            session.add(submission)
+            # Повторный ответ отсекается уникальным индексом (задание, ученик)
+            submission_id = session.execute(
+                sqlite_insert(AssignmentSubmission).values(
+                    assignment_id=assignment_id,
+                    student_id=student_id,
+                    answers_json=answers_json,
+                    score=score,
+                    max_score=max_score,
+                    percentage=percentage,
+                    time_spent=time_spent,
+                    status='submitted'
+                ).on_conflict_do_nothing(
+                    index_elements=['assignment_id', 'student_id']
+                ).returning(AssignmentSubmission.id)
+            ).scalar()
             session.commit()
             
+            if submission_id is None:
+                return False, "Вы уже отправили ответ на это задание"
+            
             print(f"Ответ на задание {assignment_id} от ученика {student_id} отправлен")
-            return True, submission.id
+            return True, submission_id
         except SQLAlchemyError as e:
             session.rollback()
             print(f"Ошибка отправки ответа: {e}")
             return False, str(e)
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_assignment_statistics(self, assignment_id):
         """Получение статистики по заданию"""
         session = self.get_session()
         try:
-            assignment = session.query(ClassAssignment).filter(
-                ClassAssignment.id == assignment_id
-            ).first()
+            assignment = session.query(
+                ClassAssignment.title, ClassAssignment.subject, ClassAssignment.topic
+            ).filter(ClassAssignment.id == assignment_id).first()
             
             if not assignment:
                 return None
             
-            submissions = session.query(AssignmentSubmission).filter(
-                AssignmentSubmission.assignment_id == assignment_id
-            ).all()
+            totals = session.query(
+                func.count(AssignmentSubmission.id).label('total'),
+                func.avg(AssignmentSubmission.score).label('avg_score'),
+                func.avg(AssignmentSubmission.percentage).label('avg_percentage'),
+                func.avg(AssignmentSubmission.time_spent).label('avg_time'),
+                func.max(AssignmentSubmission.percentage).label('max_percentage'),
+                func.min(AssignmentSubmission.percentage).label('min_percentage')
+            ).filter(AssignmentSubmission.assignment_id == assignment_id).one()
             
-            if not submissions:
+            if not totals.total:
                 return {
                     'assignment_id': assignment_id,
                     'title': assignment.title,
@@ -1416,13 +1899,14 @@ class Database:
                     'submissions': []
                 }
             
+            submissions = session.execute(assignment_submissions_query(assignment_id)).all()
+            
             submissions_data = []
             for s in submissions:
-                student = session.query(User).filter(User.id == s.student_id).first()
                 submissions_data.append({
                     'student_id': s.student_id,
-                    'student_name': f"{student.first_name} {student.last_name}" if student else "Неизвестно",
-                    'student_class': student.class_number if student else "",
+                    'student_name': f"{s.first_name} {s.last_name}" if s.first_name is not None else "Неизвестно",
+                    'student_class': s.class_number if s.first_name is not None else "",
                     'score': s.score,
                     'max_score': s.max_score,
                     'percentage': s.percentage,
@@ -1430,90 +1914,77 @@ class Database:
                     'submitted_at': s.submitted_at.strftime('%Y-%m-%d %H:%M')
                 })
             
-            avg_score = sum(s.score for s in submissions) / len(submissions)
-            avg_percentage = sum(s.percentage for s in submissions) / len(submissions)
-            avg_time = sum(s.time_spent for s in submissions) / len(submissions)
-            
             return {
                 'assignment_id': assignment_id,
                 'title': assignment.title,
                 'subject': assignment.subject,
                 'topic': assignment.topic,
-                'total_submissions': len(submissions),
-                'avg_score': round(avg_score, 2),
-                'avg_percentage': round(avg_percentage, 2),
-                'avg_time': round(avg_time),
-                'max_score': max(s.percentage for s in submissions),
-                'min_score': min(s.percentage for s in submissions),
+                'total_submissions': totals.total,
+                'avg_score': round(totals.avg_score, 2),
+                'avg_percentage': round(totals.avg_percentage, 2),
+                'avg_time': round(totals.avg_time),
+                'max_score': totals.max_percentage,
+                'min_score': totals.min_percentage,
                 'submissions': submissions_data
             }
         except SQLAlchemyError as e:
             print(f"Ошибка получения статистики: {e}")
             return None
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def get_class_statistics(self, teacher_id, city=None, school=None, class_number=None):
         """Получение статистики по классу"""
         session = self.get_session()
         try:
-            # Получаем все задания учителя
-            assignments = session.query(ClassAssignment).filter(
-                ClassAssignment.teacher_id == teacher_id
-            )
+            params = {'teacher_id': teacher_id, 'city': city or None, 'school': school or None,
+                      'class_number': class_number or None}
+            # Строка на каждое задание под фильтром: их число и есть total_assignments
+            per_assignment = session.execute(CLASS_ASSIGNMENT_STATS, params).all()
             
-            if city:
-                assignments = assignments.filter(ClassAssignment.target_city == city)
-            if school:
-                assignments = assignments.filter(ClassAssignment.target_school == school)
-            if class_number:
-                assignments = assignments.filter(ClassAssignment.target_class.contains(class_number))
+            if not per_assignment:
+                return {'total_assignments': 0, 'students': [], 'assignments': []}
             
-            assignments = assignments.all()
+            students = session.execute(CLASS_STUDENT_STATS, params).all()
             
-            if not assignments:
-                return {'total_assignments': 0, 'students': []}
+            students_stats = []
+            for s in students:
+                known = s.first_name is not None
+                students_stats.append({
+                    'student_id': s.student_id,
+                    'name': f"{s.first_name} {s.last_name}" if known else "Неизвестно",
+                    'class': s.class_number if known else "",
+                    'total_submissions': s.total_submissions,
+                    'total_score': s.total_score,
+                    'avg_percentage': round(s.avg_percentage, 2),
+                    'min_percentage': s.min_percentage,
+                    'max_percentage': s.max_percentage,
+                    'total_time': s.total_time
+                })
             
-            # Собираем статистику по ученикам
-            students_stats = {}
-            for a in assignments:
-                submissions = session.query(AssignmentSubmission).filter(
-                    AssignmentSubmission.assignment_id == a.id
-                ).all()
-                
-                for s in submissions:
-                    if s.student_id not in students_stats:
-                        student = session.query(User).filter(User.id == s.student_id).first()
-                        students_stats[s.student_id] = {
-                            'student_id': s.student_id,
-                            'name': f"{student.first_name} {student.last_name}" if student else "Неизвестно",
-                            'class': student.class_number if student else "",
-                            'total_submissions': 0,
-                            'total_score': 0,
-                            'avg_percentage': 0
-                        }
-                    
-                    students_stats[s.student_id]['total_submissions'] += 1
-                    students_stats[s.student_id]['total_score'] += s.percentage
-            
-            # Вычисляем средние
-            for student_id in students_stats:
-                if students_stats[student_id]['total_submissions'] > 0:
-                    students_stats[student_id]['avg_percentage'] = round(
-                        students_stats[student_id]['total_score'] / students_stats[student_id]['total_submissions'],
-                        2
-                    )
+            assignments_stats = []
+            for a in per_assignment:
+                assignments_stats.append({
+                    'assignment_id': a.id,
+                    'title': a.title,
+                    'total_submissions': a.total_submissions,
+                    'avg_percentage': round(a.avg_percentage, 2) if a.total_submissions else 0,
+                    'min_percentage': a.min_percentage or 0,
+                    'max_percentage': a.max_percentage or 0,
+                    'avg_time': round(a.avg_time) if a.total_submissions else 0
+                })
             
             return {
-                'total_assignments': len(assignments),
-                'students': list(students_stats.values())
+                'total_assignments': len(per_assignment),
+                'students': students_stats,
+                'assignments': assignments_stats
             }
         except SQLAlchemyError as e:
             print(f"Ошибка получения статистики класса: {e}")
-            return {'total_assignments': 0, 'students': []}
+            return {'total_assignments': 0, 'students': [], 'assignments': []}
         finally:
-            session.close()
+            self.release_session(session)
     
     @trace
     def toggle_assignment_active(self, assignment_id, teacher_id):
@@ -1540,7 +2011,7 @@ class Database:
             print(f"Ошибка изменения статуса задания: {e}")
             return False, str(e)
         finally:
-            session.close()
+            self.release_session(session)
 
 
 db = Database()
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Проверка планов выполнения частых запросов (EXPLAIN QUERY PLAN)
+
+Запуск: python -m database.diagnostics
+"""
+import re
+from sqlalchemy import select
+from database.models import User
+
+# Строка плана вида "SCAN users" без индекса означает полный просмотр таблицы
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def hot_queries():
+    """Частые запросы Database: те же готовые выражения и построители, что выполняет database.py"""
+    # Импорт при вызове: database.database при импорте создаёт глобальный db
+    from database.database import (
+        USER_BY_EMAIL, USER_BY_ID, PENDING_STUDENT_REQUESTS, USER_NOTIFICATIONS,
+        UNREAD_NOTIFICATIONS_COUNT, UNREAD_COUNTER_RECOUNT, teachers_query, student_teachers_query,
+        teacher_students_query, students_directory_query, teacher_requests_query, user_calls_query,
+        lesson_records_query, expired_lesson_records_query, notifications_page_query,
+        CLASS_ASSIGNMENT_STATS, CLASS_STUDENT_STATS, teacher_assignments_query, student_assignments_query,
+        assignment_submissions_query
+    )
+    class_filter = {'teacher_id': 1, 'city': None, 'school': None, 'class_number': '10А'}
+    
+    return {
+        'get_students_directory': students_directory_query('Москва', 'Школа №1').limit(51),
+        'get_students_directory_by_name': students_directory_query(name_prefix='ив').limit(51),
+        'get_teachers_by_subject': teachers_query('Математика'),
+        'get_user_by_email': USER_BY_EMAIL.params(email='user@example.com'),
+        'get_user_by_id': USER_BY_ID.params(user_id=1),
+        'get_student_requests': PENDING_STUDENT_REQUESTS.params(student_id=1),
+        'get_requests_by_teacher': teacher_requests_query(1),
+        'get_student_teachers': student_teachers_query(1),
+        'get_teacher_students': teacher_students_query(1),
+        'get_user_calls_page': user_calls_query(1).limit(51),
+        'get_user_lesson_records': lesson_records_query(1),
+        'cleanup_expired_records': expired_lesson_records_query('2000-01-01', 500),
+        'get_user_notifications': USER_NOTIFICATIONS.params(user_id=1),
+        'get_notifications_page': notifications_page_query(1).limit(21),
+        'unread_notifications_count': UNREAD_NOTIFICATIONS_COUNT.params(user_id=1),
+        'mark_notification_read_buffered': UNREAD_COUNTER_RECOUNT,
+        'get_teacher_assignments': teacher_assignments_query(1),
+        'get_student_assignments': student_assignments_query(1, 'Москва', 'Школа №1', '10А'),
+        'get_assignment_statistics': assignment_submissions_query(1),
+        'get_class_statistics_by_assignment': CLASS_ASSIGNMENT_STATS.params(class_filter),
+        'get_class_statistics_by_student': CLASS_STUDENT_STATS.params(class_filter),
+    }
+
+
+def check_cache_metrics(database, user_id):
+    """Проверка, что чтение карточки пользователя учитывается в счётчиках кэша"""
+    from logger.tracer import cache_stats
+    
+    database.invalidate_user(user_id)
+    before = cache_stats().get('user', {'hits': 0, 'misses': 0})
+    database.get_user_by_id(user_id)
+    database.get_user_by_id(user_id)
+    after = cache_stats()['user']
+    if (after['misses'] - before['misses'], after['hits'] - before['hits']) != (1, 1):
+        raise AssertionError(f"Счётчики кэша не учитывают обращения: {before} -> {after}")
+    return True
+
+
+def explain_query_plan(conn, statement):
+    """Строки плана выполнения запроса"""
+    # Параметры передаются драйверу: готовые выражения содержат bindparam без типа,
+    # а для UPDATE значения не задаются вовсе (план от них не зависит)
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    params = tuple(compiled.params.get(name) for name in compiled.positiontup)
+    return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
+
+def full_scans(plan):
+    """Таблицы, которые просматриваются целиком (проход по результату подзапроса не в счёт)"""
+    subqueries = {line.split()[-1] for line in plan if line.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    return [
+        match.group(1) for line in plan
+        if (match := FULL_SCAN_PATTERN.match(line.strip())) and match.group(1) not in subqueries
+    ]
+
+
+def check_hot_queries(engine):
+    """Планы частых запросов: {имя: (использует индексы, план)}"""
+    report = {}
+    with engine.connect() as conn:
+        for name, statement in hot_queries().items():
+            plan = explain_query_plan(conn, statement)
+            report[name] = (not full_scans(plan), plan)
+    return report
+
+
+def assert_hot_queries_use_indexes(engine):
+    """Проверка, что ни один частый запрос не просматривает таблицу целиком"""
+    failed = {name: plan for name, (ok, plan) in check_hot_queries(engine).items() if not ok}
+    if failed:
+        details = "; ".join(f"{name}: {' | '.join(plan)}" for name, plan in failed.items())
+        raise AssertionError(f"Запросы без индекса: {details}")
+    return True
+
+
+if __name__ == '__main__':
+    from database.database import db
+
+    for name, (ok, plan) in check_hot_queries(db.engine).items():
+        print(f"{'OK  ' if ok else 'SCAN'} {name}")
+        for line in plan:
+            print(f"       {line}")
+    assert_hot_queries_use_indexes(db.engine)
+    
+    with db.engine.connect() as conn:
+        any_user = conn.execute(select(User.id).limit(1)).scalar()
+    if any_user is not None:
+        check_cache_metrics(db, any_user)
+        print("OK   счётчики кэша")
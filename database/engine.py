@@ -0,0 +1,53 @@
+"""
+Создание движков SQLAlchemy для SQLite с профилем PRAGMA
+"""
+from sqlalchemy import create_engine, event
+from database.settings import SQLITE_PRAGMAS
+
+
+def apply_sqlite_pragmas(engine, pragmas=None):
+    """Применение PRAGMA к каждому новому подключению движка"""
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+    
+    return engine
+
+
+def statement_cache_status(context):
+    """Состояние кэша скомпилированных выражений для выполненного запроса"""
+    dialect = context.dialect
+    return {
+        dialect.CACHE_HIT: 'hit',
+        dialect.CACHE_MISS: 'miss',
+        dialect.CACHING_DISABLED: 'disabled',
+        dialect.NO_CACHE_KEY: 'no_cache_key',
+        dialect.NO_DIALECT_SUPPORT: 'no_dialect_support',
+    }.get(context.cache_hit, 'unknown')
+
+
+def track_statement_cache(engine):
+    """Счётчики попаданий в кэш скомпилированных выражений для каждого запроса движка.
+    Подключается только к движку приложения: запросы экспортера метрик не учитываются"""
+    # Импорт при подключении: logger.exporter сам импортирует этот модуль
+    from logger.tracer import record_statement_cache
+    
+    @event.listens_for(engine, "after_cursor_execute")
+    def _record_cache_hit(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            record_statement_cache(statement_cache_status(context))
+    
+    return engine
+
+
+def create_sqlite_engine(url, pragmas=None, **kwargs):
+    """Создание движка SQLite с настроенным профилем PRAGMA"""
+    kwargs.setdefault('echo', False)
+    return apply_sqlite_pragmas(create_engine(url, **kwargs), pragmas)
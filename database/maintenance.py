@@ -0,0 +1,153 @@
+"""
+Фоновое обслуживание базы данных
+
+Раз в MAINTENANCE_INTERVAL_SECONDS удаляются просроченные автоматические записи
+уроков (вместе с видеофайлами) и прочитанные уведомления старше
+NOTIFICATION_RETENTION_DAYS. В часы низкой нагрузки дополнительно выполняются
+PRAGMA optimize и incremental_vacuum.
+
+Пути к видео внутри MEDIA_ROOT хранятся в виде /<путь от MEDIA_ROOT> - так их передаёт
+браузер (/recordings/<файл>); при записи их приводит media_url_path, при удалении файл
+находит тот же media_relative_path. Пути вне MEDIA_ROOT сохраняются, но файлы по ним не удаляются.
+Планировщик работает в одном процессе: остальные процессы (воркеры,
+перезапуск Flask) не получают файловую блокировку MAINTENANCE_LOCK_PATH.
+"""
+import time
+import threading
+from datetime import datetime
+from pathlib import Path
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка недоступна, предполагается один процесс
+    fcntl = None
+from database.settings import (
+    MEDIA_ROOT, MAINTENANCE_LOCK_PATH, MAINTENANCE_INTERVAL_SECONDS, MAINTENANCE_BATCH_SIZE, MAINTENANCE_OFF_PEAK_HOURS,
+    MAINTENANCE_VACUUM_PAGES, NOTIFICATION_RETENTION_DAYS
+)
+
+
+def media_relative_path(path, media_root=MEDIA_ROOT):
+    """Путь к файлу относительно каталога медиа: '' для пустого, None для пути вне каталога.
+    Абсолютный путь внутри MEDIA_ROOT сокращается, путь вида /recordings/x.mp4 считается от MEDIA_ROOT"""
+    if not path:
+        return ''
+    root = Path(media_root).resolve()
+    candidate = Path(str(path))
+    if not (candidate.is_absolute() and root in candidate.resolve().parents):
+        candidate = root / str(path).lstrip('/\\')
+    target = candidate.resolve()
+    if root not in target.parents:
+        return None
+    return target.relative_to(root).as_posix()
+
+
+def media_url_path(path, media_root=MEDIA_ROOT):
+    """Путь для хранения в базе: файл внутри MEDIA_ROOT - /<путь от MEDIA_ROOT>, остальные - без изменений"""
+    relative = media_relative_path(path, media_root)
+    return f"/{relative}" if relative else (path or '')
+
+
+def remove_media_file(path, media_root=MEDIA_ROOT):
+    """Удаление файла из каталога медиа; пути вне каталога не трогаются"""
+    relative = media_relative_path(path, media_root)
+    if not relative:
+        return False
+    target = Path(media_root).resolve() / relative
+    if not target.is_file():
+        return False
+    try:
+        target.unlink()
+        return True
+    except OSError as e:
+        print(f"[Maintenance] Не удалось удалить файл {target}: {e}")
+        return False
+
+
+def is_off_peak(now=None, hours=MAINTENANCE_OFF_PEAK_HOURS):
+    """Текущий час попадает в окно низкой нагрузки"""
+    start, end = hours
+    hour = (now or datetime.now()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+class MaintenanceScheduler:
+    """Периодический запуск задач обслуживания для экземпляра Database"""
+    
+    def __init__(self, database, interval=MAINTENANCE_INTERVAL_SECONDS, batch_size=MAINTENANCE_BATCH_SIZE,
+                 retention_days=NOTIFICATION_RETENTION_DAYS, vacuum_pages=MAINTENANCE_VACUUM_PAGES):
+        self.database = database
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.vacuum_pages = vacuum_pages
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+    
+    def run_once(self, housekeeping=None):
+        """Один проход обслуживания; возвращает отчёт"""
+        start = time.perf_counter()
+        records, files = self.database.delete_expired_lesson_records(self.batch_size)
+        notifications = self.database.prune_read_notifications(self.retention_days, self.batch_size)
+        
+        if housekeeping is None:
+            housekeeping = is_off_peak()
+        vacuumed = self.database.optimize_storage(self.vacuum_pages) if housekeeping else None
+        
+        report = {
+            'lesson_records': records,
+            'video_files': files,
+            'notifications': notifications,
+            'vacuum_pages': vacuumed,
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+        self.last_report = report
+        print(
+            f"[Maintenance] Записей уроков: {records}, видеофайлов: {files}, "
+            f"уведомлений: {notifications}, "
+            f"освобождено страниц: {'-' if vacuumed is None else vacuumed}, "
+            f"время: {report['seconds']} с"
+        )
+        return report
+    
+    def _acquire_lock(self, lock_path):
+        """Эксклюзивная блокировка файла; False, если обслуживание уже идёт в другом процессе"""
+        if fcntl is None:
+            return True
+        lock_file = open(lock_path, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+    
+    def start(self, lock_path=MAINTENANCE_LOCK_PATH):
+        """Запуск фонового потока обслуживания (True - запущен в этом процессе)"""
+        if self._thread is not None:
+            return False
+        if not self._acquire_lock(lock_path):
+            print("[Maintenance] Обслуживание уже запущено другим процессом")
+            return False
+        self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self._thread.start()
+        return True
+    
+    def stop(self):
+        """Остановка фонового потока и снятие блокировки"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Maintenance] Ошибка обслуживания: {e}")
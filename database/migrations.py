@@ -0,0 +1,389 @@
+"""
+Версионные миграции схемы базы данных
+
+Версия схемы хранится в PRAGMA user_version. При старте читается только она:
+если база уже на последней версии, ни create_all, ни проверки таблиц не выполняются.
+Каждый шаг миграции идемпотентен, поэтому его можно безопасно применить
+к базе, только что созданной через create_all по актуальным моделям.
+
+Перепаковка сжатых JSON-колонок: python -m database.migrations recompress
+Удаление строк-сирот: python -m database.migrations sweep-orphans
+"""
+import sys
+from sqlalchemy import text, MetaData
+from sqlalchemy.schema import CreateTable
+from database.codec import compress_text, decompress_text
+from database.models import (
+    Base, normalize_email, normalize_name, split_subjects, build_assignment_targets, User, TeacherSubject, StudentTeacherRelation,
+    TeacherRequest, Call, LessonRecord, Notification, ClassAssignment, AssignmentTarget, AssignmentSubmission,
+    UserSettings
+)
+
+
+# ==================== Вспомогательные функции ====================
+
+def get_schema_version(conn):
+    """Текущая версия схемы базы данных"""
+    return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def set_schema_version(conn, version):
+    """Сохранение версии схемы"""
+    conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+
+def column_names(conn, table):
+    """Имена столбцов таблицы"""
+    return [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def add_column(conn, table, column, ddl):
+    """Добавление столбца, если его ещё нет"""
+    if column not in column_names(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def create_index(conn, name, table, *columns):
+    """Создание индекса по явному описанию. Нужно выпущенным миграциям, чьи индексы
+    позже убраны из моделей: такая миграция должна выполняться так же, как при выпуске"""
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def create_indexes(conn, model, *names):
+    """Создание объявленных в модели индексов с указанными именами"""
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def rebuild_table(conn, model):
+    """Пересоздание таблицы по актуальной модели с сохранением данных.
+    Нужно для изменения ограничений, которые SQLite не меняет через ALTER TABLE;
+    выполняется при отключённых внешних ключах"""
+    table = model.__table__
+    new_name = f"{table.name}__new"
+    # Копия метаданных нужна, чтобы внешние ключи новой таблицы нашли родительские таблицы
+    metadata = MetaData()
+    for other in table.metadata.tables.values():
+        other.to_metadata(metadata)
+    conn.execute(CreateTable(table.to_metadata(metadata, name=new_name)))
+    existing = set(column_names(conn, table.name))
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+    conn.execute(text(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def sweep_orphans(conn, metadata=Base.metadata):
+    """Удаление строк, ссылающихся на несуществующие записи (ON DELETE SET NULL - обнуление ссылки).
+    Повторяется, пока удаление одних сирот порождает других; возвращает {таблица: строк}"""
+    result = {}
+    changed = True
+    while changed:
+        changed = False
+        for table in metadata.sorted_tables:
+            for fk in table.foreign_keys:
+                column, parent = fk.parent.name, fk.column
+                orphaned = (
+                    f"{column} IS NOT NULL AND {column} NOT IN "
+                    f"(SELECT {parent.name} FROM {parent.table.name})"
+                )
+                if fk.ondelete == 'SET NULL':
+                    sql = f"UPDATE {table.name} SET {column} = NULL WHERE {orphaned}"
+                else:
+                    sql = f"DELETE FROM {table.name} WHERE {orphaned}"
+                count = conn.execute(text(sql)).rowcount
+                if count:
+                    result[table.name] = result.get(table.name, 0) + count
+                    changed = True
+    return result
+
+
+# ==================== Шаги миграций ====================
+
+def _add_users_is_online(conn):
+    """Столбец статуса онлайн у пользователей"""
+    add_column(conn, 'users', 'is_online', 'BOOLEAN DEFAULT 0')
+
+
+def _add_users_email_normalized(conn):
+    """Нормализованный email с уникальным индексом"""
+    add_column(conn, 'users', 'email_normalized', 'VARCHAR(255)')
+    
+    rows = conn.execute(text(
+        "SELECT id, email FROM users WHERE email_normalized IS NULL ORDER BY id"
+    )).fetchall()
+    taken = {row[0] for row in conn.execute(text(
+        "SELECT email_normalized FROM users WHERE email_normalized IS NOT NULL"
+    ))}
+    for user_id, email in rows:
+        normalized = normalize_email(email)
+        # При дубликатах адрес остаётся за пользователем с меньшим ID,
+        # как и при прежнем поиске перебором
+        if not normalized or normalized in taken:
+            continue
+        taken.add(normalized)
+        conn.execute(
+            text("UPDATE users SET email_normalized = :email WHERE id = :id"),
+            {'email': normalized, 'id': user_id}
+        )
+    
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email_normalized ON users (email_normalized)"
+    ))
+
+
+def _add_foreign_key_indexes(conn):
+    """Составные индексы для частых фильтров по внешним ключам"""
+    create_indexes(conn, StudentTeacherRelation, 'ix_student_teacher_relations_teacher_student')
+    # Заменён уникальным индексом в миграции 4
+    create_index(conn, 'ix_student_teacher_relations_student_teacher',
+                 'student_teacher_relations', 'student_id', 'teacher_id')
+    create_indexes(conn, TeacherRequest,
+                   'ix_teacher_requests_student_status',
+                   'ix_teacher_requests_teacher_created')
+    create_indexes(conn, Call,
+                   'ix_calls_student_scheduled',
+                   'ix_calls_teacher_scheduled')
+    create_indexes(conn, LessonRecord,
+                   'ix_lesson_records_expires_auto',
+                   'ix_lesson_records_student_date',
+                   'ix_lesson_records_teacher_date')
+    create_indexes(conn, Notification, 'ix_notifications_user_read_created')
+    create_indexes(conn, ClassAssignment, 'ix_class_assignments_teacher_created')
+    create_indexes(conn, AssignmentSubmission, 'ix_assignment_submissions_student')
+    # Заменён уникальным индексом в миграции 8
+    create_index(conn, 'ix_assignment_submissions_assignment_student',
+                 'assignment_submissions', 'assignment_id', 'student_id')
+
+
+def _unique_student_teacher_relations(conn):
+    """Уникальность пары (ученик, учитель) в связях"""
+    conn.execute(text(
+        "DELETE FROM student_teacher_relations WHERE id NOT IN ("
+        "SELECT MIN(id) FROM student_teacher_relations GROUP BY student_id, teacher_id)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_student_teacher_relations_student_teacher"))
+    create_indexes(conn, StudentTeacherRelation, 'uq_student_teacher_relations_student_teacher')
+
+
+def _add_users_directory_indexes(conn):
+    """Индексы каталога учеников: по имени и по городу/школе/классу"""
+    create_indexes(conn, User, 'ix_users_role_name', 'ix_users_role_location')
+
+
+def _backfill_teacher_subjects(conn):
+    """Заполнение teacher_subjects из строки users.subjects"""
+    TeacherSubject.__table__.create(conn, checkfirst=True)
+    rows = conn.execute(text(
+        "SELECT id, subjects FROM users WHERE role = 'Учитель' AND subjects IS NOT NULL AND subjects != ''"
+    )).fetchall()
+    values = [
+        {'teacher_id': teacher_id, 'subject': subject}
+        for teacher_id, subjects in rows
+        for subject in split_subjects(subjects)
+    ]
+    if values:
+        conn.execute(
+            text("INSERT OR IGNORE INTO teacher_subjects (teacher_id, subject) VALUES (:teacher_id, :subject)"),
+            values
+        )
+
+
+def _backfill_assignment_targets(conn):
+    """Заполнение assignment_targets из target_city/target_school/target_class"""
+    AssignmentTarget.__table__.create(conn, checkfirst=True)
+    rows = conn.execute(text(
+        "SELECT id, target_city, target_school, target_class FROM class_assignments "
+        "WHERE id NOT IN (SELECT assignment_id FROM assignment_targets)"
+    )).fetchall()
+    values = [
+        {'assignment_id': assignment_id, **target}
+        for assignment_id, city, school, target_class in rows
+        for target in build_assignment_targets(city, school, target_class)
+    ]
+    if values:
+        conn.execute(
+            text(
+                "INSERT INTO assignment_targets (assignment_id, city, school, class_number) "
+                "VALUES (:assignment_id, :city, :school, :class_number)"
+            ),
+            values
+        )
+
+
+def _unique_pending_requests_and_submissions(conn):
+    """Уникальность ожидающих заявок и ответов ученика на задание"""
+    conn.execute(text(
+        "DELETE FROM teacher_requests WHERE status = 'pending' AND id NOT IN ("
+        "SELECT MIN(id) FROM teacher_requests WHERE status = 'pending' GROUP BY teacher_id, student_id)"
+    ))
+    create_indexes(conn, TeacherRequest, 'uq_teacher_requests_pending')
+    
+    conn.execute(text(
+        "DELETE FROM assignment_submissions WHERE id NOT IN ("
+        "SELECT MIN(id) FROM assignment_submissions GROUP BY assignment_id, student_id)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_assignment_submissions_assignment_student"))
+    create_indexes(conn, AssignmentSubmission, 'uq_assignment_submissions_assignment_student')
+
+
+def _cascade_foreign_keys(conn):
+    """ON DELETE CASCADE во внешних ключах: удаление сирот и пересоздание таблиц"""
+    swept = sweep_orphans(conn)
+    if swept:
+        print(f"[Migrations] Удалены строки-сироты: {swept}")
+    for model in (TeacherSubject, StudentTeacherRelation, TeacherRequest, Call, LessonRecord, Notification,
+                  ClassAssignment, AssignmentTarget, AssignmentSubmission, UserSettings):
+        rebuild_table(conn, model)
+    violations = conn.execute(text("PRAGMA foreign_key_check")).fetchall()
+    if violations:
+        raise RuntimeError(f"Нарушены внешние ключи после пересоздания таблиц: {violations[:10]}")
+
+
+def _add_unread_notifications_counter(conn):
+    """Счётчик непрочитанных уведомлений у пользователей и индекс ленты уведомлений"""
+    add_column(conn, 'users', 'unread_notifications', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(text(
+        "UPDATE users SET unread_notifications = ("
+        "SELECT COUNT(*) FROM notifications "
+        "WHERE notifications.user_id = users.id AND notifications.is_read = 0)"
+    ))
+    create_indexes(conn, Notification, 'ix_notifications_user_created')
+
+
+def _add_users_normalized_names(conn):
+    """Имена без учёта регистра для поиска в каталоге учеников"""
+    add_column(conn, 'users', 'first_name_normalized', 'VARCHAR(100)')
+    add_column(conn, 'users', 'last_name_normalized', 'VARCHAR(100)')
+    rows = conn.execute(text("SELECT id, first_name, last_name FROM users")).fetchall()
+    if rows:
+        conn.execute(
+            text("UPDATE users SET first_name_normalized = :first, last_name_normalized = :last WHERE id = :id"),
+            [{'id': row[0], 'first': normalize_name(row[1]), 'last': normalize_name(row[2])} for row in rows]
+        )
+    create_indexes(conn, User, 'ix_users_role_first_name_normalized', 'ix_users_role_last_name_normalized')
+
+
+def _add_users_last_seen(conn):
+    """Время последнего heartbeat: статус онлайн выводится из него, а не из is_online"""
+    add_column(conn, 'users', 'last_seen', 'DATETIME')
+
+
+def _add_submission_stats_index(conn):
+    """Покрывающий индекс ответов для статистики класса"""
+    create_indexes(conn, AssignmentSubmission, 'ix_assignment_submissions_stats')
+
+
+# Упорядоченный список миграций: (версия, описание, функция)
+MIGRATIONS = [
+    (1, "users.is_online", _add_users_is_online),
+    (2, "users.email_normalized", _add_users_email_normalized),
+    (3, "индексы внешних ключей", _add_foreign_key_indexes),
+    (4, "уникальные связи ученик-учитель", _unique_student_teacher_relations),
+    (5, "индексы каталога учеников", _add_users_directory_indexes),
+    (6, "таблица предметов учителей", _backfill_teacher_subjects),
+    (7, "таблица адресатов заданий", _backfill_assignment_targets),
+    (8, "уникальные ожидающие заявки и ответы на задания", _unique_pending_requests_and_submissions),
+    (9, "каскадное удаление по внешним ключам", _cascade_foreign_keys),
+    (10, "счётчик непрочитанных уведомлений", _add_unread_notifications_counter),
+    (11, "имена для поиска без учёта регистра", _add_users_normalized_names),
+    (12, "users.last_seen", _add_users_last_seen),
+    (13, "индекс статистики ответов", _add_submission_stats_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ==================== Применение ====================
+
+def migrate(engine, metadata):
+    """Приведение схемы базы данных к последней версии"""
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    
+    if version >= SCHEMA_VERSION:
+        return version
+    
+    metadata.create_all(bind=engine)
+    
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        with engine.connect() as conn:
+            # Пересоздание таблиц требует отключённых внешних ключей;
+            # PRAGMA foreign_keys действует только вне транзакции
+            conn.execute(text("PRAGMA foreign_keys = OFF"))
+            conn.commit()
+            try:
+                with conn.begin():
+                    step(conn)
+                    set_schema_version(conn, step_version)
+            finally:
+                conn.execute(text("PRAGMA foreign_keys = ON"))
+                conn.commit()
+        print(f"[Migrations] Применена миграция {step_version}: {description}")
+        version = step_version
+    
+    return version
+
+
+# ==================== Сжатие JSON-колонок ====================
+
+# Колонки с типом CompressedJSON: (таблица, столбец)
+COMPRESSED_COLUMNS = [
+    ('class_assignments', 'questions_json'),
+    ('assignment_submissions', 'answers_json'),
+]
+
+
+def recompress_json_columns(engine, batch_size=500, columns=COMPRESSED_COLUMNS):
+    """Перепаковка сохранённого JSON в текущий формат сжатия пакетами по batch_size строк"""
+    result = {}
+    for table, column in columns:
+        last_id = 0
+        changed = 0
+        while True:
+            # Каждый пакет - отдельная короткая транзакция, чтобы не блокировать запись надолго
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    text(f"SELECT id, {column} FROM {table} WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                    {'last_id': last_id, 'limit': batch_size}
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for row_id, value in rows:
+                    packed = compress_text(decompress_text(value))
+                    if packed != value:
+                        updates.append({'id': row_id, 'value': packed})
+                if updates:
+                    conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), updates)
+            changed += len(updates)
+            last_id = rows[-1][0]
+        result[f"{table}.{column}"] = changed
+    return result
+
+
+def vacuum(engine):
+    """Возврат освободившихся страниц файлу базы данных"""
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("VACUUM"))
+
+
+if __name__ == '__main__':
+    # Запуск: python -m database.migrations recompress
+    from database.database import db
+    
+    if sys.argv[1:] == ['recompress']:
+        for column, changed in recompress_json_columns(db.engine).items():
+            print(f"[Migrations] {column}: перепаковано строк: {changed}")
+        vacuum(db.engine)
+    elif sys.argv[1:] == ['sweep-orphans']:
+        with db.engine.begin() as conn:
+            swept = sweep_orphans(conn)
+        print(f"[Migrations] Удалены строки-сироты: {swept or 'нет'}")
+    else:
+        print("Использование: python -m database.migrations recompress | sweep-orphans")
@@ -1,53 +1,112 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, text, select, union, and_, or_, func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, backref, deferred
 from datetime import datetime
+from database.codec import CompressedJSON
 
 Base = declarative_base()
 
+
+def normalize_email(email):
+    """Нормализация email для хранения и поиска"""
+    return email.strip().lower() if email else ''
+
+
+def normalize_name(name):
+    """Имя для поиска без учёта регистра (casefold понимает кириллицу, в отличие от NOCASE и lower() SQLite)"""
+    return name.strip().casefold() if name else ''
+
+
+def split_subjects(subjects):
+    """Список предметов учителя из строки через запятую (без пустых и повторов)"""
+    result = []
+    for subject in (subjects or '').split(','):
+        subject = subject.strip()
+        if subject and subject not in result:
+            result.append(subject)
+    return result
+
+
+def build_assignment_targets(city, school, target_class):
+    """Строки assignment_targets для задания ('' означает «любой»)"""
+    classes = [c.strip() for c in (target_class or '').split(',') if c.strip()] or ['']
+    return [
+        {'city': (city or '').strip(), 'school': (school or '').strip(), 'class_number': class_number}
+        for class_number in dict.fromkeys(classes)
+    ]
+
+
 class User(Base):
     """Модель пользователя"""
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_role_name', 'role', 'first_name', 'last_name', 'id'),
+        Index('ix_users_role_location', 'role', 'city', 'school', 'class_number', 'first_name', 'last_name'),
+        Index('ix_users_role_first_name_normalized', 'role', 'first_name_normalized'),
+        Index('ix_users_role_last_name_normalized', 'role', 'last_name_normalized'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     email = Column(String(255), unique=True, nullable=False)
+    email_normalized = Column(String(255), unique=True, index=True)  # email.strip().lower() для поиска по индексу
     password_hash = Column(String(255), nullable=False)
     first_name = Column(String(100), nullable=False)
     last_name = Column(String(100), nullable=False)
+    first_name_normalized = Column(String(100))  # normalize_name(first_name) для поиска по префиксу
+    last_name_normalized = Column(String(100))
     role = Column(String(10), nullable=False)
     city = Column(String(100))
     school = Column(String(255))
     class_number = Column(String(10))  # Для учеников
     subjects = Column(Text)  # Для учителей (через запятую)
-    is_online = Column(Boolean, default=False)  # Статус онлайн/офлайн
+    is_online = Column(Boolean, default=False)  # Устарел: статус выводится из last_seen
+    last_seen = Column(DateTime)  # последний heartbeat (UTC), пишется пакетно из PresenceTracker
+    unread_notifications = Column(Integer, nullable=False, default=0, server_default='0')  # Счётчик непрочитанных уведомлений
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
     # Как ученик
-    student_relations = relationship("StudentTeacherRelation", foreign_keys="StudentTeacherRelation.student_id", back_populates="student")
-    student_requests = relationship("TeacherRequest", foreign_keys="TeacherRequest.student_id", back_populates="student")
-    student_calls = relationship("Call", foreign_keys="Call.student_id", back_populates="student")
-    student_lessons = relationship("LessonRecord", foreign_keys="LessonRecord.student_id", back_populates="student")
+    student_relations = relationship("StudentTeacherRelation", foreign_keys="StudentTeacherRelation.student_id", back_populates="student", passive_deletes=True)
+    student_requests = relationship("TeacherRequest", foreign_keys="TeacherRequest.student_id", back_populates="student", passive_deletes=True)
+    student_calls = relationship("Call", foreign_keys="Call.student_id", back_populates="student", passive_deletes=True)
+    student_lessons = relationship("LessonRecord", foreign_keys="LessonRecord.student_id", back_populates="student", passive_deletes=True)
     
     # Как учитель
-    teacher_relations = relationship("StudentTeacherRelation", foreign_keys="StudentTeacherRelation.teacher_id", back_populates="teacher")
-    teacher_requests = relationship("TeacherRequest", foreign_keys="TeacherRequest.teacher_id", back_populates="teacher")
-    teacher_calls = relationship("Call", foreign_keys="Call.teacher_id", back_populates="teacher")
-    teacher_lessons = relationship("LessonRecord", foreign_keys="LessonRecord.teacher_id", back_populates="teacher")
+    teacher_relations = relationship("StudentTeacherRelation", foreign_keys="StudentTeacherRelation.teacher_id", back_populates="teacher", passive_deletes=True)
+    teacher_requests = relationship("TeacherRequest", foreign_keys="TeacherRequest.teacher_id", back_populates="teacher", passive_deletes=True)
+    teacher_calls = relationship("Call", foreign_keys="Call.teacher_id", back_populates="teacher", passive_deletes=True)
+    teacher_lessons = relationship("LessonRecord", foreign_keys="LessonRecord.teacher_id", back_populates="teacher", passive_deletes=True)
     
     # Уведомления
-    notifications = relationship("Notification", back_populates="user")
+    notifications = relationship("Notification", back_populates="user", passive_deletes=True)
     
     def __repr__(self):
         return f"<User(id={self.id}, email='{self.email}', role='{self.role}')>"
 
+class TeacherSubject(Base):
+    """Модель предмета учителя (нормализованный User.subjects)"""
+    __tablename__ = 'teacher_subjects'
+    __table_args__ = (
+        Index('ix_teacher_subjects_subject', 'subject', 'teacher_id'),
+    )
+    
+    teacher_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    subject = Column(String(100), primary_key=True)
+    
+    def __repr__(self):
+        return f"<TeacherSubject(teacher_id={self.teacher_id}, subject='{self.subject}')>"
+
 class StudentTeacherRelation(Base):
     """Модель связи ученик-учитель"""
     __tablename__ = 'student_teacher_relations'
+    __table_args__ = (
+        Index('ix_student_teacher_relations_teacher_student', 'teacher_id', 'student_id'),
+        Index('uq_student_teacher_relations_student_teacher', 'student_id', 'teacher_id', unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    student_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    teacher_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    student_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    teacher_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
@@ -60,10 +119,16 @@ class StudentTeacherRelation(Base):
 class TeacherRequest(Base):
     """Модель заявки от учителя к ученику"""
     __tablename__ = 'teacher_requests'
+    __table_args__ = (
+        Index('ix_teacher_requests_student_status', 'student_id', 'status', 'created_at'),
+        Index('ix_teacher_requests_teacher_created', 'teacher_id', 'created_at'),
+        Index('uq_teacher_requests_pending', 'teacher_id', 'student_id', unique=True,
+              sqlite_where=text("status = 'pending'")),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    teacher_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    student_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    teacher_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    student_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     status = Column(String(20), default='pending')  # pending, accepted, rejected
     message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -79,10 +144,14 @@ class TeacherRequest(Base):
 class Call(Base):
     """Модель звонка"""
     __tablename__ = 'calls'
+    __table_args__ = (
+        Index('ix_calls_student_scheduled', 'student_id', 'scheduled_time'),
+        Index('ix_calls_teacher_scheduled', 'teacher_id', 'scheduled_time'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    student_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    teacher_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    student_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    teacher_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     scheduled_time = Column(DateTime)
     actual_start_time = Column(DateTime)
     actual_end_time = Column(DateTime)
@@ -95,7 +164,7 @@ class Call(Base):
     # Связи
     student = relationship("User", foreign_keys=[student_id], back_populates="student_calls")
     teacher = relationship("User", foreign_keys=[teacher_id], back_populates="teacher_calls")
-    lesson_records = relationship("LessonRecord", back_populates="call")
+    lesson_records = relationship("LessonRecord", back_populates="call", passive_deletes=True)
     
     def __repr__(self):
         return f"<Call(id={self.id}, student_id={self.student_id}, teacher_id={self.teacher_id}, status='{self.status}')>"
@@ -103,19 +172,25 @@ class Call(Base):
 class LessonRecord(Base):
     """Модель записи урока"""
     __tablename__ = 'lesson_records'
+    __table_args__ = (
+        Index('ix_lesson_records_expires_auto', 'expires_at', 'is_auto_created'),
+        Index('ix_lesson_records_student_date', 'student_id', 'lesson_date'),
+        Index('ix_lesson_records_teacher_date', 'teacher_id', 'lesson_date'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    student_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    teacher_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    student_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    teacher_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     lesson_title = Column(String(255), nullable=False)
     lesson_date = Column(DateTime)
     subject = Column(String(100))
     video_url = Column(Text)
     video_file_path = Column(Text)
-    description = Column(Text)
-    homework = Column(Text)
+    # Крупные тексты загружаются только при обращении к ним (группа 'content')
+    description = deferred(Column(Text), group='content')
+    homework = deferred(Column(Text), group='content')
     is_auto_created = Column(Boolean, default=False)  # Автоматически созданная запись от звонка
-    call_id = Column(Integer, ForeignKey('calls.id'))
+    call_id = Column(Integer, ForeignKey('calls.id', ondelete='SET NULL'))
     expires_at = Column(DateTime)  # Для автоматических записей (2 дня)
     created_at = Column(DateTime, default=datetime.utcnow)
     
@@ -127,9 +202,14 @@ class LessonRecord(Base):
     @property
     def availability_status(self):
         """Статус доступности записи"""
-        if self.expires_at is None:
+        return self.availability_for(self.expires_at)
+    
+    @staticmethod
+    def availability_for(expires_at):
+        """Статус доступности записи по сроку хранения"""
+        if expires_at is None:
             return 'permanent'
-        elif self.expires_at > datetime.utcnow():
+        elif expires_at > datetime.utcnow():
             return 'available'
         else:
             return 'expired'
@@ -140,9 +220,13 @@ class LessonRecord(Base):
 class Notification(Base):
     """Модель уведомления"""
     __tablename__ = 'notifications'
+    __table_args__ = (
+        Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+        Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     title = Column(String(255), nullable=False)
     message = Column(Text, nullable=False)
     is_read = Column(Boolean, default=False)
@@ -158,16 +242,19 @@ class Notification(Base):
 class ClassAssignment(Base):
     """Модель задания для класса от учителя"""
     __tablename__ = 'class_assignments'
+    __table_args__ = (
+        Index('ix_class_assignments_teacher_created', 'teacher_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    teacher_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    teacher_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     title = Column(String(255), nullable=False)
-    description = Column(Text)
+    description = deferred(Column(Text), group='content')
     subject = Column(String(100))
     topic = Column(String(255))
     difficulty = Column(String(50), default='Средний')  # Лёгкий, Средний, Хардкор
     assignment_type = Column(String(50), default='test')  # test, practice, homework
-    questions_json = Column(Text)  # JSON с вопросами теста
+    questions_json = deferred(Column(CompressedJSON), group='content')  # JSON с вопросами теста
     target_city = Column(String(100))
     target_school = Column(String(255))
     target_class = Column(String(50))  # Класс или несколько классов через запятую
@@ -177,20 +264,48 @@ class ClassAssignment(Base):
     
     # Связи
     teacher = relationship("User", foreign_keys=[teacher_id])
-    submissions = relationship("AssignmentSubmission", back_populates="assignment")
+    submissions = relationship("AssignmentSubmission", back_populates="assignment", passive_deletes=True)
+    targets = relationship("AssignmentTarget", back_populates="assignment", passive_deletes=True)
     
     def __repr__(self):
         return f"<ClassAssignment(id={self.id}, title='{self.title}', teacher_id={self.teacher_id})>"
 
 
+class AssignmentTarget(Base):
+    """Модель адресата задания: город, школа и класс (пустая строка - любой)"""
+    __tablename__ = 'assignment_targets'
+    __table_args__ = (
+        Index('ix_assignment_targets_location', 'city', 'school', 'class_number', 'assignment_id'),
+        Index('ix_assignment_targets_assignment_class', 'assignment_id', 'class_number'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    assignment_id = Column(Integer, ForeignKey('class_assignments.id', ondelete='CASCADE'), nullable=False)
+    city = Column(String(100), nullable=False, default='')
+    school = Column(String(255), nullable=False, default='')
+    class_number = Column(String(10), nullable=False, default='')
+    
+    # Связи
+    assignment = relationship("ClassAssignment", back_populates="targets")
+    
+    def __repr__(self):
+        return f"<AssignmentTarget(assignment_id={self.assignment_id}, city='{self.city}', school='{self.school}', class_number='{self.class_number}')>"
+
+
 class AssignmentSubmission(Base):
     """Модель ответа ученика на задание"""
     __tablename__ = 'assignment_submissions'
+    __table_args__ = (
+        Index('uq_assignment_submissions_assignment_student', 'assignment_id', 'student_id', unique=True),
+        Index('ix_assignment_submissions_student', 'student_id'),
+        # Покрывающий индекс статистики класса: агрегаты считаются без чтения строк таблицы
+        Index('ix_assignment_submissions_stats', 'assignment_id', 'student_id', 'percentage', 'time_spent'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    assignment_id = Column(Integer, ForeignKey('class_assignments.id'), nullable=False)
-    student_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    answers_json = Column(Text)  # JSON с ответами ученика
+    assignment_id = Column(Integer, ForeignKey('class_assignments.id', ondelete='CASCADE'), nullable=False)
+    student_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    answers_json = deferred(Column(CompressedJSON), group='content')  # JSON с ответами ученика
     score = Column(Integer, default=0)
     max_score = Column(Integer, default=0)
     percentage = Column(Integer, default=0)  # Процент правильных ответов
@@ -213,7 +328,7 @@ class UserSettings(Base):
     __tablename__ = 'user_settings'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, unique=True)
     theme = Column(String(20), default='light')  # light, dark
     font_size = Column(String(20), default='medium')  # small, medium, large
     notifications_enabled = Column(Boolean, default=True)
@@ -222,7 +337,7 @@ class UserSettings(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связи
-    user = relationship("User", backref="settings")
+    user = relationship("User", backref=backref("settings", passive_deletes=True))
     
     def __repr__(self):
         return f"<UserSettings(user_id={self.user_id}, theme='{self.theme}')>"
@@ -247,3 +362,35 @@ class UserSettings(Base):
             'sound_enabled': True,
             'language': 'ru'
         }
+
+
+def email_matches(email):
+    """Условие поиска пользователя по нормализованному email
+
+    Миграция 2 оставила email_normalized = NULL у пользователей, чей адрес после
+    нормализации совпал с адресом пользователя с меньшим ID: их адрес сравнивается
+    по исходному полю email. Обе ветви идут по индексу ix_users_email_normalized.
+    """
+    return or_(
+        User.email_normalized == email,
+        and_(User.email_normalized.is_(None), func.lower(func.trim(User.email)) == email)
+    )
+
+
+# Владелец нормализованного адреса раньше пользователей, оставшихся без него
+EMAIL_MATCH_ORDER = (User.email_normalized.is_(None), User.id)
+
+
+def name_prefix_ids(prefix):
+    """id учеников, у которых имя или фамилия начинается с нормализованного префикса
+
+    Два диапазона объединены через UNION, чтобы каждый шёл по своему индексу (role, *_normalized):
+    с OR и сортировкой по имени SQLite предпочитает перебор по ix_users_role_name.
+    """
+    upper = prefix + '\uffff'
+    return union(
+        select(User.id).where(User.role == 'Ученик', User.first_name_normalized >= prefix,
+                              User.first_name_normalized < upper),
+        select(User.id).where(User.role == 'Ученик', User.last_name_normalized >= prefix,
+                              User.last_name_normalized < upper)
+    )
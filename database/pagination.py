@@ -0,0 +1,46 @@
+"""
+Курсоры для keyset-пагинации
+
+Курсор - непрозрачная строка с ключом сортировки последней строки страницы.
+Следующая страница выбирается условием по индексу, а не через OFFSET,
+поэтому её стоимость не растёт с номером страницы.
+"""
+import base64
+import json
+from datetime import datetime
+
+DATETIME_MARKER = '$dt'
+
+
+def _encode_value(value):
+    """Значение ключа сортировки в JSON-совместимом виде"""
+    if isinstance(value, datetime):
+        return {DATETIME_MARKER: value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    """Восстановление значения ключа сортировки"""
+    if isinstance(value, dict) and DATETIME_MARKER in value:
+        return datetime.fromisoformat(value[DATETIME_MARKER])
+    return value
+
+
+def encode_cursor(*values):
+    """Курсор из значений ключа сортировки"""
+    raw = json.dumps([_encode_value(v) for v in values], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    """Значения ключа сортировки из курсора (None, если курсор пуст или повреждён)"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != size:
+            return None
+        # Курсор приходит из query-параметра: подделанные значения дают None, а не исключение
+        return [_decode_value(v) for v in values]
+    except (ValueError, TypeError):
+        return None
@@ -0,0 +1,96 @@
+"""
+Реестр присутствия пользователей в памяти
+
+Браузер периодически отправляет heartbeat; время последнего heartbeat копится
+в памяти и записывается в users.last_seen пакетом по таймеру. Пользователь
+онлайн, пока last_seen не старше PRESENCE_TTL_SECONDS: статус не хранится,
+а выводится из времени, поэтому запись, оставшаяся от упавшего процесса,
+устаревает сама.
+
+Реестр живёт в памяти одного процесса. При нескольких воркерах каждый видит
+только heartbeat, пришедшие к нему; heartbeat из другого воркера становится
+виден через users.last_seen с задержкой до PRESENCE_FLUSH_INTERVAL_SECONDS.
+"""
+import threading
+from datetime import datetime, timedelta
+from database.settings import PRESENCE_TTL_SECONDS, PRESENCE_FLUSH_INTERVAL_SECONDS
+
+
+class PresenceTracker:
+    """Потокобезопасный реестр «пользователь -> время последнего heartbeat» (UTC)"""
+    
+    def __init__(self, ttl=PRESENCE_TTL_SECONDS, flush_interval=PRESENCE_FLUSH_INTERVAL_SECONDS):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._last_seen = {}
+        self._changes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def touch(self, user_id):
+        """Heartbeat пользователя"""
+        now = datetime.utcnow()
+        with self._lock:
+            self._last_seen[user_id] = now
+            self._changes[user_id] = now
+    
+    def set_offline(self, user_id):
+        """Явный выход пользователя: last_seen стирается при следующей записи"""
+        with self._lock:
+            self._last_seen.pop(user_id, None)
+            self._changes[user_id] = None
+    
+    def is_online(self, user_id, stored=False):
+        """Статус с учётом этого процесса; stored - статус по users.last_seen"""
+        deadline = datetime.utcnow() - timedelta(seconds=self.ttl)
+        with self._lock:
+            if user_id in self._changes and self._changes[user_id] is None:
+                return False
+            seen = self._last_seen.get(user_id)
+        return bool(stored) or (seen is not None and seen >= deadline)
+    
+    def annotate(self, users):
+        """Копии словарей пользователей с is_online: статус по last_seen и heartbeat этого процесса"""
+        return [{**user, 'is_online': self.is_online(user['id'], user.get('is_online'))} for user in users]
+    
+    def expire(self):
+        """Удаление из памяти пользователей без heartbeat дольше ttl"""
+        deadline = datetime.utcnow() - timedelta(seconds=self.ttl)
+        with self._lock:
+            for user_id in [u for u, seen in self._last_seen.items() if seen < deadline]:
+                del self._last_seen[user_id]
+    
+    def drain(self):
+        """Накопленные изменения: {user_id: last_seen или None после выхода}"""
+        self.expire()
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        return changes
+    
+    def start(self, flush):
+        """Запуск потока, вызывающего flush() раз в flush_interval секунд (True - запущен сейчас)"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(flush,), name='presence-flush', daemon=True)
+        self._thread.start()
+        return True
+    
+    def stop(self, flush):
+        """Остановка фонового потока и запись накопленных heartbeat
+        
+        Пользователи не переводятся в офлайн: их могут обслуживать другие процессы,
+        а статус устареет сам через ttl
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        flush()
+    
+    def _run(self, flush):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                flush()
+            except Exception as e:
+                print(f"[Presence] Ошибка записи статусов: {e}")
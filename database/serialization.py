@@ -0,0 +1,52 @@
+"""
+Преобразование строк Core-запросов select() в словари ответа
+
+Набор колонок фиксируется один раз, поэтому на каждую строку приходится
+только zip ключей со значениями и форматирование колонок DateTime.
+Форматы дат задаются здесь, чтобы все методы Database отдавали их одинаково.
+"""
+from sqlalchemy import select, DateTime
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATETIME_MINUTES_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def format_datetime(value, fmt=DATETIME_FORMAT):
+    """Дата и время строкой; None остаётся None"""
+    return value.strftime(fmt) if value is not None else None
+
+
+class RowSerializer:
+    """Словари из строк select() по фиксированному набору колонок"""
+    
+    def __init__(self, *columns, datetime_format=DATETIME_FORMAT):
+        self.columns = columns
+        self.keys = tuple(column.key for column in columns)
+        self.datetime_format = datetime_format
+        self._datetime_indexes = tuple(
+            index for index, column in enumerate(columns) if isinstance(column.type, DateTime)
+        )
+    
+    def select(self):
+        """select() по колонкам сериализатора"""
+        return select(*self.columns)
+    
+    def one(self, row):
+        """Словарь из одной строки; None для отсутствующей строки"""
+        if row is None:
+            return None
+        if not self._datetime_indexes:
+            return dict(zip(self.keys, row))
+        values = list(row)
+        for index in self._datetime_indexes:
+            if values[index] is not None:
+                values[index] = values[index].strftime(self.datetime_format)
+        return dict(zip(self.keys, values))
+    
+    def all(self, rows):
+        """Список словарей из строк результата"""
+        keys = self.keys
+        if not self._datetime_indexes:
+            return [dict(zip(keys, row)) for row in rows]
+        one = self.one
+        return [one(row) for row in rows]
@@ -5,4 +5,48 @@ DATABASE_NAME = "users.db"
 DATABASE_PATH = DATABASE_DIR / DATABASE_NAME
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 SESSION_STATE_KEY = "user_session"
-USER_ROLES = ["Ученик", "Учитель"]
\ No newline at end of file
+USER_ROLES = ["Ученик", "Учитель"]
+
+# Профиль PRAGMA, применяемый к каждому новому подключению SQLite
+SQLITE_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",  # для новых баз; существующие переключаются после VACUUM
+    "journal_mode": "WAL",      # читатели не блокируются записью
+    "synchronous": "NORMAL",    # в режиме WAL безопасно и без fsync на каждый коммит
+    "cache_size": -64000,       # отрицательное значение - размер в КиБ (~64 МБ)
+    "mmap_size": 268435456,     # 256 МБ отображаемой в память базы
+    "busy_timeout": 5000,       # мс ожидания блокировки вместо немедленной ошибки
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",       # ON DELETE CASCADE / SET NULL выполняются самой SQLite
+}
+
+# Кэш чтения пользователей и связей
+CACHE_TTL_SECONDS = 30
+CACHE_MAX_SIZE = 4096
+
+# Сжатие JSON вопросов и ответов: "zlib" (стандартная библиотека) или "zstd".
+# zstd включается явно и требует pip install zstandard на каждом хосте, который читает базу:
+# без пакета значения, сжатые zstd, не прочитать
+JSON_COMPRESSION = "zlib"
+JSON_COMPRESSION_LEVEL = 6
+JSON_COMPRESSION_MIN_SIZE = 256  # байт; более короткие значения хранятся как текст
+
+# Присутствие пользователей: heartbeat из браузера и пакетная запись времени в users.last_seen
+PRESENCE_TTL_SECONDS = 90            # без heartbeat дольше этого пользователь считается офлайн
+PRESENCE_FLUSH_INTERVAL_SECONDS = 15
+
+# Обслуживание базы данных в фоне
+MEDIA_ROOT = DATABASE_DIR.parent / "media"  # корень путей video_file_path и recording_path
+RECORDINGS_DIR = MEDIA_ROOT / "recordings"  # записи звонков: пути вида /recordings/<файл>
+MAINTENANCE_ENABLED = True
+MAINTENANCE_LOCK_PATH = DATABASE_DIR / "maintenance.lock"  # обслуживание выполняет один процесс
+MAINTENANCE_INTERVAL_SECONDS = 3600
+MAINTENANCE_BATCH_SIZE = 500
+MAINTENANCE_OFF_PEAK_HOURS = (2, 5)  # [начало, конец) по локальному времени сервера
+MAINTENANCE_VACUUM_PAGES = 1000
+NOTIFICATION_RETENTION_DAYS = 30
+
+# Групповой коммит мелких записей (статус онлайн, уведомления, прочтение, настройки).
+# Выключен по умолчанию: после записи её результат виден чтению только после сброса буфера
+WRITE_BUFFER_ENABLED = False
+WRITE_BUFFER_FLUSH_INTERVAL_MS = 50
+WRITE_BUFFER_MAX_ROWS = 200
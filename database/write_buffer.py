@@ -0,0 +1,138 @@
+"""
+Буфер отложенной записи с групповым коммитом
+
+Мелкие некритичные записи (статус онлайн, уведомления, отметки о прочтении,
+настройки) копятся в памяти и фиксируются одной транзакцией раз в
+WRITE_BUFFER_FLUSH_INTERVAL_MS или сразу по достижении WRITE_BUFFER_MAX_ROWS строк.
+Один коммит на пакет вместо коммита на каждую строку.
+
+При сбросе одинаковые выражения выполняются одним executemany в порядке
+первого появления, порядок строк внутри выражения сохраняется. Поэтому в буфер
+ставятся только записи, результат которых не зависит от порядка разных выражений.
+
+add() возвращает Future: он завершается после коммита пакета или с ошибкой,
+если запись не удалась и при повторе по одной операции.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from sqlalchemy.exc import SQLAlchemyError
+from database.settings import WRITE_BUFFER_FLUSH_INTERVAL_MS, WRITE_BUFFER_MAX_ROWS
+from logger.tracer import record_write_buffer_depth, record_write_buffer_batch, record_write_buffer_error
+
+
+class WriteBuffer:
+    """Потокобезопасная очередь записей (выражение, параметры) с периодическим групповым коммитом"""
+    
+    def __init__(self, engine, flush_interval_ms=WRITE_BUFFER_FLUSH_INTERVAL_MS, max_rows=WRITE_BUFFER_MAX_ROWS):
+        self.engine = engine
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self._entries = []
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'batches': 0, 'rows': 0, 'max_batch': 0, 'errors': 0}
+    
+    def add(self, *writes):
+        """Постановка в очередь записей (выражение, параметры); все они попадут в одну транзакцию
+        
+        Возвращает Future с количеством записанных строк или исключением записи
+        """
+        future = Future()
+        with self._lock:
+            self._entries.append((writes, future))
+            self._rows += len(writes)
+            full = self._rows >= self.max_rows
+        record_write_buffer_depth(len(writes))
+        if full:
+            self._wakeup.set()
+        return future
+    
+    @property
+    def depth(self):
+        """Количество строк, ожидающих записи"""
+        return self._rows
+    
+    def _drain(self):
+        """Забрать все накопленные записи"""
+        with self._lock:
+            entries, self._entries = self._entries, []
+            rows, self._rows = self._rows, 0
+        if rows:
+            record_write_buffer_depth(-rows)
+        return entries, rows
+    
+    @staticmethod
+    def _group(entries):
+        """Параметры по выражениям в порядке первого появления: {выражение: [параметры, ...]}"""
+        groups = OrderedDict()
+        for writes, _ in entries:
+            for statement, params in writes:
+                groups.setdefault(statement, []).append(params)
+        return groups
+    
+    def _execute(self, entries):
+        """Запись пакета одной транзакцией"""
+        with self.engine.begin() as conn:
+            for statement, params in self._group(entries).items():
+                conn.execute(statement, params)
+    
+    def flush(self):
+        """Синхронная запись всего, что накоплено (количество записанных строк)"""
+        with self._flush_lock:
+            entries, rows = self._drain()
+            if not entries:
+                return 0
+            try:
+                self._execute(entries)
+                for writes, future in entries:
+                    future.set_result(len(writes))
+            except SQLAlchemyError as e:
+                # Пакет откатан целиком: повтор по одной операции, чтобы ошибка одной не теряла остальные
+                print(f"Ошибка группового коммита ({rows} строк), повтор по одной операции: {e}")
+                rows = 0
+                for entry in entries:
+                    writes, future = entry
+                    try:
+                        self._execute([entry])
+                        rows += len(writes)
+                        future.set_result(len(writes))
+                    except SQLAlchemyError as e:
+                        self.stats['errors'] += 1
+                        record_write_buffer_error(e)
+                        print(f"Ошибка отложенной записи: {e}")
+                        future.set_exception(e)
+            
+            self.stats['batches'] += 1
+            self.stats['rows'] += rows
+            self.stats['max_batch'] = max(self.stats['max_batch'], rows)
+            record_write_buffer_batch(rows)
+            return rows
+    
+    def _run(self):
+        """Цикл фонового потока: сброс по таймеру или по заполнению очереди"""
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+    
+    def start(self):
+        """Запуск фонового потока сброса (True - запущен сейчас)"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(target=self._run, name='write-buffer-flush', daemon=True)
+        self._thread.start()
+        return True
+    
+    def stop(self):
+        """Остановка фонового потока и запись оставшихся строк"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.flush()
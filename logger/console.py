@@ -10,10 +10,12 @@ import psutil
 import platform
 from collections import defaultdict
 
-from sqlalchemy import create_engine, Column, String, Float, Integer, DateTime, Text
+from sqlalchemy import Column, String, Float, Integer, DateTime, Text
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
 from sqlalchemy.exc import DatabaseError
 
+from database.engine import create_sqlite_engine
+
 Base = declarative_base()
 
 class PerformanceMetric(Base):
@@ -154,10 +156,9 @@ class CPUTracer:
         self.db_url = f"sqlite:///{self.db_path}"
         
         try:
-            self.engine = create_engine(
+            self.engine = create_sqlite_engine(
                 self.db_url,
                 connect_args={"check_same_thread": False},
-                echo=False,
                 pool_pre_ping=True
             )
             self.SessionLocal = sessionmaker(
@@ -2,17 +2,22 @@
 Экспортер метрик OpenTelemetry в SQLite
 """
 from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult, AggregationTemporality
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from pathlib import Path
 
 from logger.models import Base, FunctionMetric
+from database.engine import create_sqlite_engine
 
 class SQLiteMetricExporter(MetricExporter):
     """Экспортер метрик в SQLite"""
     
-    METRIC_TYPES = {'error': 'error', 'time': 'time', 'duration': 'time', 'call': 'call'}
+    METRIC_TYPES = {
+        'error': 'error', 'time': 'time', 'duration': 'time', 'call': 'call', 'hit': 'hit', 'miss': 'miss',
+        'size': 'size'
+    }
+    # Гистограммы без единиц времени: min/avg/max хранят сами значения (строки в пакете и т.п.)
+    VALUE_HISTOGRAM_TYPES = ('size',)
     
     def __init__(self, db_path=None):
         """Инициализация экспортера"""
@@ -22,7 +27,7 @@ class SQLiteMetricExporter(MetricExporter):
         self.db_path = str(db_path if db_path else self._get_default_db_path())
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
         
-        self.engine = create_engine(f'sqlite:///{self.db_path}', echo=False)
+        self.engine = create_sqlite_engine(f'sqlite:///{self.db_path}')
         Base.metadata.create_all(self.engine)
         self.SessionLocal = sessionmaker(bind=self.engine)
         
@@ -68,13 +73,13 @@ class SQLiteMetricExporter(MetricExporter):
         full_name = self._build_function_name(attrs)
         metric_type = self._get_metric_type(metric.name)
         
-        # Histogram (time)
+        # Histogram (time или size)
         if hasattr(point, 'count') and hasattr(point, 'sum'):
             calls = point.count
             total = round(point.sum, 4)
             return FunctionMetric(
                 function=full_name,
-                metric_type='time',
+                metric_type=metric_type if metric_type in self.VALUE_HISTOGRAM_TYPES else 'time',
                 timestamp=timestamp,
                 calls=calls,
                 avg_time=round(total / calls, 4) if calls > 0 else 0.0,
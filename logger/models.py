@@ -1,11 +1,12 @@
 """
 Модели для хранения метрик в SQLite
 """
-from sqlalchemy import Column, String, Float, DateTime, Integer, create_engine
+from sqlalchemy import Column, String, Float, DateTime, Integer
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from pathlib import Path
+from database.engine import create_sqlite_engine
 
 Base = declarative_base()
 
@@ -15,7 +16,7 @@ class FunctionMetric(Base):
     
     # Составной первичный ключ: function + metric_type + timestamp
     function = Column(String(300), primary_key=True, index=True)  # folder.module.function
-    metric_type = Column(String(20), primary_key=True)  # 'call', 'error', 'time'
+    metric_type = Column(String(20), primary_key=True)  # 'call', 'error', 'time', 'hit', 'miss', 'size'
     timestamp = Column(DateTime, primary_key=True, index=True, default=datetime.utcnow)
     
     # Метрики
@@ -30,6 +31,8 @@ class FunctionMetric(Base):
     def __repr__(self):
         if self.metric_type == 'time':
             return f"<{self.function}: avg={self.avg_time:.4f}s, calls={self.calls}>"
+        elif self.metric_type == 'size':
+            return f"<{self.function}: avg={self.avg_time:.1f}, max={self.max_time:.0f}, batches={self.calls}>"
         elif self.metric_type == 'error':
             return f"<{self.function}: errors={self.errors}, type={self.error_type}>"
         return f"<{self.function}: calls={self.calls}>"
@@ -52,7 +55,7 @@ def init_metrics_db(db_path=None, recreate=False):
         db_path = Path(db_path)
         db_path.parent.mkdir(parents=True, exist_ok=True)
         
-        engine = create_engine(f'sqlite:///{db_path}', echo=False)
+        engine = create_sqlite_engine(f'sqlite:///{db_path}')
         
         if recreate:
             Base.metadata.drop_all(engine)
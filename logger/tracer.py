@@ -43,6 +43,10 @@ meter = metrics.get_meter(__name__)
 call_counter = meter.create_counter("function_calls", description="Total calls")
 error_counter = meter.create_counter("function_errors", description="Total errors")
 time_histogram = meter.create_histogram("function_time", description="Execution time (sec)")
+cache_hit_counter = meter.create_counter("cache_hits", description="Cache hits")
+cache_miss_counter = meter.create_counter("cache_misses", description="Cache misses")
+write_buffer_depth = meter.create_up_down_counter("write_buffer_depth", description="Rows waiting in write buffer")
+write_buffer_batch = meter.create_histogram("write_buffer_batch_size", description="Rows per group commit")
 
 # ============= Декоратор =============
 
@@ -76,6 +80,53 @@ def trace(func):
     
     return wrapper
 
+# ============= Кэш =============
+
+# Попадания и промахи в текущем процессе: {имя кэша: [попадания, промахи]}
+_cache_totals = {}
+
+def record_cache_access(cache_name, hit):
+    """Учёт попадания или промаха кэша"""
+    attrs = {"module": "cache", "function": cache_name}
+    totals = _cache_totals.setdefault(cache_name, [0, 0])
+    if hit:
+        totals[0] += 1
+        cache_hit_counter.add(1, attrs)
+    else:
+        totals[1] += 1
+        cache_miss_counter.add(1, attrs)
+
+def cache_stats():
+    """Попадания и промахи кэшей с начала работы процесса: {имя: {'hits', 'misses'}}"""
+    return {name: {'hits': hits, 'misses': misses} for name, (hits, misses) in _cache_totals.items()}
+
+def record_statement_cache(status):
+    """Учёт кэша скомпилированных SQL-выражений SQLAlchemy
+    
+    status - 'hit', 'miss' или причина, по которой выражение не кэшируется
+    """
+    # Причина некэшируемости входит в имя: экспортер различает записи только по функции и типу
+    function = "statement_cache" if status in ('hit', 'miss') else f"statement_cache_{status}"
+    attrs = {"module": "sqlalchemy", "function": function}
+    if status == 'hit':
+        cache_hit_counter.add(1, attrs)
+    else:
+        cache_miss_counter.add(1, attrs)
+
+# ============= Буфер записи =============
+
+def record_write_buffer_depth(delta):
+    """Изменение количества строк в очереди буфера записи"""
+    write_buffer_depth.add(delta, {"module": "database", "function": "write_buffer"})
+
+def record_write_buffer_batch(rows):
+    """Размер пакета, записанного одним коммитом"""
+    write_buffer_batch.record(rows, {"module": "database", "function": "write_buffer"})
+
+def record_write_buffer_error(error):
+    """Отложенная запись, которая не удалась и при повторе: тот же счётчик ошибок, что у @trace"""
+    error_counter.add(1, {"module": "database", "function": "write_buffer", "error": type(error).__name__})
+
 # ============= Утилиты =============
 
 def flush():
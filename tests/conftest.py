@@ -0,0 +1,48 @@
+"""
+Общие фикстуры тестов: база данных во временном файле
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# database.database создаёт глобальный db при импорте: до импорта он направляется во временный каталог
+import database.settings as settings
+
+_TMP = Path(tempfile.mkdtemp(prefix='webva-tests-'))
+settings.DATABASE_PATH = _TMP / 'users.db'
+settings.DATABASE_URL = f"sqlite:///{settings.DATABASE_PATH}"
+settings.MEDIA_ROOT = _TMP / 'media'
+
+from database.database import Database
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Пустая база без буфера записи"""
+    db = Database(f"sqlite:///{tmp_path / 'test.db'}", write_buffer=False)
+    yield db
+    db.engine.dispose()
+
+
+@pytest.fixture
+def make_user(database):
+    """Регистрация пользователя: make_user('Ученик', city=...) -> id"""
+    counter = iter(range(1, 10 ** 6))
+    
+    def make(role='Ученик', **fields):
+        number = next(counter)
+        data = {
+            'email': f'user{number}@example.com', 'password': 'secret',
+            'first_name': f'Имя{number}', 'last_name': 'Фамилия', 'role': role,
+            'city': 'Москва', 'school': 'Школа №1', 'class_number': '10А', **fields
+        }
+        success, user_id = database.register_user(data)
+        assert success, user_id
+        return user_id
+    
+    return make
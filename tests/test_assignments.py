@@ -0,0 +1,81 @@
+"""
+Создание заданий классу и рассылка уведомлений ученикам
+"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+
+def _create(database, teacher_id, **options):
+    return database.create_class_assignment(
+        teacher_id, 'Контрольная', 'Описание', 'Математика', 'Дроби', 'Средний', 'test', '[]',
+        'Москва', 'Школа №1', '10А', **options
+    )
+
+
+def _count(database, table):
+    with database.engine.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+
+def _unread(database, user_id):
+    with database.engine.connect() as conn:
+        return conn.execute(
+            text("SELECT unread_notifications FROM users WHERE id = :id"), {'id': user_id}
+        ).scalar()
+
+
+@pytest.fixture
+def classroom(make_user):
+    teacher_id = make_user('Учитель', subjects='Математика')
+    students = [make_user() for _ in range(3)]
+    make_user(class_number='11Б')
+    return teacher_id, students
+
+
+def _fail(*args, **kwargs):
+    raise OperationalError('INSERT INTO notifications', {}, Exception('disk I/O error'))
+
+
+def test_notifications_are_written_with_the_assignment(database, classroom):
+    teacher_id, students = classroom
+    
+    success, _ = _create(database, teacher_id)
+    
+    assert success
+    assert _count(database, 'notifications') == len(students)
+    assert [_unread(database, student_id) for student_id in students] == [1, 1, 1]
+
+
+def test_failed_fan_out_rolls_back_the_assignment(database, classroom, monkeypatch):
+    teacher_id, _ = classroom
+    monkeypatch.setattr(database, '_insert_student_notifications', _fail)
+    
+    success, _ = _create(database, teacher_id)
+    
+    assert not success
+    assert _count(database, 'class_assignments') == 0
+
+
+def test_background_fan_out_runs_after_commit(database, classroom):
+    teacher_id, students = classroom
+    
+    success, _ = _create(database, teacher_id, notify_in_background=True)
+    # Задачи фонового потока выполняются по очереди: пустая задача дожидается рассылки
+    database.run_in_background(lambda: None).result(timeout=10)
+    
+    assert success
+    assert _count(database, 'notifications') == len(students)
+    assert [_unread(database, student_id) for student_id in students] == [1, 1, 1]
+
+
+def test_background_fan_out_failure_keeps_the_assignment(database, classroom, monkeypatch):
+    teacher_id, _ = classroom
+    monkeypatch.setattr(database, '_insert_student_notifications', _fail)
+    
+    success, _ = _create(database, teacher_id, notify_in_background=True)
+    database.run_in_background(lambda: None).result(timeout=10)
+    
+    assert success
+    assert _count(database, 'class_assignments') == 1
+    assert _count(database, 'notifications') == 0
@@ -0,0 +1,50 @@
+"""
+Кэш чтения: запасные значения при ошибках и сброс во время чтения
+"""
+from sqlalchemy import text
+
+from database.cache import TTLCache, cached
+
+
+def test_error_fallback_is_not_cached(database, make_user):
+    make_user('Учитель', subjects='Физика')
+    with database.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE teacher_subjects RENAME TO teacher_subjects_moved"))
+    
+    assert database.get_teachers('Физика') == []
+    
+    with database.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE teacher_subjects_moved RENAME TO teacher_subjects"))
+    
+    assert len(database.get_teachers('Физика')) == 1
+
+
+def test_store_is_skipped_after_invalidate():
+    cache = TTLCache('test')
+    generation = cache.generation
+    cache.invalidate(('key',))
+    
+    assert cache.set(('key',), 'stale', generation) is False
+    assert cache.get(('key',)) == (False, None)
+
+
+class _Reader:
+    """Чтение, во время которого параллельная запись сбрасывает кэш"""
+    
+    def __init__(self):
+        self.caches = {'values': TTLCache('values')}
+        self.version = 0
+    
+    @cached('values')
+    def load(self, key):
+        value = self.version
+        self.version += 1
+        self.caches['values'].invalidate((key,))
+        return value
+
+
+def test_read_racing_with_invalidate_is_not_stored():
+    reader = _Reader()
+    
+    assert reader.load('a') == 0
+    assert reader.load('a') == 1
@@ -0,0 +1,9 @@
+"""
+Планы частых запросов на схеме после миграций
+"""
+from database.diagnostics import assert_hot_queries_use_indexes
+
+
+def test_hot_queries_use_indexes(database):
+    assert assert_hot_queries_use_indexes(database.engine)
+
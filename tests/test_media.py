@@ -0,0 +1,74 @@
+"""
+Файлы записей звонков и уроков в каталоге медиа
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+import database.settings as settings
+
+
+@pytest.fixture
+def call(database, make_user):
+    """Активный звонок: (id звонка, id ученика, id учителя)"""
+    teacher_id = make_user('Учитель', subjects='Математика')
+    student_id = make_user()
+    success, call_id = database.create_call(student_id, teacher_id, datetime.utcnow())
+    assert success
+    database.start_call(call_id)
+    return call_id, student_id, teacher_id
+
+
+def _recording(database, call_id):
+    with database.engine.connect() as conn:
+        return conn.execute(text("SELECT recording_path FROM calls WHERE id = :id"), {'id': call_id}).scalar()
+
+
+def _video(name):
+    path = settings.MEDIA_ROOT / 'recordings' / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'video')
+    return path
+
+
+@pytest.mark.parametrize('given, stored', [
+    ('/recordings/call.mp4', '/recordings/call.mp4'),
+    (str(settings.MEDIA_ROOT / 'recordings' / 'call.mp4'), '/recordings/call.mp4'),
+    ('../outside/call.mp4', '../outside/call.mp4'),
+])
+def test_end_call_keeps_recording_path(database, call, given, stored):
+    call_id, _, _ = call
+    
+    success, _ = database.end_call(call_id, given)
+    
+    assert success
+    assert _recording(database, call_id) == stored
+
+
+def test_delete_user_removes_lesson_videos(database, call):
+    call_id, student_id, teacher_id = call
+    recording = _video('deleted_user_call.mp4')
+    lesson_video = _video('deleted_user_lesson.mp4')
+    database.end_call(call_id, '/recordings/deleted_user_call.mp4')
+    database.create_lesson_record(student_id, teacher_id, 'Урок', datetime.utcnow(),
+                                  video_file_path='/recordings/deleted_user_lesson.mp4')
+    email = database.get_user_by_id(student_id)['email']
+    
+    success, _ = database.delete_user(student_id, email, 'secret')
+    
+    assert success
+    assert not recording.exists()
+    assert not lesson_video.exists()
+
+
+def test_failed_delete_keeps_videos(database, call):
+    call_id, student_id, _ = call
+    recording = _video('kept_call.mp4')
+    database.end_call(call_id, '/recordings/kept_call.mp4')
+    email = database.get_user_by_id(student_id)['email']
+    
+    success, _ = database.delete_user(student_id, email, 'wrong')
+    
+    assert not success
+    assert recording.exists()
@@ -0,0 +1,62 @@
+"""
+Статус онлайн по users.last_seen
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from database.database import Database
+
+
+def _online(database, student_id):
+    return {student['id']: student['is_online'] for student in database.get_all_students()}[student_id]
+
+
+def test_stale_is_online_flag_is_ignored(database, make_user):
+    student_id = make_user()
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE users SET is_online = 1 WHERE id = :id"), {'id': student_id})
+    
+    assert _online(database, student_id) is False
+
+
+def test_heartbeat_is_visible_to_other_process_after_flush(database, make_user):
+    student_id = make_user()
+    other = Database(str(database.engine.url), write_buffer=False)
+    
+    database.update_user_online_status(student_id, True)
+    assert _online(database, student_id) is True
+    assert _online(other, student_id) is False
+    
+    database.flush_presence()
+    assert _online(other, student_id) is True
+    other.engine.dispose()
+
+
+def test_last_seen_older_than_ttl_is_offline(database, make_user):
+    student_id = make_user()
+    old = datetime.utcnow() - timedelta(seconds=database.presence.ttl + 5)
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE users SET last_seen = :seen WHERE id = :id"), {'seen': old, 'id': student_id})
+    
+    assert _online(database, student_id) is False
+
+
+def test_logout_clears_last_seen(database, make_user):
+    student_id = make_user()
+    database.update_user_online_status(student_id, True)
+    database.flush_presence()
+    
+    database.update_user_online_status(student_id, False)
+    assert _online(database, student_id) is False
+    database.flush_presence()
+    with database.engine.connect() as conn:
+        assert conn.execute(text("SELECT last_seen FROM users WHERE id = :id"), {'id': student_id}).scalar() is None
+
+
+def test_teacher_list_reports_presence(database, make_user):
+    teacher_id = make_user('Учитель', subjects='Физика')
+    database.update_user_online_status(teacher_id, True)
+    database.flush_presence()
+    
+    assert [teacher['is_online'] for teacher in database.get_teachers('Физика')] == [True]
@@ -0,0 +1,40 @@
+"""
+Статистика по классу
+"""
+
+
+def _assign(database, teacher_id, class_number='10А'):
+    success, assignment_id = database.create_class_assignment(
+        teacher_id, 'Контрольная', 'Описание', 'Математика', 'Дроби', 'Средний', 'test', '[]',
+        'Москва', 'Школа №1', class_number
+    )
+    assert success, assignment_id
+    return assignment_id
+
+
+def test_empty_class_has_the_same_keys(database, make_user):
+    teacher_id = make_user('Учитель', subjects='Математика')
+    _assign(database, teacher_id, '11Б')
+    
+    assert database.get_class_statistics(teacher_id, class_number='10А') == {
+        'total_assignments': 0, 'students': [], 'assignments': []
+    }
+
+
+def test_class_statistics_by_student_and_assignment(database, make_user):
+    teacher_id = make_user('Учитель', subjects='Математика')
+    first, second = make_user(), make_user()
+    assignment_id = _assign(database, teacher_id)
+    _assign(database, teacher_id, '11Б')
+    database.submit_assignment(assignment_id, first, '[]', 8, 10, time_spent=60)
+    database.submit_assignment(assignment_id, second, '[]', 4, 10, time_spent=120)
+    
+    stats = database.get_class_statistics(teacher_id, city='Москва', class_number='10А')
+    
+    assert stats['total_assignments'] == 1
+    assert [(s['student_id'], s['avg_percentage'], s['total_time']) for s in stats['students']] == [
+        (first, 80, 60), (second, 40, 120)
+    ]
+    assert [(a['assignment_id'], a['total_submissions'], a['avg_percentage'], a['avg_time'])
+            for a in stats['assignments']] == [(assignment_id, 2, 60, 90)]
+    assert database.get_class_statistics(teacher_id)['total_assignments'] == 2
@@ -0,0 +1,12 @@
+"""
+Предметы учителя в teacher_subjects
+"""
+
+
+def test_registration_fills_teacher_subjects(database, make_user):
+    teacher_id = make_user('Учитель', subjects='Физика, Математика, Физика')
+    
+    assert [teacher['id'] for teacher in database.get_teachers('Математика')] == [teacher_id]
+    assert database.get_teacher_subject_facets() == [
+        {'subject': 'Математика', 'count': 1}, {'subject': 'Физика', 'count': 1}
+    ]
@@ -0,0 +1,52 @@
+"""
+Уведомления через буфер группового коммита
+"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from database.database import Database
+
+
+@pytest.fixture
+def buffered(database):
+    """База с буфером записи; пакеты сбрасываются вручную через write_buffer.flush()"""
+    db = Database(str(database.engine.url), write_buffer=True)
+    db.write_buffer.stop()
+    yield db
+    db.engine.dispose()
+
+
+def test_create_notification_returns_id_with_buffer(buffered, make_user):
+    user_id = make_user()
+    
+    success, notification_id = buffered.create_notification(user_id, 'Заголовок', 'Текст')
+    
+    assert success
+    assert isinstance(notification_id, int)
+
+
+def test_failed_entry_fails_only_its_future(buffered, make_user):
+    user_id = make_user()
+    missing_user_id = user_id + 1000
+    
+    first = buffered.enqueue_notification(user_id, 'Первое', 'Текст')
+    broken = buffered.enqueue_notification(missing_user_id, 'Удалённому', 'Текст')
+    last = buffered.enqueue_notification(user_id, 'Второе', 'Текст')
+    buffered.write_buffer.flush()
+    
+    assert first.exception(timeout=1) is None
+    assert last.exception(timeout=1) is None
+    assert isinstance(broken.exception(timeout=1), IntegrityError)
+    with buffered.engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM notifications")).scalar() == 2
+    assert buffered.get_unread_notifications_count(user_id) == 2
+
+
+def test_enqueue_without_buffer_writes_immediately(database, make_user):
+    user_id = make_user()
+    
+    future = database.enqueue_notification(user_id, 'Заголовок', 'Текст')
+    
+    assert isinstance(future.result(timeout=1), int)
+    assert database.get_unread_notifications_count(user_id) == 1